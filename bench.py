@@ -0,0 +1,900 @@
+# Micro-benchmarks for the Brewin front end and interpreter.
+#
+# usage: python bench.py [benchmark ...]     (no arguments runs all of them)
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import brewparse
+from element import Element, Node
+
+
+# a large straight-line program: n assignment statements with nested arithmetic
+def generate_program(n):
+    lines = ["func main() : void {", "  var x: int;", "  var y: int;"]
+    for i in range(n):
+        lines.append(f"  x = (x + {i}) * 2 - y / 3;")
+        lines.append(f"  if (x > {i}) {{ y = y + 1; }} else {{ y = y - 1; }}")
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def best_of(f, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def peak_memory(build):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    result = build()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, result
+
+
+# --- AST node representation -------------------------------------------------
+
+
+# rebuild a Node tree with the old dict-backed Element class
+def to_element(v):
+    if isinstance(v, Node):
+        return Element(v.elem_type, **{key: to_element(getattr(v, key)) for key in v._fields})
+    if isinstance(v, list):
+        return [to_element(i) for i in v]
+    return v
+
+
+def clone_nodes(v):
+    if isinstance(v, Node):
+        return v.__class__(*[clone_nodes(getattr(v, key)) for key in v.init_args])
+    if isinstance(v, list):
+        return [clone_nodes(i) for i in v]
+    return v
+
+
+def walk_get(node):
+    count = 1
+    for key in ("structs", "functions", "statements", "else_statements", "args",
+                "condition", "expression", "op1", "op2", "init", "update"):
+        child = node.get(key)
+        if child is None:
+            continue
+        if isinstance(child, list):
+            for c in child:
+                count += walk_get(c)
+        elif not isinstance(child, str):
+            count += walk_get(child)
+    return count
+
+
+def bench_nodes():
+    source = generate_program(5000)
+    ast = brewparse.parse_program(source)
+
+    # both trees are built by the same kind of recursive copy so the peaks are comparable
+    element_bytes, elements = peak_memory(lambda: to_element(ast))
+    node_bytes, _ = peak_memory(lambda: clone_nodes(ast))
+    print(f"nodes: {walk_get(ast)} per tree")
+    print(f"memory  Element: {element_bytes / 1e6:8.2f} MB")
+    print(f"memory  Node   : {node_bytes / 1e6:8.2f} MB")
+
+    element_time = best_of(lambda: walk_get(elements))
+    node_time = best_of(lambda: walk_get(ast))
+    print(f"get()   Element: {element_time * 1e3:8.2f} ms")
+    print(f"get()   Node   : {node_time * 1e3:8.2f} ms")
+
+    binops = [n for n in _iter_nodes(ast) if n.elem_type in ("+", "-", "*", "/", ">")]
+    binop_elements = [to_element(n) for n in binops]
+    element_time = best_of(lambda: [(e.get("op1"), e.get("op2")) for e in binop_elements])
+    node_time = best_of(lambda: [(n.op1, n.op2) for n in binops])
+    print(f"fields  Element.get(): {element_time * 1e3:8.2f} ms for {len(binops)} binops")
+    print(f"fields  Node.attr    : {node_time * 1e3:8.2f} ms for {len(binops)} binops")
+
+
+def _iter_nodes(v):
+    if isinstance(v, Node):
+        yield v
+        for key in v._fields:
+            yield from _iter_nodes(getattr(v, key))
+    elif isinstance(v, list):
+        for i in v:
+            yield from _iter_nodes(i)
+
+
+# --- lexer ------------------------------------------------------------------
+
+
+# a program whose bulk is block comments, like the /* OUT ... */ trailers in our tests
+def generate_commented_program(n):
+    lines = ["func main() : void {"]
+    for i in range(n):
+        body = "\n".join(f"  line {j} of comment {i}: x = x + 1; print(x);" for j in range(20))
+        lines.append(f"/*\n{body}\n*/")
+        lines.append(f'  print("step {i}");')
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def lex_all(lexer, source):
+    lexer.lineno = 1
+    lexer.input(source)
+    count = 0
+    while lexer.token() is not None:
+        count += 1
+    return count
+
+
+def bench_lexer():
+    import brewlex
+    import brewscan
+
+    for label, source in (
+        ("generated", generate_program(20000)),
+        ("comment-heavy", generate_commented_program(2000)),
+    ):
+        ply_lexer = brewlex.lexer.clone()
+        scanner = brewscan.Lexer()
+        count = lex_all(scanner, source)
+        ply_time = best_of(lambda: lex_all(ply_lexer, source), repeat=3)
+        scan_time = best_of(lambda: lex_all(scanner, source), repeat=3)
+        mb = len(source) / 1e6
+        print(f"{label}: {mb:.1f} MB, {count} tokens")
+        print(f"  PLY lex  : {ply_time * 1e3:8.1f} ms  {mb / ply_time:6.2f} MB/s")
+        print(f"  brewscan : {scan_time * 1e3:8.1f} ms  {mb / scan_time:6.2f} MB/s")
+
+    source = generate_program(5000)
+    ply_time = best_of(lambda: brewparse.Parser(fast_lexer=False).parse(source), repeat=3)
+    scan_time = best_of(lambda: brewparse.Parser().parse(source), repeat=3)
+    print(f"parse_program, PLY lexer : {ply_time * 1e3:8.1f} ms")
+    print(f"parse_program, brewscan  : {scan_time * 1e3:8.1f} ms")
+
+
+# --- file input -------------------------------------------------------------
+
+
+def bench_mmap():
+    import mmap
+
+    import brewscan
+
+    path = os.path.join(os.environ.get("TMPDIR", "/tmp"), f"brewin_bench_{os.getpid()}.br")
+    with open(path, "w") as f:
+        f.write(generate_program(20000))
+    try:
+        size = os.path.getsize(path)
+
+        def lex_str():
+            with open(path) as f:
+                return lex_all(brewscan.Lexer(), f.read())
+
+        def lex_mmap():
+            with open(path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as source:
+                    return lex_all(brewscan.Lexer(), source)
+
+        def parse_str():
+            with open(path) as f:
+                return brewparse.parse_program(f.read())
+
+        print(f"source: {size / 1e6:.1f} MB")
+        for label, run in (
+            ("lex   read() + str ", lex_str),
+            ("lex   mmap + bytes ", lex_mmap),
+            ("parse parse_program", parse_str),
+            ("parse parse_file   ", lambda: brewparse.parse_file(path)),
+        ):
+            peak, _ = peak_memory(run)
+            elapsed = best_of(run, repeat=3)
+            print(f"{label}: peak {peak / 1e6:8.2f} MB  {elapsed * 1e3:8.1f} ms")
+    finally:
+        os.remove(path)
+
+
+# --- struct field access ----------------------------------------------------
+
+
+# build an n-node linked list, then walk it with x = x.next and sum the fields
+def generate_list_program(n, walks):
+    return f"""
+struct node {{ val: int; next: node; }}
+func main() : void {{
+  var head: node;
+  var x: node;
+  var i: int;
+  var w: int;
+  var total: int;
+  for (i = 0; i < {n}; i = i + 1) {{
+    x = new node;
+    x.val = i;
+    x.next = head;
+    head = x;
+  }}
+  for (w = 0; w < {walks}; w = w + 1) {{
+    x = head;
+    for (i = 0; i < {n}; i = i + 1) {{
+      total = total + x.val + x.next.val * 0;
+      x = x.next;
+      if (i == {n} - 2) {{ i = {n}; }}
+    }}
+  }}
+  print(total);
+}}
+"""
+
+
+def run_quietly(interpreter, source, **kwargs):
+    import contextlib
+    import io
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        interpreter.run(source, **kwargs)
+
+
+def bench_fields():
+    import contextlib
+    import io
+
+    with contextlib.redirect_stdout(io.StringIO()):  # interpreterv3 runs a demo on import
+        import interpreterv3
+
+    source = generate_list_program(200, 20)
+    interpreter = interpreterv3.Interpreter(console_output=False)
+    run_quietly(interpreter, source)  # warm the parse
+    elapsed = best_of(lambda: run_quietly(interpreter, source), repeat=3)
+    print(f"linked list walk, 200 nodes x 20: {elapsed * 1e3:8.1f} ms")
+
+
+# a linked list built one cons call per node, kept alive until main returns
+CONS_PROGRAM = """
+struct node {{ val: int; next: node; }}
+func cons(v: int, rest: node) : node {{
+  var n: node;
+  n = new node;
+  n.val = v;
+  n.next = rest;
+  return n;
+}}
+func main() : void {{
+  var head: node;
+  var i: int;
+  for (i = 0; i < {n}; i = i + 1) {{ head = cons(i, head); }}
+  print(i);
+}}
+"""
+
+
+STRUCTS_SNIPPET = (
+    "import contextlib, io, resource, sys, time\n"
+    "sys.setrecursionlimit(10000)\n"
+    "with contextlib.redirect_stdout(io.StringIO()): import interpreterv3\n"
+    "source = sys.stdin.read()\n"
+    "start = time.perf_counter()\n"
+    "interpreterv3.Interpreter(console_output=False).run(source, backend=sys.argv[1])\n"
+    "print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)\n"
+)
+
+
+# peak resident memory (KiB) and run time of source, in a fresh interpreter
+def run_in_child(source, backend):
+    out = subprocess.run(
+        [sys.executable, "-c", STRUCTS_SNIPPET, backend],
+        input=source,
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    elapsed, max_rss = out.stdout.split()
+    return float(elapsed), int(max_rss)
+
+
+def bench_structs(n=1000000, backend="vm"):
+    _, base = run_in_child(CONS_PROGRAM.format(n=0), backend)
+    elapsed, max_rss = run_in_child(CONS_PROGRAM.format(n=n), backend)
+    print(
+        f"{n} nodes ({backend}): peak RSS {max_rss / 1024:6.1f} MiB, "
+        f"{(max_rss - base) * 1024 / n:5.1f} bytes/node, {elapsed:5.2f} s"
+    )
+
+
+# a struct per call that never leaves it: the StructPool recycles it when the call returns
+TEMP_STRUCT_PROGRAM = """
+struct point { x: int; y: int; }
+func dist(a: int, b: int) : int {
+  var p: point;
+  p = new point;
+  p.x = a;
+  p.y = b;
+  return p.x * p.x + p.y * p.y;
+}
+func main() : void {
+  var i: int;
+  var total: int;
+  for (i = 0; i < 5000; i = i + 1) { total = total + dist(i, 3); }
+  print(total);
+}
+"""
+
+
+# the cons list escapes every call, so the pool only counts its allocations
+def bench_pool(backends=("tree", "closure", "vm")):
+    import contextlib
+    import io
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import interpreterv3
+    from brewpool import StructPool
+
+    for label, source in (("temp structs", TEMP_STRUCT_PROGRAM), ("cons 20000", CONS_PROGRAM.format(n=20000))):
+        for backend in backends:
+            plain = time_backend(source, backend, repeat=5)
+            pool = StructPool()
+            pooled = interpreterv3.Interpreter(console_output=False, struct_pool=pool)
+            run_quietly(pooled, source, backend=backend)
+            elapsed = best_of(lambda: run_quietly(pooled, source, backend=backend), repeat=5)
+            print(
+                f"{label} {backend:8}: {plain * 1e3:6.1f} ms, pooled {elapsed * 1e3:6.1f} ms; {pool.report()}"
+            )
+
+
+# --- execution backends -----------------------------------------------------
+
+LOOP_PROGRAM = """
+func main() : void {
+  var i: int;
+  var j: int;
+  var total: int;
+  for (i = 0; i < 300; i = i + 1) {
+    for (j = 0; j < 100; j = j + 1) {
+      if (j / 2 * 2 == j) { total = total + i * j; } else { total = total - 1; }
+    }
+  }
+  print(total);
+}
+"""
+
+RECURSION_PROGRAM = """
+func fib(n: int) : int {
+  if (n < 2) { return n; }
+  return fib(n - 1) + fib(n - 2);
+}
+func fact(n: int) : int {
+  if (n <= 1) { return 1; }
+  return n * fact(n - 1);
+}
+func main() : void {
+  var i: int;
+  print(fib(18));
+  for (i = 0; i < 50; i = i + 1) { fact(200); }
+}
+"""
+
+# variables read from blocks nested several levels below their declaration
+NESTED_PROGRAM = """
+func main() : void {
+  var a: int;
+  var b: int;
+  var c: int;
+  var total: int;
+  for (a = 0; a < 20; a = a + 1) {
+    for (b = 0; b < 20; b = b + 1) {
+      if (a != b) {
+        for (c = 0; c < 20; c = c + 1) {
+          if (c > a) {
+            if (c > b) { total = total + a + b + c; }
+          }
+        }
+      }
+    }
+  }
+  print(total);
+}
+"""
+
+BACKEND_PROGRAMS = {
+    "loops": LOOP_PROGRAM,
+    "recursion": RECURSION_PROGRAM,
+    "nested": NESTED_PROGRAM,
+    "linked list": generate_list_program(200, 20),
+}
+
+
+def time_backend(source, backend, repeat=3):
+    import contextlib
+    import io
+
+    with contextlib.redirect_stdout(io.StringIO()):  # interpreterv3 runs a demo on import
+        import interpreterv3
+
+    interpreter = interpreterv3.Interpreter(console_output=False)
+    run_quietly(interpreter, source, backend=backend)  # warm the parse
+    return best_of(lambda: run_quietly(interpreter, source, backend=backend), repeat=repeat)
+
+
+def bench_backends(backends=("tree", "closure", "vm")):
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    for label, source in BACKEND_PROGRAMS.items():
+        times = {backend: time_backend(source, backend) for backend in backends}
+        base = times[backends[0]]
+        line = "  ".join(
+            f"{backend} {elapsed * 1e3:7.1f} ms ({base / elapsed:4.1f}x)"
+            for backend, elapsed in times.items()
+        )
+        print(f"{label:12}: {line}")
+
+
+# Value objects built per run: every Value.__init__ call is one allocation
+def count_values(source, backend):
+    import contextlib
+    import io
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import interpreterv3
+    from type_valuev2 import Value
+
+    interpreter = interpreterv3.Interpreter(console_output=False)
+    run_quietly(interpreter, source, backend=backend)
+    init = Value.__init__
+    count = 0
+
+    def counting_init(self, *args):
+        nonlocal count
+        count += 1
+        init(self, *args)
+
+    Value.__init__ = counting_init
+    try:
+        run_quietly(interpreter, source, backend=backend)
+    finally:
+        Value.__init__ = init
+    return count
+
+
+def bench_values(backends=("tree", "closure", "vm")):
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    for label in ("loops", "nested", "recursion"):
+        source = BACKEND_PROGRAMS[label]
+        line = "  ".join(
+            f"{backend} {count_values(source, backend):7d} values {time_backend(source, backend, repeat=5) * 1e3:6.1f} ms"
+            for backend in backends
+        )
+        print(f"{label:10}: {line}")
+
+
+def bench_typecheck(backends=("tree", "closure")):
+    import contextlib
+    import io
+
+    with contextlib.redirect_stdout(io.StringIO()):  # interpreterv3 runs a demo on import
+        import interpreterv3
+    import brewcheck
+
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    # every run re-parses (no AST cache), so a run without the pass has no annotations
+    # left behind; the times include the pass itself
+    interpreter = interpreterv3.Interpreter(console_output=False)
+    for label, source in BACKEND_PROGRAMS.items():
+        line = []
+        for backend in backends:
+            unchecked = time_backend(source, backend)
+            checked = best_of(lambda: run_quietly(interpreter, source, backend=backend, check_types=True), repeat=3)
+            line.append(f"{backend} {unchecked * 1e3:7.1f} -> {checked * 1e3:7.1f} ms ({unchecked / checked:4.2f}x)")
+        print(f"{label:12}: {'  '.join(line)}")
+
+    # cost of the pass itself
+    interpreter = interpreterv3.Interpreter(console_output=False)
+    ast = brewparse.parse_program(generate_program(2000))
+    interpreter.structs, interpreter.struct_layouts = {}, {}
+    interpreter.func_name_to_ast = {"main": {0: ast.functions[0]}}
+    interpreterv3.resolve(ast, {}, {})
+    elapsed = best_of(lambda: brewcheck.check(ast, interpreter))
+    print(f"check 4000-statement program: {elapsed * 1e3:7.1f} ms")
+
+
+# tail-recursive functions: a counter, and a pair of mutually recursive ones
+TAIL_CALL_PROGRAM = """
+func sum(n: int, acc: int) : int {{
+  if (n == 0) {{ return acc; }}
+  return sum(n - 1, acc + n);
+}}
+func even(n: int) : bool {{
+  if (n == 0) {{ return true; }}
+  return odd(n - 1);
+}}
+func odd(n: int) : bool {{
+  if (n == 0) {{ return false; }}
+  return even(n - 1);
+}}
+func main() : void {{
+  var i: int;
+  for (i = 0; i < {repeat}; i = i + 1) {{ sum({depth}, 0); even({depth}); }}
+  print(sum({depth}, 0));
+}}
+"""
+
+
+def bench_tailcalls(backends=("tree", "closure", "vm")):
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    source = TAIL_CALL_PROGRAM.format(depth=300, repeat=20)
+    line = "  ".join(f"{backend} {time_backend(source, backend) * 1e3:7.1f} ms" for backend in backends)
+    print(f"depth 300 x 20: {line}")
+
+    # far deeper than the Python stack allows without tail calls
+    source = TAIL_CALL_PROGRAM.format(depth=100000, repeat=0)
+    for backend in backends:
+        try:
+            elapsed = time_backend(source, backend, repeat=1)
+            print(f"depth 100000 {backend:8}: {elapsed * 1e3:7.1f} ms")
+        except RecursionError:
+            print(f"depth 100000 {backend:8}: RecursionError")
+
+
+# many calls from one call site, with parameters of several types
+CALL_PROGRAM = """
+struct box { v: int; }
+func f(a: int, b: int, c: bool, d: box) : int { return a; }
+func main() : void {
+  var i: int; var t: int; var x: box;
+  x = new box;
+  for (i = 0; i < 10000; i = i + 1) { t = t + f(i, t, true, x); }
+  print(t);
+}
+"""
+
+
+def bench_calls(backends=("tree", "closure", "vm")):
+    line = "  ".join(f"{backend} {time_backend(CALL_PROGRAM, backend, repeat=7) * 1e3:7.1f} ms" for backend in backends)
+    print(f"10000 calls: {line}")
+
+
+# non-tail recursion: counting down, and building and summing a linked list recursively
+DEEP_RECURSION_PROGRAM = """
+struct node {{
+  val: int;
+  next: node;
+}}
+func count(n: int) : int {{
+  if (n == 0) {{ return 0; }}
+  return 1 + count(n - 1);
+}}
+func build(n: int) : node {{
+  var head: node;
+  if (n == 0) {{ return nil; }}
+  head = new node;
+  head.val = n;
+  head.next = build(n - 1);
+  return head;
+}}
+func total(l: node) : int {{
+  if (l == nil) {{ return 0; }}
+  return l.val + total(l.next);
+}}
+func main() : void {{
+  var x: int;
+  var l: node;
+  x = count({depth});
+  l = build({depth});
+  print(total(l));
+}}
+"""
+
+
+def bench_deep(backends=("tree", "closure", "vm")):
+    # the tree walker and the closures recurse in Python for every Brewin call
+    # (and several times per call); the VM only grows its own list of frames
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    for depth in (300, 3000, 30000, 100000):
+        source = DEEP_RECURSION_PROGRAM.format(depth=depth)
+        results = []
+        for backend in backends:
+            try:
+                elapsed = time_backend(source, backend, repeat=1 if depth > 1000 else 3)
+                results.append(f"{backend} {elapsed * 1e3:8.1f} ms")
+            except RecursionError:
+                results.append(f"{backend} {'RecursionError':>14}")
+        print(f"depth {depth:6}: {'  '.join(results)}")
+
+
+# exponential recursions over ints
+MEMO_PROGRAMS = {
+    "fib": """
+func fib(n: int) : int {{
+  if (n < 2) {{ return n; }}
+  return fib(n - 1) + fib(n - 2);
+}}
+func main() : void {{ print(fib({n})); }}
+""",
+    "catalan": """
+func catalan(n: int) : int {{
+  var i: int;
+  var total: int;
+  if (n <= 1) {{ return 1; }}
+  for (i = 0; i < n; i = i + 1) {{ total = total + catalan(i) * catalan(n - 1 - i); }}
+  return total;
+}}
+func main() : void {{ print(catalan({n})); }}
+""",
+}
+
+
+def bench_memo(backends=("tree", "closure", "vm")):
+    import contextlib
+    import io
+
+    with contextlib.redirect_stdout(io.StringIO()):  # interpreterv3 runs a demo on import
+        import interpreterv3
+    import brewmemo
+
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    for label, n, memo_n in (("fib", 20, 300), ("catalan", 10, 100)):
+        for backend in backends:
+            source = MEMO_PROGRAMS[label].format(n=n)
+            plain = interpreterv3.Interpreter(console_output=False)
+            memo = brewmemo.MemoCache()
+            memoized = interpreterv3.Interpreter(console_output=False, memo_cache=memo)
+            off = best_of(lambda: run_quietly(plain, source, backend=backend), repeat=3)
+            on = best_of(lambda: run_quietly(memoized, source, backend=backend), repeat=3)
+            print(f"{label}({n}) {backend:8}: {off * 1e3:8.1f} ms -> {on * 1e3:6.1f} ms memoized")
+        # far out of reach without the cache
+        memo = brewmemo.MemoCache()
+        memoized = interpreterv3.Interpreter(console_output=False, memo_cache=memo)
+        elapsed = best_of(lambda: run_quietly(memoized, MEMO_PROGRAMS[label].format(n=memo_n), backend="vm"), repeat=1)
+        print(f"{label}({memo_n}) vm memoized: {elapsed * 1e3:6.1f} ms; {memo.report()}")
+
+
+# constants spelled out and named the way people write them, in a hot loop
+FOLD_PROGRAM = """
+func main() : void {{
+  var i: int;
+  var total: int;
+  var scale: int;
+  var debug: bool;
+  scale = 4;
+  debug = false;
+  for (i = 0; i < {n}; i = i + 1) {{
+    total = total + i * scale + (60 * 60 * 24) / 1000 - -(2 * 3);
+    if (debug) {{ print("i = ", i); }}
+    if (!debug && scale > 2) {{ total = total - 1; }}
+  }}
+  print(total);
+}}
+"""
+
+
+def bench_fold(backends=("tree", "closure", "vm")):
+    import contextlib
+    import io
+
+    with contextlib.redirect_stdout(io.StringIO()):  # interpreterv3 runs a demo on import
+        import interpreterv3
+
+    source = FOLD_PROGRAM.format(n=20000)
+    for backend in backends:
+        plain = interpreterv3.Interpreter(console_output=False)
+        optimized = interpreterv3.Interpreter(console_output=False, optimize=True)
+        off = best_of(lambda: run_quietly(plain, source, backend=backend), repeat=5)
+        on = best_of(lambda: run_quietly(optimized, source, backend=backend), repeat=5)
+        print(f"constant loop {backend:8}: {off * 1e3:8.1f} ms -> {on * 1e3:6.1f} ms optimized")
+
+
+# small helpers called in a loop, as in test_challenge1.br
+INLINE_PROGRAM = """
+struct list {{ val: int; next: list; }}
+func cons(val: int, l: list) : list {{
+  var h: list;
+  h = new list;
+  h.val = val;
+  h.next = l;
+  return h;
+}}
+func is_even(n: int) : bool {{ return n - n / 2 * 2 == 0; }}
+func main() : void {{
+  var i: int;
+  var l: list;
+  var evens: int;
+  for (i = 0; i < {n}; i = i + 1) {{
+    l = cons(i, l);
+    if (is_even(i)) {{ evens = evens + 1; }}
+  }}
+  print(evens, l.val);
+}}
+"""
+
+
+def bench_inline(backends=("tree", "closure", "vm")):
+    import contextlib
+    import io
+
+    with contextlib.redirect_stdout(io.StringIO()):  # interpreterv3 runs a demo on import
+        import interpreterv3
+    import brewinline
+
+    source = INLINE_PROGRAM.format(n=10000)
+    for backend in backends:
+        plain = interpreterv3.Interpreter(console_output=False)
+        inliner = brewinline.Inliner()
+        inlined = interpreterv3.Interpreter(console_output=False, inliner=inliner)
+        # alternated, so both see the same machine
+        off = on = float("inf")
+        for _ in range(7):
+            off = min(off, best_of(lambda: run_quietly(plain, source, backend=backend), repeat=1))
+            on = min(on, best_of(lambda: run_quietly(inlined, source, backend=backend), repeat=1))
+        print(f"helpers in a loop {backend:8}: {off * 1e3:8.1f} ms -> {on * 1e3:6.1f} ms inlined")
+    print(inliner.report())
+
+
+INVARIANT_PROGRAM = """
+struct point {{ x: int; y: int; }}
+struct shape {{ origin: point; scale: int; }}
+func main() : void {{
+  var s: shape;
+  var i: int;
+  var n: int;
+  var total: int;
+  s = new shape;
+  s.origin = new point;
+  s.origin.x = 3;
+  s.origin.y = 4;
+  s.scale = 2;
+  n = {n};
+  for (i = 0; i < n; i = i + 1) {{
+    total = total + i * s.scale + s.origin.x * s.origin.y - n / 4;
+  }}
+  print(total, s.origin.x + s.origin.y * s.origin.x - s.origin.y);
+}}
+"""
+
+
+def bench_loops(backends=("tree", "closure", "vm")):
+    import contextlib
+    import io
+
+    with contextlib.redirect_stdout(io.StringIO()):  # interpreterv3 runs a demo on import
+        import interpreterv3
+
+    source = INVARIANT_PROGRAM.format(n=20000)
+    for backend in backends:
+        plain = interpreterv3.Interpreter(console_output=False)
+        optimized = interpreterv3.Interpreter(console_output=False, optimize=True)
+        # alternated, so both see the same machine
+        off = on = float("inf")
+        for _ in range(7):
+            off = min(off, best_of(lambda: run_quietly(plain, source, backend=backend), repeat=1))
+            on = min(on, best_of(lambda: run_quietly(optimized, source, backend=backend), repeat=1))
+        print(f"invariant field reads {backend:8}: {off * 1e3:8.1f} ms -> {on * 1e3:6.1f} ms optimized")
+
+
+# a struct made, filled in and read within each call, never leaving it
+LOCAL_STRUCT_PROGRAM = """
+struct point {{ x: int; y: int; }}
+func dist(ax: int, ay: int, bx: int, by: int) : int {{
+  var d: point;
+  d = new point;
+  d.x = bx - ax;
+  d.y = by - ay;
+  if (d.x < 0) {{ d.x = -d.x; }}
+  if (d.y < 0) {{ d.y = -d.y; }}
+  return d.x + d.y;
+}}
+func main() : void {{
+  var i: int;
+  var total: int;
+  for (i = 0; i < {n}; i = i + 1) {{
+    total = total + dist(i, 3, 7, i / 2);
+  }}
+  print(total);
+}}
+"""
+
+
+def bench_locals(backends=("tree", "closure", "vm")):
+    import contextlib
+    import io
+
+    with contextlib.redirect_stdout(io.StringIO()):  # interpreterv3 runs a demo on import
+        import interpreterv3
+
+    source = LOCAL_STRUCT_PROGRAM.format(n=20000)
+    for backend in backends:
+        plain = interpreterv3.Interpreter(console_output=False)
+        optimized = interpreterv3.Interpreter(console_output=False, optimize=True)
+        # alternated, so both see the same machine
+        off = on = float("inf")
+        for _ in range(7):
+            off = min(off, best_of(lambda: run_quietly(plain, source, backend=backend), repeat=1))
+            on = min(on, best_of(lambda: run_quietly(optimized, source, backend=backend), repeat=1))
+        print(f"local struct per call {backend:8}: {off * 1e3:8.1f} ms -> {on * 1e3:6.1f} ms optimized")
+
+
+# --- import time ------------------------------------------------------------
+
+IMPORT_SNIPPET = (
+    "import time; start = time.perf_counter(); import brewparse; "
+    "print(time.perf_counter() - start)"
+)
+
+
+def import_time(env_overrides, runs=15):
+    env = dict(os.environ, **env_overrides)
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return statistics.median(samples)
+
+
+def bench_import():
+    # fresh interpreter per sample; bytecode caching off to match read-only deployments
+    cold = {"PYTHONDONTWRITEBYTECODE": "1"}
+    reflect = import_time(dict(cold, BREWIN_PARSER_REFLECT="1"))
+    tables = import_time(dict(cold, BREWIN_PARSER_REFLECT="0"))
+    print(f"import brewparse  reflect grammar : {reflect * 1e3:7.1f} ms (median)")
+    print(f"import brewparse  prebuilt tables : {tables * 1e3:7.1f} ms (median)")
+
+    # the part of the import that builds the lexer and parser, without module loading
+    import brewlex
+
+    def setup(reflect_mode):
+        brewlex.REFLECT = brewparse.REFLECT = reflect_mode
+        brewlex.build_lexer()
+        brewparse.build_parser()
+
+    reflect = best_of(lambda: setup(True), repeat=20)
+    tables = best_of(lambda: setup(False), repeat=20)
+    brewlex.REFLECT = brewparse.REFLECT = False
+    print(f"lexer+parser setup  reflect grammar : {reflect * 1e3:7.2f} ms")
+    print(f"lexer+parser setup  prebuilt tables : {tables * 1e3:7.2f} ms")
+
+
+BENCHMARKS = {
+    "nodes": bench_nodes,
+    "import": bench_import,
+    "lexer": bench_lexer,
+    "mmap": bench_mmap,
+    "fields": bench_fields,
+    "structs": bench_structs,
+    "pool": bench_pool,
+    "backends": bench_backends,
+    "values": bench_values,
+    "typecheck": bench_typecheck,
+    "calls": bench_calls,
+    "tailcalls": bench_tailcalls,
+    "deep": bench_deep,
+    "memo": bench_memo,
+    "fold": bench_fold,
+    "inline": bench_inline,
+    "loops": bench_loops,
+    "locals": bench_locals,
+}
+
+
+def main(argv):
+    names = argv or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"unknown benchmark {name}; choose from {', '.join(BENCHMARKS)}")
+            return 1
+        print(f"== {name}")
+        BENCHMARKS[name]()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,206 @@
+# On-disk cache of parsed Brewin programs.
+#
+# Entries are pickled AST trees stored under <cache_dir>/<grammar key>/<source key>.ast.
+# The grammar key is derived from the LALR table signature in parsetab.py and from the
+# layout of the node classes in element.py, so editing the grammar in brewparse.py
+# (which regenerates parsetab.py) or changing a node's fields moves the cache to a new
+# directory and the entries built before are thrown away.
+import gc
+import hashlib
+import os
+import pickle
+import threading
+
+import element
+
+# bump when the meaning of the nodes brewparse produces changes without their
+# layout changing (node_layout_signature covers that)
+AST_FORMAT_VERSION = 3
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "brewin", "ast")
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+ENTRY_SUFFIX = ".ast"
+
+
+def grammar_signature():
+    # imported lazily: yacc.yacc() may have just rewritten parsetab.py
+    import parsetab
+
+    return parsetab._lr_signature
+
+
+# the name, fields and constructor arguments of every node class, in a stable order
+def node_layout_signature():
+    layouts = []
+    for name, cls in sorted(vars(element).items()):
+        if isinstance(cls, type) and issubclass(cls, element.Node):
+            layouts.append(f"{name}:{cls.__slots__}:{cls._fields}:{cls.init_args}")
+    return "\n".join(layouts)
+
+
+class ASTCache:
+    # max_entries / max_bytes bound the cache; None disables that limit.
+    # Entries are evicted least recently used first (a hit refreshes the file's mtime).
+    def __init__(
+        self,
+        cache_dir=None,
+        max_entries=DEFAULT_MAX_ENTRIES,
+        max_bytes=DEFAULT_MAX_BYTES,
+        signature=None,
+    ):
+        self.cache_dir = cache_dir or os.environ.get("BREWIN_AST_CACHE", DEFAULT_CACHE_DIR)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        if signature is None:
+            signature = grammar_signature()
+        grammar_key = hashlib.sha256(
+            f"{AST_FORMAT_VERSION}\0{signature}\0{node_layout_signature()}".encode("utf-8")
+        ).hexdigest()[:16]
+        self.grammar_key = grammar_key
+        self.entry_dir = os.path.join(self.cache_dir, grammar_key)
+        self.hits = 0
+        self.misses = 0
+        self.__ready = False
+
+    # program: source text, or its UTF-8 bytes (e.g. an mmap from brewparse.parse_file)
+    def key(self, program):
+        if isinstance(program, str):
+            program = program.encode("utf-8")
+        return hashlib.sha256(program).hexdigest()
+
+    def get(self, program):
+        path = self.__entry_path(program)
+        # unpickling allocates one object per node; running the cyclic collector over a
+        # half-built tree dominates the load time for large programs, so pause it meanwhile
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(path, "rb") as f:
+                ast = pickle.load(f)
+            if not isinstance(ast, element.ProgramNode):
+                raise pickle.UnpicklingError(f"not a program: {type(ast).__name__}")
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception:
+            # truncated, corrupt or from an incompatible version: drop it and parse again
+            self.misses += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        self.hits += 1
+        return ast
+
+    def put(self, program, ast):
+        if not self.__prepare():
+            return False
+        path = self.__entry_path(program)
+        # unique per thread, as parsers in a brewparse.ParserPool can cache the same source at once
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(ast, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except (OSError, pickle.PicklingError, RecursionError):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+        self.evict()
+        return True
+
+    # drop least recently used entries until both limits are satisfied
+    def evict(self):
+        entries = self.__entries()
+        total_bytes = sum(size for _, _, size in entries)
+        entries.sort()  # oldest mtime first
+        count = len(entries)
+        for _, path, size in entries:
+            over_count = self.max_entries is not None and count > self.max_entries
+            over_bytes = self.max_bytes is not None and total_bytes > self.max_bytes
+            if not over_count and not over_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            count -= 1
+            total_bytes -= size
+
+    def clear(self):
+        for _, path, _ in self.__entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        entries = self.__entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(entries),
+            "bytes": sum(size for _, _, size in entries),
+        }
+
+    def __entry_path(self, program):
+        return os.path.join(self.entry_dir, self.key(program) + ENTRY_SUFFIX)
+
+    def __entries(self):
+        entries = []
+        try:
+            names = os.listdir(self.entry_dir)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+            path = os.path.join(self.entry_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, path, st.st_size))
+        return entries
+
+    # create the entry directory and remove directories left behind by older grammars
+    def __prepare(self):
+        if self.__ready:
+            return True
+        try:
+            os.makedirs(self.entry_dir, exist_ok=True)
+        except OSError:
+            return False
+        for name in os.listdir(self.cache_dir):
+            if name == self.grammar_key:
+                continue
+            stale_dir = os.path.join(self.cache_dir, name)
+            if not self.__is_grammar_dir(name) or not os.path.isdir(stale_dir):
+                continue
+            for entry in os.listdir(stale_dir):
+                if entry.endswith(ENTRY_SUFFIX) or entry.endswith(".tmp"):
+                    try:
+                        os.remove(os.path.join(stale_dir, entry))
+                    except OSError:
+                        pass
+            try:
+                os.rmdir(stale_dir)
+            except OSError:
+                pass
+        self.__ready = True
+        return True
+
+    def __is_grammar_dir(self, name):
+        return len(name) == len(self.grammar_key) and all(c in "0123456789abcdef" for c in name)
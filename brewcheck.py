@@ -0,0 +1,468 @@
+# Static type checker for interpreterv3 programs.
+#
+# Runs after brewresolve.resolve. Every expression node gets a static_type: the
+# frozenset of type names its value can have at run time ("int", "nil", a struct
+# name, ...), or None when that can't be determined. An empty set means the
+# expression never produces a value (it always stops the program with an error).
+#
+# The types follow what the interpreter actually does, not just the
+# declarations: EnvironmentManager.set stores the assigned value as is, so an int
+# assigned to a bool variable stays an int, a struct variable starts out nil and
+# can take any struct, and so on. A variable's type is therefore the set of all
+# types that can be stored in its slot anywhere in the function, found by
+# iterating to a fixed point.
+#
+# From the types the checker marks what is proven safe, so the backends can skip
+# the matching run-time checks:
+#   BinOpNode.operand_type   both operands always have this type and the operator
+#                            applies to it directly (no coercion or nil rule)
+#   AssignNode.checked       the variable always holds the value's one type
+#   FCallNode.args_checked   every argument always passes the parameter checks
+#   static_type is BOOL      a condition needs no int coercion or type check
+#
+# It also collects the type errors that are certain to happen whenever a node
+# runs, with the ErrorType and message the interpreter would raise there. The
+# interpreter reports the first one before running when asked to (check_types).
+from brewrules import PRIMITIVE_TYPES, can_store
+from intbase import InterpreterBase, ErrorType
+
+UNKNOWN = "?"
+
+_interned = {}
+
+
+# the one frozenset for each set of type names, so annotations can be compared with `is`
+def types(*names):
+    key = frozenset(names)
+    return _interned.setdefault(key, key)
+
+
+NO_TYPE = types()
+INT = types("int")
+BOOL = types("bool")
+STRING = types("string")
+NIL = types("nil")
+VOID = types("void")
+
+_PRIMITIVE = {"int": INT, "bool": BOOL, "string": STRING}
+
+
+# returns the list of (ErrorType, message) type errors found, in program order
+def check(ast, interpreter):
+    checker = _Checker(interpreter)
+    checker.collect_struct_vars(ast)
+    for func_def in ast.functions:
+        checker.function(func_def)
+    return checker.errors
+
+
+class _Checker:
+    def __init__(self, interpreter):
+        self.structs = interpreter.structs
+        self.layouts = interpreter.struct_layouts
+        self.functions = interpreter.func_name_to_ast
+        self.op_types = {t: set(ops) for t, ops in interpreter.op_to_lambda.items()}
+        self.struct_values = types(InterpreterBase.NIL_DEF, *self.structs)
+        self.errors = []
+        self.struct_var_types = {}  # variable name -> struct types of its var definitions
+
+    # type_of_struct_dict maps each variable name to the struct type of the
+    # latest var definition with that name, anywhere in the program
+    def collect_struct_vars(self, ast):
+        def visit(statements):
+            for statement in statements:
+                kind = statement.elem_type
+                if kind == InterpreterBase.VAR_DEF_NODE and statement.var_type in self.structs:
+                    self.struct_var_types.setdefault(statement.name, set()).add(statement.var_type)
+                elif kind == InterpreterBase.IF_NODE:
+                    visit(statement.statements)
+                    visit(statement.else_statements or [])
+                elif kind == InterpreterBase.FOR_NODE:
+                    visit([statement.init, statement.update])
+                    visit(statement.statements)
+
+        for func_def in ast.functions:
+            visit(func_def.statements)
+
+    def function(self, func_def):
+        self.func_def = func_def
+        self.var_types = {}  # slot -> set of type names
+        self.vardef_slots = set()
+        for arg, slot in zip(func_def.args, func_def.param_slots):
+            self.__store(slot, self.__param_types(arg.var_type))
+        errors = self.errors
+        while True:
+            self.changed = False
+            self.errors = []
+            self.statements(func_def.statements)
+            if not self.changed:
+                break
+        self.errors = errors + self.errors
+
+    def __param_types(self, var_type):
+        if var_type in _PRIMITIVE:
+            return _PRIMITIVE[var_type]
+        if var_type in self.structs:
+            return types(InterpreterBase.NIL_DEF, var_type)
+        return NO_TYPE
+
+    # widen a variable's types
+    def __store(self, slot, value_types):
+        current = self.var_types.get(slot, NO_TYPE)
+        if not value_types <= current:
+            self.var_types[slot] = types(*current, *value_types)
+            self.changed = True
+
+    def __error(self, error_type, message):
+        self.errors.append((error_type, message))
+
+    # --- statements ---------------------------------------------------------
+
+    def statements(self, statements):
+        for statement in statements:
+            self.statement(statement)
+
+    def statement(self, statement):
+        kind = statement.elem_type
+        if kind == InterpreterBase.FCALL_NODE or kind == InterpreterBase.INLINE_NODE:
+            self.expression(statement)
+        elif kind == "=":
+            self.assign(statement)
+        elif kind == InterpreterBase.FIELD_SLOT_ASSIGN_NODE:
+            self.expression(statement.expression)
+        elif kind == InterpreterBase.VAR_DEF_NODE:
+            self.var_def(statement)
+        elif kind == InterpreterBase.RETURN_NODE:
+            self.return_statement(statement)
+        elif kind == InterpreterBase.IF_NODE:
+            self.condition(statement.condition, "if")
+            self.statements(statement.statements)
+            if statement.else_statements is not None:
+                self.statements(statement.else_statements)
+        elif kind == InterpreterBase.FOR_NODE:
+            self.statement(statement.init)
+            self.condition(statement.condition, "for")
+            self.statements(statement.statements)
+            self.statement(statement.update)
+
+    def var_def(self, var_ast):
+        var_type = var_ast.var_type
+        if var_type in _PRIMITIVE:
+            value_types = _PRIMITIVE[var_type]
+        elif var_type in self.structs:
+            value_types = NIL
+        else:
+            self.__error(
+                ErrorType.TYPE_ERROR,
+                "All variable definitions must now specify an explicit type for the variable",
+            )
+            return
+        if var_ast.slot is not None:
+            self.vardef_slots.add(var_ast.slot)
+            self.__store(var_ast.slot, value_types)
+
+    def assign(self, assign_ast):
+        value_types = self.expression(assign_ast.expression)
+        if assign_ast.path is not None:
+            self.store_path(assign_ast.path, value_types)
+            assign_ast.checked = False
+            return
+        slot = assign_ast.slot
+        if slot is None:
+            assign_ast.checked = False
+            return
+        var_types = self.var_types.get(slot, NO_TYPE)
+        stored = set()
+        for cur_type in var_types:
+            for val_type in value_types:
+                if _can_store(cur_type, val_type):
+                    stored.add(val_type)
+        self.__store(slot, types(*stored))
+        assign_ast.checked = len(var_types) == 1 and var_types is value_types and UNKNOWN not in var_types
+        if _exact(var_types) and _exact(value_types) and not stored:
+            (cur_type,) = var_types
+            (val_type,) = value_types
+            self.__error(
+                ErrorType.TYPE_ERROR,
+                f"{assign_ast.name} has type {cur_type} but was set to a {val_type}",
+            )
+
+    def return_statement(self, return_ast):
+        if return_ast.expression is None:
+            return
+        value_types = self.expression(return_ast.expression)
+        return_type = self.func_def.return_type
+        if _exact(value_types):
+            (val_type,) = value_types
+            if not (
+                val_type == return_type
+                or (val_type == "nil" and return_type in ("int", "string", "bool", "void"))
+                or (return_type == "bool" and val_type == "int")
+                or (return_type in self.structs and val_type == "nil")
+            ):
+                self.__error(
+                    ErrorType.TYPE_ERROR,
+                    f"The function is supposed to return a {return_type} but instead returns a {val_type}",
+                )
+
+    def condition(self, cond_ast, statement_kind):
+        value_types = self.expression(cond_ast)
+        if _exact(value_types) and not value_types <= {"int", "bool"}:
+            self.__error(ErrorType.TYPE_ERROR, f"Incompatible type for {statement_kind} condition")
+
+    # --- expressions --------------------------------------------------------
+
+    def expression(self, expr_ast):
+        value_types = self.__expression(expr_ast)
+        expr_ast.static_type = None if UNKNOWN in value_types else value_types
+        return value_types
+
+    def __expression(self, expr_ast):
+        kind = expr_ast.elem_type
+        if kind == InterpreterBase.INT_NODE:
+            return INT
+        if kind == InterpreterBase.STRING_NODE:
+            return STRING
+        if kind == InterpreterBase.BOOL_NODE:
+            return BOOL
+        if kind == InterpreterBase.NIL_NODE:
+            return NIL
+        if kind == InterpreterBase.NEW_NODE:
+            return types(expr_ast.var_type) if expr_ast.var_type in self.structs else NO_TYPE
+        if kind == InterpreterBase.VAR_NODE:
+            if expr_ast.path is not None:
+                return self.load_path(expr_ast.path)
+            if expr_ast.slot is None:
+                return NO_TYPE
+            return self.var_types.get(expr_ast.slot, NO_TYPE)
+        if kind == InterpreterBase.FCALL_NODE:
+            return self.call(expr_ast)
+        if kind == InterpreterBase.INLINE_NODE:
+            return self.inline(expr_ast)
+        if kind == InterpreterBase.CACHED_NODE:
+            return self.expression(expr_ast.expression)
+        if kind == InterpreterBase.FIELD_SLOT_NODE:
+            return self.field_slot(expr_ast)
+        if kind == InterpreterBase.NEG_NODE:
+            return self.unary(expr_ast, "int")
+        if kind == InterpreterBase.NOT_NODE:
+            return self.unary(expr_ast, "bool")
+        if hasattr(expr_ast, "op2"):
+            return self.binary(expr_ast)
+        return types(UNKNOWN)
+
+    def unary(self, expr_ast, operand_type):
+        value_types = self.expression(expr_ast.op1)
+        if _exact(value_types) and operand_type not in value_types:
+            self.__error(ErrorType.TYPE_ERROR, f"Incompatible type for {expr_ast.elem_type} operation")
+        if UNKNOWN in value_types:
+            return types(UNKNOWN)
+        return _PRIMITIVE[operand_type] if operand_type in value_types else NO_TYPE
+
+    def binary(self, expr_ast):
+        op = expr_ast.elem_type
+        left_types = self.expression(expr_ast.op1)
+        right_types = self.expression(expr_ast.op2)
+        results = set()
+        for left_type in left_types:
+            for right_type in right_types:
+                if left_type == UNKNOWN or right_type == UNKNOWN:
+                    results.add(UNKNOWN)
+                    continue
+                result, error = self.__binary_result(op, left_type, right_type)
+                if result is not None:
+                    results.add(result)
+                elif error is not None and _exact(left_types) and _exact(right_types):
+                    self.__error(*error)
+
+        expr_ast.operand_type = None
+        if _exact(left_types) and left_types is right_types:
+            (operand_type,) = left_types
+            if (
+                operand_type in self.op_types
+                and op in self.op_types[operand_type]
+                and not (operand_type == "int" and op in ("&&", "||"))
+            ):
+                expr_ast.operand_type = operand_type
+        return types(*results)
+
+    # (result type, None), or (None, (ErrorType, message)), or (None, None) when
+    # the interpreter fails without a Brewin error; step for step as brewrules.general_binary_op
+    def __binary_result(self, op, left_type, right_type):
+        logical = op in ("||", "&&")
+        if left_type == "bool" and right_type == "int":
+            right_type = "bool"
+        elif left_type == "int" and right_type == "bool":
+            left_type = "bool"
+        elif left_type == "int" and right_type == "int" and logical:
+            left_type = right_type = "bool"
+        elif left_type in self.structs and right_type == "nil" and op in ("==", "!="):
+            return "bool", None
+        elif left_type in PRIMITIVE_TYPES and right_type == "nil":
+            return None, (ErrorType.TYPE_ERROR, f"Cannot compare {left_type} to nil")
+        elif right_type in PRIMITIVE_TYPES and left_type == "nil":
+            return None, (ErrorType.TYPE_ERROR, f"Cannot compare {left_type} to nil")
+
+        if op not in ("==", "!=") and left_type != right_type:
+            return None, (ErrorType.TYPE_ERROR, f"Incompatible types for {op} operation")
+        if left_type not in self.op_types:
+            return None, None
+        if op not in self.op_types[left_type]:
+            return None, (ErrorType.TYPE_ERROR, f"Incompatible operator {op} for type {left_type}")
+        # arithmetic and logical operators keep the operand type, comparisons give a bool
+        return (left_type if op in ("+", "-", "*", "/", "&&", "||") else "bool"), None
+
+    # --- field paths --------------------------------------------------------
+
+    # the types of the struct values a path's fields are read from, one set per field
+    def __path_containers(self, path):
+        base_types = NO_TYPE if path.base_slot is None else self.var_types.get(path.base_slot, NO_TYPE)
+        if _exact(base_types) and base_types <= {"int", "bool", "string", "void"}:
+            self.__error(ErrorType.TYPE_ERROR, "Dot operator only valid on struct")
+        containers = [base_types]
+        for field in path.fields[:-1]:
+            containers.append(self.__field_types(containers[-1], field))
+        return containers
+
+    def __field_types(self, container_types, field):
+        if UNKNOWN in container_types:
+            return types(UNKNOWN)
+        result = set()
+        for struct_type in container_types:
+            layout = self.layouts.get(struct_type)
+            if layout is None or field not in layout.offsets:
+                continue
+            declared = layout.field_types[layout.offsets[field]]
+            if declared in _PRIMITIVE:
+                result.add(declared)
+            elif declared in self.structs:
+                # a struct field starts out nil and can be set to any struct
+                result.update(self.struct_values)
+            else:
+                result.add(UNKNOWN)
+        return types(*result)
+
+    # a field of a struct variable brewopt split into slots holds what the field would
+    def field_slot(self, field_ast):
+        value_types = self.__field_types(types(field_ast.var_type), field_ast.field)
+        for field, _, _ in field_ast.steps:
+            value_types = self.__field_types(value_types, field)
+        return value_types
+
+    def load_path(self, path):
+        containers = self.__path_containers(path)
+        return self.__field_types(containers[-1], path.fields[-1])
+
+    def store_path(self, path, value_types):
+        container_types = self.__path_containers(path)[-1]
+        field = path.fields[-1]
+        if not _exact(container_types) or not _exact(value_types):
+            return
+        (struct_type,) = container_types
+        layout = self.layouts.get(struct_type)
+        if layout is None or field not in layout.offsets:
+            return
+        declared = layout.field_types[layout.offsets[field]]
+        (val_type,) = value_types
+        if declared in _PRIMITIVE and val_type != declared and not (declared == "bool" and val_type == "int"):
+            self.__error(
+                ErrorType.TYPE_ERROR,
+                f"Setting a struct field of type {declared} to a value of type {val_type}",
+            )
+
+    # --- calls --------------------------------------------------------------
+
+    def call(self, call_ast):
+        func_name = call_ast.name
+        arg_types = [self.expression(arg) for arg in call_ast.args]
+        call_ast.args_checked = False
+        if func_name == "print":
+            return types(UNKNOWN)  # print() returns a plain string, not a Value
+        if func_name == "inputi" or func_name == "inputs":
+            if len(call_ast.args) > 1:
+                return NO_TYPE
+            return INT if func_name == "inputi" else STRING
+
+        func_def = self.functions.get(func_name, {}).get(len(call_ast.args))
+        if func_def is None:
+            return NO_TYPE
+        checked = True
+        for formal_ast, actual_ast, actual_types in zip(func_def.args, call_ast.args, arg_types):
+            checked = self.__argument(formal_ast, actual_ast, actual_types) and checked
+        call_ast.args_checked = checked
+
+        return_type = func_def.return_type
+        if return_type in _PRIMITIVE:
+            return _PRIMITIVE[return_type]
+        if return_type == InterpreterBase.VOID_DEF:
+            return VOID
+        if return_type in self.structs:
+            return types(InterpreterBase.NIL_DEF, return_type)
+        return types(UNKNOWN)
+
+    # a call brewinline replaced with the callee's body: checked as the call,
+    # and the body as part of the function it was inlined into, its parameters
+    # in their own slots and its returns against the callee's return type
+    def inline(self, inline_ast):
+        value_types = self.call(inline_ast)
+        callee = inline_ast.callee
+        for arg, slot in zip(callee.args, inline_ast.param_slots):
+            self.__store(slot, self.__param_types(arg.var_type))
+        func_def, self.func_def = self.func_def, callee
+        self.statements(inline_ast.statements)
+        self.func_def = func_def
+        return value_types
+
+    # whether the argument always passes Interpreter.__call_func_aux's checks
+    def __argument(self, formal_ast, actual_ast, actual_types):
+        arg_type = formal_ast.var_type
+        if arg_type not in PRIMITIVE_TYPES and arg_type not in self.structs:
+            return False
+        if UNKNOWN in actual_types:
+            return False
+
+        if arg_type not in self.structs:
+            if _exact(actual_types):
+                (val_type,) = actual_types
+                if val_type != arg_type and not (arg_type == "bool" and val_type == "int"):
+                    self.__error(ErrorType.TYPE_ERROR, "Wrong type for parameter input")
+            return actual_types == {arg_type}
+
+        mismatch = f"Formal parameter {formal_ast.name} excepted struct of type {arg_type}, type mismatch*/"
+        if actual_ast.get("var_type") is not None and actual_ast.get("var_type") == arg_type:
+            pass
+        elif actual_ast.elem_type == InterpreterBase.VAR_NODE and actual_ast.path is not None:
+            field_type = actual_ast.path.field_type
+            if field_type is not None and field_type != arg_type:
+                self.__error(ErrorType.TYPE_ERROR, mismatch)
+                return False
+        elif (
+            actual_ast.elem_type == InterpreterBase.VAR_NODE
+            and actual_ast.slot in self.vardef_slots
+            and len(self.struct_var_types.get(actual_ast.name, ())) == 1
+        ):
+            # the variable's own definition has run, so type_of_struct_dict has
+            # its name, and every definition with that name gives the same type
+            (dict_type,) = self.struct_var_types[actual_ast.name]
+            if dict_type != arg_type:
+                self.__error(ErrorType.TYPE_ERROR, mismatch)
+                return False
+        else:
+            return False
+
+        if _exact(actual_types):
+            (val_type,) = actual_types
+            if val_type != arg_type and val_type != "nil":
+                self.__error(ErrorType.TYPE_ERROR, "Wrong type for parameter input")
+        return actual_types <= {arg_type, "nil"}
+
+
+def _exact(value_types):
+    return len(value_types) == 1 and UNKNOWN not in value_types
+
+
+# whether brewrules.can_store might accept a value of val_type for a variable holding cur_type
+def _can_store(cur_type, val_type):
+    if cur_type == UNKNOWN or val_type == UNKNOWN:
+        return True
+    return can_store(cur_type, val_type)
@@ -0,0 +1,711 @@
+# Closure-compiling backend for interpreterv3.
+#
+# Every function body is translated once into nested Python closures: each
+# statement and expression node becomes a closure with its children, operator
+# functions and constants bound when it is built, so running the program is
+# plain closure calls instead of re-dispatching on elem_type at every node.
+#
+# The closures reproduce the tree walker's behavior exactly, including its
+# coercions, the order in which it evaluates and checks things, and the errors
+# it raises. Anything that can fail is still checked when it runs, never at
+# compile time, so a program prints the same output before failing. Checks
+# that brewcheck proved always pass are left out.
+#
+# Closure calling conventions:
+#   expression(frame) -> Value
+#   statement(frame)  -> None to continue, the Value being returned, or a
+#                        TailCall for a return brewresolve.mark_tail_calls marked
+# frame is the running call's list of locals, indexed by the slots
+# brewresolve.resolve assigned, as in EnvironmentManager.environment[-1].
+
+from brewcheck import BOOL
+from brewmemo import MemoCache
+from brewrules import PRIMITIVE_TYPES, can_store, general_binary_op, return_coercion
+from intbase import InterpreterBase, ErrorType
+from type_valuev2 import EMPTY_STRING, FALSE, NIL, TRUE, ZERO, Type, Value, get_printable, int_value
+
+
+class CompiledFunction:
+    def __init__(self, func_def):
+        self.func_def = func_def
+        self.body = None  # filled in once every function has a CompiledFunction
+
+
+# returned by a function body instead of a Value: run function.body(frame) in
+# place of the call that got it
+class TailCall:
+    __slots__ = ("function", "frame")
+
+    def __init__(self, function, frame):
+        self.function = function
+        self.frame = frame
+
+
+class ClosureCompiler:
+    # interpreter: the interpreterv3.Interpreter running the program, after its
+    # struct and function tables are set up
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.error = interpreter.error
+        self.structs = interpreter.structs
+        self.functions = {}
+
+    # returns a closure that runs main()
+    def compile_program(self):
+        for name, overloads in self.interpreter.func_name_to_ast.items():
+            for num_params, func_def in overloads.items():
+                self.functions[name, num_params] = CompiledFunction(func_def)
+        for function in self.functions.values():
+            function.body = self.__block(function.func_def.statements)
+        return self.__call("main", [])
+
+    # --- statements ---------------------------------------------------------
+
+    def __block(self, statements):
+        compiled = [self.__statement(statement) for statement in statements]
+        if self.interpreter.trace_output:
+            compiled = [self.__traced(s, c) for s, c in zip(statements, compiled)]
+
+        def block(frame):
+            for statement in compiled:
+                return_val = statement(frame)
+                if return_val is not None:
+                    return return_val
+            return None
+
+        return block
+
+    def __traced(self, statement, compiled):
+        def traced(frame):
+            print(statement)
+            return compiled(frame)
+
+        return traced
+
+    def __statement(self, statement):
+        kind = statement.elem_type
+        if kind == InterpreterBase.FCALL_NODE:
+            call = self.__call(statement.name, statement.args, statement.args_checked)
+
+            def call_statement(frame):
+                call(frame)
+
+            return call_statement
+        if kind == InterpreterBase.INLINE_NODE:
+            inline = self.__inline(statement)
+
+            def inline_statement(frame):
+                inline(frame)
+
+            return inline_statement
+        if kind == InterpreterBase.UNCACHE_NODE:
+            slots = statement.slots
+
+            def uncache(frame):
+                for slot in slots:
+                    frame[slot] = None
+
+            return uncache
+        if kind == InterpreterBase.FIELD_SLOT_ASSIGN_NODE:
+            return self.__assign_field_slot(statement)
+        if kind == InterpreterBase.FIELD_SLOTS_NODE:
+            slots_values = tuple(zip(statement.slots, statement.values))
+
+            def set_field_slots(frame):
+                for slot, value in slots_values:
+                    frame[slot] = value
+
+            return set_field_slots
+        if kind == "=":
+            return self.__assign(statement)
+        if kind == InterpreterBase.VAR_DEF_NODE:
+            return self.__var_def(statement)
+        if kind == InterpreterBase.RETURN_NODE:
+            return self.__return(statement)
+        if kind == InterpreterBase.IF_NODE:
+            return self.__if(statement)
+        if kind == InterpreterBase.FOR_NODE:
+            return self.__for(statement)
+        # anything else (try, raise) is ignored by the tree walker too
+        return lambda frame: None
+
+    def __assign(self, assign_ast):
+        expression = self.__expression(assign_ast.expression)
+        error = self.error
+        if assign_ast.path is not None:
+            path = assign_ast.path
+            base_slot, steps = path.base_slot, path.steps
+            check_path_base = self.interpreter.check_path_base
+            store_field_path = self.interpreter.store_field_path
+
+            def assign_field(frame):
+                value = expression(frame)
+                base = None if base_slot is None else frame[base_slot]
+                store_field_path(check_path_base(base), steps, value)
+
+            return assign_field
+
+        name = assign_ast.name
+        slot = assign_ast.slot
+        if slot is None:
+
+            def undefined_assign(frame):
+                expression(frame)
+                error(ErrorType.NAME_ERROR, f"Undefined variable {name} in assignment")
+
+            return undefined_assign
+
+        if assign_ast.checked:
+
+            def checked_assign(frame):
+                frame[slot] = expression(frame)
+
+            return checked_assign
+
+        def assign(frame):
+            value = expression(frame)
+            cur_type = frame[slot].type()
+            val_type = value.type()
+            if cur_type != val_type and not can_store(cur_type, val_type):
+                error(
+                    ErrorType.TYPE_ERROR,
+                    f"{name} has type {cur_type} but was set to a {val_type}",
+                )
+            frame[slot] = value
+
+        return assign
+
+    def __var_def(self, var_ast):
+        name = var_ast.name
+        var_type = var_ast.var_type
+        error = self.error
+        type_of_struct_dict = self.interpreter.type_of_struct_dict
+
+        if var_type == InterpreterBase.BOOL_NODE:
+            default = lambda: FALSE
+        elif var_type == InterpreterBase.INT_NODE:
+            default = lambda: ZERO
+        elif var_type == InterpreterBase.STRING_NODE:
+            default = lambda: EMPTY_STRING
+        elif var_type in self.structs:
+
+            def default():
+                type_of_struct_dict[name] = var_type
+                return NIL
+
+        else:
+
+            def bad_var_def(frame):
+                error(
+                    ErrorType.TYPE_ERROR,
+                    f"All variable definitions must now specify an explicit type for the variable",
+                )
+
+            return bad_var_def
+
+        slot = var_ast.slot
+        if slot is None:
+
+            def duplicate_var_def(frame):
+                default()
+                error(ErrorType.NAME_ERROR, f"Duplicate definition for variable {name}")
+
+            return duplicate_var_def
+
+        def var_def(frame):
+            frame[slot] = default()
+
+        return var_def
+
+    def __return(self, return_ast):
+        expr_ast = return_ast.expression
+        nil_value = self.interpreter.NIL_VALUE
+        if expr_ast is None:
+            return lambda frame: nil_value
+
+        if return_ast.tail_call is not None:
+            function = self.functions[expr_ast.name, len(expr_ast.args)]
+            build_frame = self.__frame_builder(function, expr_ast.args, expr_ast.args_checked)
+            return lambda frame: TailCall(function, build_frame(frame))
+
+        # struct references and (immutable) Values are both returned as is
+        return self.__expression(expr_ast)
+
+    def __if(self, if_ast):
+        condition = self.__expression(if_ast.condition)
+        statements = self.__block(if_ast.statements)
+        if if_ast.else_statements is not None:
+            else_statements = self.__block(if_ast.else_statements)
+        else:
+            else_statements = lambda frame: None
+        error = self.error
+
+        if if_ast.condition.static_type is BOOL:
+
+            def run_bool_if(frame):
+                if condition(frame).value():
+                    return statements(frame)
+                return else_statements(frame)
+
+            return run_bool_if
+
+        def run_if(frame):
+            result = condition(frame)
+            result_type = result.type()
+            if result_type == Type.INT:
+                taken = result.value() != 0
+            elif result_type != Type.BOOL:
+                error(ErrorType.TYPE_ERROR, "Incompatible type for if condition")
+            else:
+                taken = result.value()
+            if taken:
+                return statements(frame)
+            return else_statements(frame)
+
+        return run_if
+
+    def __for(self, for_ast):
+        init = self.__statement(for_ast.init)
+        condition = self.__expression(for_ast.condition)
+        update = self.__statement(for_ast.update)
+        statements = self.__block(for_ast.statements)
+        error = self.error
+
+        # the loop after its init
+        if for_ast.condition.static_type is BOOL:
+
+            def loop(frame):
+                while condition(frame).value():
+                    return_val = statements(frame)
+                    if return_val is not None:
+                        return return_val
+                    update(frame)
+                return None
+
+        else:
+
+            def loop(frame):
+                while True:
+                    result = condition(frame)
+                    result_type = result.type()
+                    if result_type == Type.INT:
+                        taken = result.value() != 0
+                    elif result_type != Type.BOOL:
+                        error(ErrorType.TYPE_ERROR, "Incompatible type for for condition")
+                    else:
+                        taken = result.value()
+                    if not taken:
+                        return None
+                    return_val = statements(frame)
+                    if return_val is not None:
+                        return return_val
+                    update(frame)
+
+        counting = for_ast.counter
+        if counting is None:
+
+            def run_for(frame):
+                init(frame)
+                return loop(frame)
+
+            return run_for
+
+        # a counting loop (brewresolve.mark_counting_loops) counts in a Python
+        # int once its init has shown the counter and limit hold int Values
+        slot = counting.slot
+        test = counting.test
+        fixed_limit = counting.limit
+        limit_slot = counting.limit_slot
+        step = counting.step
+
+        def run_counting_for(frame):
+            init(frame)
+            counter = frame[slot]
+            if counter.__class__ is not Value or counter.t != Type.INT:
+                return loop(frame)
+            limit = fixed_limit
+            if limit_slot is not None:
+                limit = frame[limit_slot]
+                if limit.__class__ is not Value or limit.t != Type.INT:
+                    return loop(frame)
+                limit = limit.v
+            i = counter.v
+            while test(i, limit):
+                return_val = statements(frame)
+                if return_val is not None:
+                    return return_val
+                i += step
+                frame[slot] = int_value(i)
+            return None
+
+        return run_counting_for
+
+    # --- expressions --------------------------------------------------------
+
+    def __expression(self, expr_ast):
+        kind = expr_ast.elem_type
+        if kind == InterpreterBase.NEW_NODE:
+            structs = self.structs
+            struct_name = expr_ast.var_type
+            pool = self.interpreter.pool
+            if pool is not None:
+                return lambda frame: pool.new(structs[struct_name])
+
+            def new(frame):
+                struct_class = structs[struct_name]
+                return struct_class(struct_class.defaults)
+
+            return new
+        if kind == InterpreterBase.NIL_NODE:
+            nil_value = self.interpreter.NIL_VALUE
+            return lambda frame: nil_value
+        if kind == InterpreterBase.INT_NODE:
+            constant = expr_ast.constant
+            return lambda frame: constant
+        if kind == InterpreterBase.STRING_NODE:
+            constant = expr_ast.constant
+            return lambda frame: constant
+        if kind == InterpreterBase.BOOL_NODE:
+            constant = expr_ast.constant
+            return lambda frame: constant
+        if kind == InterpreterBase.VAR_NODE:
+            return self.__variable(expr_ast)
+        if kind == InterpreterBase.FCALL_NODE:
+            return self.__call(expr_ast.name, expr_ast.args, expr_ast.args_checked)
+        if kind == InterpreterBase.INLINE_NODE:
+            return self.__inline(expr_ast)
+        if kind == InterpreterBase.CACHED_NODE:
+            return self.__cached(expr_ast)
+        if kind == InterpreterBase.FIELD_SLOT_NODE:
+            return self.__field_slot(expr_ast)
+        if kind in self.interpreter.BIN_OPS:
+            return self.__binary_op(expr_ast)
+        if kind == InterpreterBase.NEG_NODE:
+            return self.__unary_op(expr_ast, Type.INT, lambda x: int_value(-1 * x))
+        if kind == InterpreterBase.NOT_NODE:
+            return self.__unary_op(expr_ast, Type.BOOL, lambda x: FALSE if x else TRUE)
+        return lambda frame: None
+
+    # a FieldSlotNode's value, or the field its steps lead to
+    def __field_slot(self, field_ast):
+        field_slot = self.__field_slot_value(field_ast.slot)
+        steps = field_ast.steps
+        if not steps:
+            return field_slot
+        follow_field_path = self.interpreter.follow_field_path
+        return lambda frame: follow_field_path(field_slot(frame), steps)
+
+    # the value in a FieldSlotNode's slot, which is None while the struct
+    # variable it stands for is nil
+    def __field_slot_value(self, slot):
+        error = self.error
+
+        def field_slot(frame):
+            value = frame[slot]
+            if value is None:
+                error(ErrorType.FAULT_ERROR, "Dot operator invalid on uninitialized struct")
+            return value
+
+        return field_slot
+
+    def __assign_field_slot(self, assign_ast):
+        expression = self.__expression(assign_ast.expression)
+        target = assign_ast.target
+        slot, steps = target.slot, target.steps
+        field_slot = self.__field_slot_value(slot)
+        if steps:
+            store_field_path = self.interpreter.store_field_path
+
+            def assign_path(frame):
+                value = expression(frame)
+                store_field_path(field_slot(frame), steps, value)
+
+            return assign_path
+
+        field_value = self.interpreter.field_value
+
+        def assign_field(frame):
+            value = expression(frame)
+            frame[slot] = field_value(field_slot(frame), value)
+
+        return assign_field
+
+    def __cached(self, cached_ast):
+        expression = self.__expression(cached_ast.expression)
+        slot = cached_ast.slot
+
+        def cached(frame):
+            value = frame[slot]
+            if value is None:
+                value = frame[slot] = expression(frame)
+            return value
+
+        return cached
+
+    def __variable(self, var_ast):
+        if var_ast.path is not None:
+            path = var_ast.path
+            base_slot, steps = path.base_slot, path.steps
+            check_path_base = self.interpreter.check_path_base
+            follow_field_path = self.interpreter.follow_field_path
+            if base_slot is None:
+                return lambda frame: follow_field_path(check_path_base(None), steps)
+            return lambda frame: follow_field_path(check_path_base(frame[base_slot]), steps)
+
+        name = var_ast.name
+        error = self.error
+        slot = var_ast.slot
+        if slot is None:
+
+            def undefined_variable(frame):
+                error(ErrorType.NAME_ERROR, f"Variable {name} not found")
+
+            return undefined_variable
+
+        return lambda frame: frame[slot]
+
+    def __unary_op(self, arith_ast, t, f):
+        operand = self.__expression(arith_ast.op1)
+        error = self.error
+        op = arith_ast.elem_type
+
+        def unary_op(frame):
+            value_obj = operand(frame)
+            if value_obj.type() != t:
+                error(ErrorType.TYPE_ERROR, f"Incompatible type for {op} operation")
+            return f(value_obj.value())
+
+        return unary_op
+
+    def __binary_op(self, arith_ast):
+        op = arith_ast.elem_type
+        left = self.__expression(arith_ast.op1)
+        right = self.__expression(arith_ast.op2)
+        logical = op in ("||", "&&")
+        if arith_ast.operand_type is not None:
+            checked_op = self.interpreter.op_to_lambda[arith_ast.operand_type][op]
+
+            def checked_binary_op(frame):
+                return checked_op(left(frame), right(frame))
+
+            return checked_binary_op
+
+        slow_op = general_binary_op(self.interpreter, op)
+
+        int_op = self.interpreter.op_to_lambda[Type.INT].get(op)
+        if logical or int_op is None:
+
+            def binary_op(frame):
+                return slow_op(left(frame), right(frame))
+
+            return binary_op
+
+        # int (op) int needs none of the coercions or nil checks
+        def int_binary_op(frame):
+            left_value_obj = left(frame)
+            right_value_obj = right(frame)
+            if left_value_obj.type() == "int" and right_value_obj.type() == "int":
+                return int_op(left_value_obj, right_value_obj)
+            return slow_op(left_value_obj, right_value_obj)
+
+        return int_binary_op
+
+    # --- calls --------------------------------------------------------------
+
+    def __call(self, func_name, actual_args, args_checked=False):
+        if func_name == "print":
+            return self.__print(actual_args)
+        if func_name == "inputi" or func_name == "inputs":
+            return self.__input(func_name, actual_args)
+
+        error = self.error
+        function = self.functions.get((func_name, len(actual_args)))
+        if function is None:
+            if any(name == func_name for name, _ in self.functions):
+                message = f"Function {func_name} taking {len(actual_args)} params not found"
+            else:
+                message = f"Function {func_name} not found"
+
+            def missing_function(frame):
+                error(ErrorType.NAME_ERROR, message)
+
+            return missing_function
+
+        build_frame = self.__frame_builder(function, actual_args, args_checked)
+        return_value = return_coercion(self.interpreter, function.func_def.return_type)
+        nil_value = self.interpreter.NIL_VALUE
+
+        def call(frame):
+            return_val = function.body(build_frame(frame))
+            # tail calls return the same type, so this call's coercion covers them too
+            while return_val.__class__ is TailCall:
+                return_val = return_val.function.body(return_val.frame)
+            return return_value(nil_value if return_val is None else return_val)
+
+        pool = self.interpreter.pool
+        if pool is not None:
+
+            # the same, handing each finished frame's frame-local structs to the StructPool
+            def pooled_call(frame):
+                callee_frame = build_frame(frame)
+                return_val = function.body(callee_frame)
+                pool.release(callee_frame, function.func_def.pooled_slots)
+                while return_val.__class__ is TailCall:
+                    callee, callee_frame = return_val.function, return_val.frame
+                    return_val = callee.body(callee_frame)
+                    pool.release(callee_frame, callee.func_def.pooled_slots)
+                return return_value(nil_value if return_val is None else return_val)
+
+            call = pooled_call
+
+        memo = self.interpreter.memo
+        if memo is None or not function.func_def.pure:
+            return call
+
+        func_def = function.func_def
+        param_slots = func_def.param_slots
+
+        def memo_call(frame):
+            callee_frame = build_frame(frame)
+            key = MemoCache.key(func_def, [callee_frame[slot] for slot in param_slots])
+            return_val = memo.get(key)
+            if return_val is not None:
+                return return_val
+            return_val = function.body(callee_frame)
+            while return_val.__class__ is TailCall:
+                return_val = return_val.function.body(return_val.frame)
+            return_val = return_value(nil_value if return_val is None else return_val)
+            memo.put(key, return_val)
+            return return_val
+
+        return memo_call
+
+    # a call brewinline replaced with the callee's body: the arguments go into
+    # the body's parameter slots in the caller's frame, and the body runs there
+    def __inline(self, inline_ast):
+        function = self.functions[inline_ast.name, len(inline_ast.args)]
+        func_def = function.func_def
+        binders = [
+            (slot, self.__argument(func_def.name, formal_ast, actual_ast, inline_ast.args_checked))
+            for slot, formal_ast, actual_ast in zip(inline_ast.param_slots, func_def.args, inline_ast.args)
+        ]
+        body = self.__block(inline_ast.statements)
+        return_value = return_coercion(self.interpreter, func_def.return_type)
+        nil_value = self.interpreter.NIL_VALUE
+
+        def inline(frame):
+            for slot, binder in binders:
+                frame[slot] = binder(frame)
+            return_val = body(frame)
+            return return_value(nil_value if return_val is None else return_val)
+
+        return inline
+
+    # returns a closure that evaluates a call's arguments in the caller's frame
+    # and returns the callee's new frame
+    def __frame_builder(self, function, actual_args, args_checked):
+        func_def = function.func_def
+        func_name = func_def.name
+        binders = [
+            (slot, self.__argument(func_name, formal_ast, actual_ast, args_checked))
+            for slot, formal_ast, actual_ast in zip(func_def.param_slots, func_def.args, actual_args)
+        ]
+        nlocals = func_def.nlocals
+
+        def build_frame(frame):
+            callee_frame = [None] * nlocals
+            for slot, binder in binders:
+                callee_frame[slot] = binder(frame)
+            return callee_frame
+
+        return build_frame
+
+    # returns a closure that evaluates and checks one actual argument
+    def __argument(self, func_name, formal_ast, actual_ast, checked):
+        arg_name = formal_ast.name
+        arg_type = formal_ast.var_type
+        error = self.error
+        structs = self.structs
+        expression = self.__expression(actual_ast)
+
+        if checked:
+            return expression
+
+        if arg_type not in PRIMITIVE_TYPES and arg_type not in structs:
+
+            def bad_formal(frame):
+                error(
+                    ErrorType.NAME_ERROR,
+                    f"Invalid type for formal parameter {arg_name} in function {func_name}*/",
+                )
+
+            return bad_formal
+
+        mismatch = f"Formal parameter {arg_name} excepted struct of type {arg_type}, type mismatch*/"
+        if arg_type not in structs:
+            evaluate = expression
+        elif actual_ast.get("var_type") is not None and actual_ast.get("var_type") == arg_type:
+            evaluate = expression
+        elif actual_ast.elem_type == InterpreterBase.VAR_NODE and actual_ast.path is not None:
+            field_type = actual_ast.path.field_type
+            if field_type is not None and field_type != arg_type:
+
+                def evaluate(frame):
+                    error(ErrorType.TYPE_ERROR, mismatch)
+
+            else:
+                evaluate = expression
+        else:
+            type_of_struct_dict = self.interpreter.type_of_struct_dict
+            actual_name = actual_ast.get("name")
+
+            def evaluate(frame):
+                if arg_type != type_of_struct_dict[actual_name]:
+                    error(ErrorType.TYPE_ERROR, mismatch)
+                return expression(frame)
+
+        arg_is_struct = arg_type in structs
+
+        def argument(frame):
+            result = evaluate(frame)
+            result_type = result.type()
+            if arg_type == "bool" and result_type == "int":
+                return (TRUE if result.value() != 0 else FALSE)
+            if arg_is_struct and result_type == "nil":
+                return result
+            if arg_type != result_type:
+                error(ErrorType.TYPE_ERROR, f"Wrong type for parameter input")
+            return result
+
+        return argument
+
+    def __print(self, actual_args):
+        args = [self.__expression(arg) for arg in actual_args]
+        output = self.interpreter.output
+
+        def call_print(frame):
+            text = ""
+            for arg in args:
+                text = text + get_printable(arg(frame))
+            output(text)
+            return InterpreterBase.VOID_DEF
+
+        return call_print
+
+    def __input(self, func_name, actual_args):
+        interpreter = self.interpreter
+        error = self.error
+        prompt = self.__expression(actual_args[0]) if len(actual_args) == 1 else None
+        too_many = len(actual_args) > 1
+
+        def call_input(frame):
+            if prompt is not None:
+                interpreter.output(get_printable(prompt(frame)))
+            elif too_many:
+                error(ErrorType.NAME_ERROR, "No inputi() function that takes > 1 parameter")
+            inp = interpreter.get_input()
+            if func_name == "inputi":
+                return int_value(int(inp))
+            return Value(Type.STRING, inp)
+
+        return call_input
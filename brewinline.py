@@ -0,0 +1,315 @@
+# Inlining of small functions.
+#
+# An Inliner passed to the Interpreter (inliner=...) replaces calls to small,
+# non-recursive user functions with the callee's body (element.InlineNode), so
+# running one skips the call itself: the function lookup, the new frame and the
+# Python recursion of the call. What a call does with its arguments and result
+# is kept: the arguments are evaluated and checked exactly as for the call, the
+# body runs until it returns or falls off the end, and the value it returns goes
+# through the callee's return coercion. The body's variables get slots of their
+# own at the end of the caller's frame (one set per call site), so nothing in it
+# can see or change the caller's variables.
+#
+# A function is small when its body, after its own calls were inlined, has at
+# most max_size AST nodes; a caller grows by at most max_growth nodes. Calls to
+# a function that can reach itself through its calls are never inlined.
+from brewopt import rebuild
+from element import InlineNode, ProgramNode
+from intbase import InterpreterBase
+
+DEFAULT_MAX_SIZE = 40
+DEFAULT_MAX_GROWTH = 400
+
+
+# inlined and skipped describe the last run: one (caller, callee, size) triple
+# per call site inlined, and callee -> why calls to it weren't
+class Inliner:
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, max_growth=DEFAULT_MAX_GROWTH):
+        self.max_size = max_size
+        self.max_growth = max_growth
+        self.inlined = []
+        self.skipped = {}
+
+    # a copy of the program with the calls that qualify inlined
+    # functions: name -> {number of params -> FuncNode}, as Interpreter.func_name_to_ast
+    def inline(self, ast, functions):
+        self.inlined = []
+        self.skipped = {}
+        expander = _Expander(self, functions)
+        return ProgramNode(ast.structs, [expander.expand(func_def) for func_def in ast.functions])
+
+    def report(self):
+        lines = [f"inliner: {len(self.inlined)} call sites inlined"]
+        for caller, callee, size in self.inlined:
+            lines.append(f"  {callee} into {caller} (size {size})")
+        for callee, reason in self.skipped.items():
+            lines.append(f"  not {callee}: {reason}")
+        return "\n".join(lines)
+
+
+class _Expander:
+    def __init__(self, inliner, functions):
+        self.inliner = inliner
+        self.functions = functions
+        self.recursive = _recursive_functions(functions)
+        self.expanded = {}  # FuncNode -> the FuncNode with its calls inlined
+
+    def expand(self, func_def):
+        expanded = self.expanded.get(func_def)
+        if expanded is None:
+            self.caller = func_def
+            self.nlocals = func_def.nlocals
+            self.growth = 0
+            statements = self.statements(func_def.statements)
+            expanded = rebuild(func_def, statements=statements, nlocals=self.nlocals)
+            self.expanded[func_def] = expanded
+        return expanded
+
+    def statements(self, statements):
+        return [self.statement(statement) for statement in statements]
+
+    def statement(self, statement):
+        kind = statement.elem_type
+        if kind == "=":
+            return rebuild(statement, expression=self.expression(statement.expression))
+        if kind == InterpreterBase.IF_NODE:
+            else_statements = statement.else_statements
+            if else_statements is not None:
+                else_statements = self.statements(else_statements)
+            return rebuild(
+                statement,
+                condition=self.expression(statement.condition),
+                statements=self.statements(statement.statements),
+                else_statements=else_statements,
+            )
+        if kind == InterpreterBase.FOR_NODE:
+            return rebuild(
+                statement,
+                init=self.statement(statement.init),
+                condition=self.expression(statement.condition),
+                update=self.statement(statement.update),
+                statements=self.statements(statement.statements),
+            )
+        if kind == InterpreterBase.RETURN_NODE:
+            if statement.expression is None:
+                return statement
+            return rebuild(statement, expression=self.expression(statement.expression))
+        if kind == InterpreterBase.FCALL_NODE:
+            return self.expression(statement)
+        if kind == InterpreterBase.FIELD_SLOT_ASSIGN_NODE:
+            return rebuild(statement, expression=self.expression(statement.expression))
+        return statement
+
+    def expression(self, expr):
+        kind = expr.elem_type
+        if kind == InterpreterBase.FCALL_NODE:
+            args = [self.expression(arg) for arg in expr.args]
+            return self.call(expr, args)
+        if kind == InterpreterBase.NEG_NODE or kind == InterpreterBase.NOT_NODE:
+            return rebuild(expr, op1=self.expression(expr.op1))
+        if hasattr(expr, "op2"):
+            return rebuild(expr, op1=self.expression(expr.op1), op2=self.expression(expr.op2))
+        return expr
+
+    # the call with its (already expanded) args, inlined if it qualifies
+    def call(self, call, args):
+        if call.builtin is not None:
+            return rebuild(call, args=args)
+        callee = self.functions.get(call.name, {}).get(len(args))
+        if callee is None:
+            return rebuild(call, args=args)
+        if callee in self.recursive:
+            self.inliner.skipped[callee.name] = "recursive"
+            return rebuild(call, args=args)
+
+        caller, nlocals, growth = self.caller, self.nlocals, self.growth
+        body = self.expand(callee)
+        self.caller, self.nlocals, self.growth = caller, nlocals, growth
+
+        size = _size(body.statements)
+        if size > self.inliner.max_size:
+            self.inliner.skipped[callee.name] = f"size {size} > {self.inliner.max_size}"
+            return rebuild(call, args=args)
+        if self.growth + size > self.inliner.max_growth:
+            self.inliner.skipped[callee.name] = f"{caller.name} would grow past {self.inliner.max_growth}"
+            return rebuild(call, args=args)
+
+        offset = self.nlocals
+        self.nlocals += body.nlocals
+        self.growth += size
+        self.inliner.inlined.append((caller.name, callee.name, size))
+        return InlineNode(
+            call.name,
+            args,
+            body,
+            tuple(slot + offset for slot in body.param_slots),
+            _Relocator(offset).statements(body.statements),
+        )
+
+
+# the functions that can call themselves, directly or through other functions
+def _recursive_functions(functions):
+    calls = {}
+    for overloads in functions.values():
+        for func_def in overloads.values():
+            callees = set()
+            _collect_calls(func_def.statements, functions, callees)
+            calls[func_def] = callees
+
+    recursive = set()
+    for func_def in calls:
+        seen = set()
+        pending = list(calls[func_def])
+        while pending:
+            callee = pending.pop()
+            if callee is func_def:
+                recursive.add(func_def)
+                break
+            if callee not in seen:
+                seen.add(callee)
+                pending.extend(calls[callee])
+    return recursive
+
+
+def _collect_calls(node, functions, callees):
+    if isinstance(node, list):
+        for item in node:
+            _collect_calls(item, functions, callees)
+        return
+    if node is None:
+        return
+    if node.elem_type == InterpreterBase.FCALL_NODE:
+        callee = functions.get(node.name, {}).get(len(node.args))
+        if callee is not None and node.builtin is None:
+            callees.add(callee)
+    for child in _children(node):
+        _collect_calls(child, functions, callees)
+
+
+# the nodes directly under a statement or expression
+def _children(node):
+    kind = node.elem_type
+    if kind == "=" or kind == InterpreterBase.FIELD_SLOT_ASSIGN_NODE:
+        return [node.expression]
+    if kind == InterpreterBase.IF_NODE:
+        return [node.condition, node.statements, node.else_statements]
+    if kind == InterpreterBase.FOR_NODE:
+        return [node.init, node.condition, node.update, node.statements]
+    if kind == InterpreterBase.RETURN_NODE:
+        return [node.expression]
+    if kind == InterpreterBase.FCALL_NODE or kind == InterpreterBase.INLINE_NODE:
+        return [node.args]
+    if kind == InterpreterBase.CACHED_NODE:
+        return [node.expression]
+    if kind == InterpreterBase.NEG_NODE or kind == InterpreterBase.NOT_NODE:
+        return [node.op1]
+    if hasattr(node, "op2"):
+        return [node.op1, node.op2]
+    return []
+
+
+# the number of AST nodes in statements, counting an inlined body's
+def _size(statements):
+    size = 0
+    for node in statements:
+        if node is None:
+            continue
+        if isinstance(node, list):
+            size += _size(node)
+            continue
+        size += 1
+        size += _size(_children(node))
+        if node.elem_type == InterpreterBase.INLINE_NODE:
+            size += _size(node.statements)
+    return size
+
+
+# Copies a function body for inlining: every slot moves up by offset, and the
+# per-run marks (tail calls, counting loops, call site caches) start out clear,
+# as the marking passes only visit the functions' own statements.
+class _Relocator:
+    def __init__(self, offset):
+        self.offset = offset
+
+    def slot(self, slot):
+        return None if slot is None else slot + self.offset
+
+    def statements(self, statements):
+        return [self.statement(statement) for statement in statements]
+
+    def statement(self, statement):
+        kind = statement.elem_type
+        if kind == InterpreterBase.VAR_DEF_NODE:
+            return rebuild(statement, slot=self.slot(statement.slot))
+        if kind == "=":
+            return rebuild(
+                statement,
+                expression=self.expression(statement.expression),
+                slot=self.slot(statement.slot),
+                path=self.path(statement.path),
+            )
+        if kind == InterpreterBase.IF_NODE:
+            else_statements = statement.else_statements
+            if else_statements is not None:
+                else_statements = self.statements(else_statements)
+            return rebuild(
+                statement,
+                condition=self.expression(statement.condition),
+                statements=self.statements(statement.statements),
+                else_statements=else_statements,
+            )
+        if kind == InterpreterBase.FOR_NODE:
+            return rebuild(
+                statement,
+                init=self.statement(statement.init),
+                condition=self.expression(statement.condition),
+                update=self.statement(statement.update),
+                statements=self.statements(statement.statements),
+                counter=None,
+            )
+        if kind == InterpreterBase.RETURN_NODE:
+            expression = statement.expression
+            if expression is not None:
+                expression = self.expression(expression)
+            return rebuild(statement, expression=expression, tail_call=None)
+        if kind == InterpreterBase.FCALL_NODE or kind == InterpreterBase.INLINE_NODE:
+            return self.expression(statement)
+        if kind == InterpreterBase.UNCACHE_NODE or kind == InterpreterBase.FIELD_SLOTS_NODE:
+            return rebuild(statement, slots=tuple(self.slot(slot) for slot in statement.slots))
+        if kind == InterpreterBase.FIELD_SLOT_ASSIGN_NODE:
+            return rebuild(
+                statement,
+                target=self.expression(statement.target),
+                expression=self.expression(statement.expression),
+            )
+        # try and raise statements are never run
+        return statement
+
+    def expression(self, expr):
+        kind = expr.elem_type
+        if kind == InterpreterBase.VAR_NODE:
+            return rebuild(expr, slot=self.slot(expr.slot), path=self.path(expr.path))
+        if kind == InterpreterBase.FCALL_NODE:
+            return rebuild(expr, args=[self.expression(arg) for arg in expr.args], call_site=None)
+        if kind == InterpreterBase.INLINE_NODE:
+            return rebuild(
+                expr,
+                args=[self.expression(arg) for arg in expr.args],
+                param_slots=tuple(self.slot(slot) for slot in expr.param_slots),
+                statements=self.statements(expr.statements),
+                call_site=None,
+            )
+        if kind == InterpreterBase.CACHED_NODE:
+            return rebuild(expr, expression=self.expression(expr.expression), slot=self.slot(expr.slot))
+        if kind == InterpreterBase.FIELD_SLOT_NODE:
+            return rebuild(expr, slot=self.slot(expr.slot))
+        if kind == InterpreterBase.NEG_NODE or kind == InterpreterBase.NOT_NODE:
+            return rebuild(expr, op1=self.expression(expr.op1))
+        if hasattr(expr, "op2"):
+            return rebuild(expr, op1=self.expression(expr.op1), op2=self.expression(expr.op2))
+        return expr
+
+    def path(self, path):
+        if path is None:
+            return None
+        return rebuild(path, base_slot=self.slot(path.base_slot))
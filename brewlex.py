@@ -1,3 +1,4 @@
+import os
 
 from ply import lex
 
@@ -132,5 +133,35 @@ def t_error(t):
 def reset_lineno():
     lexer.lineno = 1
 
+
+# Set BREWIN_PARSER_REFLECT=1 to build the lexer and parser from the rules in this
+# module and brewparse.py instead of the generated lextab.py/parsetab.py. Either way
+# nothing is written to disk at import time; run `python brewparse.py` to regenerate
+# the tables after changing the grammar.
+REFLECT = os.environ.get("BREWIN_PARSER_REFLECT", "") not in ("", "0")
+
+
+def build_lexer():
+    if not REFLECT and has_lextab():
+        return lex.lex(optimize=True, lextab="lextab")
+    # lex() only writes lextab.py in optimized mode, so this never touches the disk
+    return lex.lex()
+
+
+# lex() collects the rules from its caller's globals, so it has to run here for the
+# single-character rules (notably the catch-all t_DOT) to keep their definition order
+def write_lextab(outputdir):
+    lex.lex().writetab("lextab", outputdir)
+
+
+def has_lextab():
+    try:
+        import lextab
+    except ImportError:
+        return False
+    # lex(optimize=True) rewrites a table it can't read, so only use one that matches
+    return getattr(lextab, "_tabversion", None) == lex.__tabversion__
+
+
 # Build the lexer
-lexer = lex.lex()
+lexer = build_lexer()
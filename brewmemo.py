@@ -0,0 +1,167 @@
+# Memoization of pure Brewin functions.
+#
+# A function is pure when a call can't do anything but compute its result from
+# its arguments, so a call with the same arguments can be answered from a cache
+# instead of running the body again. mark_pure_functions decides that from the
+# function table; a MemoCache passed to the Interpreter (memo_cache=...) turns
+# the caching on.
+from collections import OrderedDict
+
+from intbase import InterpreterBase
+
+DEFAULT_MAX_ENTRIES = 4096
+
+# parameter, return and variable types a pure function may use: values of these
+# types are never changed once built, so they can be compared and kept as keys
+_PURE_TYPES = ("int", "string", "bool")
+
+
+# Set FuncNode.pure on every function in the table. A function is pure when:
+#   - its parameters and return value are ints, strings or bools,
+#   - it declares no struct variables (which would write type_of_struct_dict),
+#     and neither creates a struct nor reads or writes a field,
+#   - it doesn't call print, inputi or inputs, and every function it calls is pure.
+# The last rule is solved for the largest set of functions that satisfies it, so
+# recursive and mutually recursive functions can be pure.
+#
+# functions: name -> {number of params -> FuncNode}, as Interpreter.func_name_to_ast
+def mark_pure_functions(functions):
+    calls = {}
+    for overloads in functions.values():
+        for func_def in overloads.values():
+            func_def.pure = False
+            callees = set()
+            if (
+                func_def.return_type in _PURE_TYPES
+                and all(arg.var_type in _PURE_TYPES for arg in func_def.args)
+                and _pure_statements(func_def.statements, callees)
+            ):
+                calls[func_def] = callees
+
+    pure = set(calls)
+    changed = True
+    while changed:
+        changed = False
+        for func_def in list(pure):
+            for name, num_params in calls[func_def]:
+                if functions.get(name, {}).get(num_params) not in pure:
+                    pure.discard(func_def)
+                    changed = True
+                    break
+    for func_def in pure:
+        func_def.pure = True
+
+
+# whether the statements are pure apart from their calls; the (name, number of
+# params) of the user functions they call are added to callees
+def _pure_statements(statements, callees):
+    for statement in statements:
+        kind = statement.elem_type
+        if kind == InterpreterBase.VAR_DEF_NODE:
+            if statement.var_type not in _PURE_TYPES:
+                return False
+        elif kind == "=":
+            if statement.path is not None or not _pure_expression(statement.expression, callees):
+                return False
+        elif kind == InterpreterBase.FCALL_NODE or kind == InterpreterBase.INLINE_NODE:
+            if not _pure_expression(statement, callees):
+                return False
+        elif kind == InterpreterBase.FIELD_SLOT_ASSIGN_NODE:
+            return False
+        elif kind == InterpreterBase.RETURN_NODE:
+            if statement.expression is not None and not _pure_expression(statement.expression, callees):
+                return False
+        elif kind == InterpreterBase.IF_NODE:
+            if not (
+                _pure_expression(statement.condition, callees)
+                and _pure_statements(statement.statements, callees)
+                and _pure_statements(statement.else_statements or [], callees)
+            ):
+                return False
+        elif kind == InterpreterBase.FOR_NODE:
+            if not (
+                _pure_statements([statement.init, statement.update], callees)
+                and _pure_expression(statement.condition, callees)
+                and _pure_statements(statement.statements, callees)
+            ):
+                return False
+        # try and raise statements are never run
+    return True
+
+
+def _pure_expression(expr, callees):
+    kind = expr.elem_type
+    if kind == InterpreterBase.NEW_NODE:
+        return False
+    if kind == InterpreterBase.VAR_NODE:
+        return expr.path is None
+    if kind == InterpreterBase.FIELD_SLOT_NODE:
+        return False
+    # an inlined call is as pure as the function it calls
+    if kind == InterpreterBase.FCALL_NODE or kind == InterpreterBase.INLINE_NODE:
+        if expr.name in ("print", "inputi", "inputs"):
+            return False
+        callees.add((expr.name, len(expr.args)))
+        return all(_pure_expression(arg, callees) for arg in expr.args)
+    if kind == InterpreterBase.CACHED_NODE:
+        return _pure_expression(expr.expression, callees)
+    if kind == InterpreterBase.NEG_NODE or kind == InterpreterBase.NOT_NODE:
+        return _pure_expression(expr.op1, callees)
+    if hasattr(expr, "op2"):
+        return _pure_expression(expr.op1, callees) and _pure_expression(expr.op2, callees)
+    return True
+
+
+# Results of calls to pure functions, keyed by (name, number of params, argument
+# values). max_entries bounds the cache (None disables the limit); the least
+# recently used entry is evicted first. hits, misses and evictions count over
+# the cache's lifetime; the entries themselves are dropped at the start of
+# every run, since another program can reuse a function's name.
+class MemoCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # args: the call's argument Values, after the parameter checks and coercions
+    @staticmethod
+    def key(func_def, args):
+        return (func_def.name, len(func_def.args), tuple((arg.type(), arg.value()) for arg in args))
+
+    # the cached return Value, or None
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        if self.max_entries is not None and len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        calls = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "hit_rate": self.hits / calls if calls else 0.0,
+        }
+
+    def report(self):
+        stats = self.stats()
+        return (
+            f"memo: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate), "
+            f"{stats['evictions']} evictions, {stats['entries']} entries"
+        )
@@ -0,0 +1,884 @@
+# Constant folding, constant propagation, dead code elimination, loop-invariant
+# code motion, sharing of repeated field reads and replacement of local structs.
+#
+# optimize() rewrites a resolved program (brewresolve.resolve has run) into an
+# equivalent one that does less at run time:
+#
+# Folding: an operator whose operands are all literals is replaced by the
+# literal of its result, computed by the same code the backends run
+# (brewrules.general_binary_op, and the tree walker's neg and !), so integer
+# division, the int/bool coercions and every comparison come out exactly as
+# they would have. An operator that would fail (a division by zero, a type
+# error) is left as it is, to fail when the program gets to it.
+#
+# Propagation: a local int, bool or string variable assigned a literal exactly
+# once in its function, by an assignment in the same block as its definition,
+# holds that literal from the assignment until the block ends. Its uses in the
+# statements after the assignment are replaced by the literal, which can then
+# fold further; the assignment itself stays, as it's still where a type error
+# would be reported. A use that is an argument to a struct parameter is kept,
+# as binding one checks the variable itself.
+#
+# Dead code: an if whose condition is a literal is replaced by the branch it
+# takes, a for whose condition is a literal false by its init, and the
+# statements after a return in the same block are dropped.
+#
+# Loop invariants: in a for loop's body, an expression of operators over
+# literals, variables the loop doesn't assign and (in a loop that assigns no
+# field and calls no user function) field reads off such variables is wrapped
+# in an element.CachedNode, preceded by an UncacheNode before the loop: it runs
+# where it always did, but only the first time it gets there each time the loop
+# runs. The loop's condition and update keep their form for mark_counting_loops.
+#
+# Field reads: within a block, a field path read more than once, with nothing
+# in between that could change it (assigning its base variable or any field,
+# calling a user function), is read once and its value shared the same way.
+# Paths are split into steps by brewresolve already; this saves walking them.
+#
+# A field read passed to a user function stays as it is, as binding it to a
+# struct parameter looks at the read itself. The cached values live in slots
+# added at the end of the function's frame (FuncNode.nlocals grows).
+#
+# Local structs: a struct variable that only ever holds nil or a new struct of
+# its own type made in its function, and is otherwise only used through its
+# fields (never passed, returned, compared, printed or stored anywhere), has no
+# instance anyone else could see. Its fields get a frame slot each instead
+# (element.FieldSlotsNode, FieldSlotNode, FieldSlotAssignNode), so running it
+# skips the allocation and the step from the variable to the instance. Reads
+# and stores still check and coerce as on an instance, and one that finds the
+# variable nil fails the same way; the variable's own slot is kept but stays
+# nil, and nothing reads it.
+#
+# The program passed in is not changed: nodes on the way to a rewritten one are
+# copied, with their annotations (slots and the like), and the rest are shared.
+# The result needs the per-run marking passes (mark_tail_calls and so on) and
+# brewcheck.check run on it like any other program.
+from brewrules import general_binary_op
+from element import (
+    BoolNode,
+    CachedNode,
+    FieldSlotAssignNode,
+    FieldSlotNode,
+    FieldSlotsNode,
+    IntNode,
+    ProgramNode,
+    StringNode,
+    UncacheNode,
+)
+from intbase import InterpreterBase
+from type_valuev2 import FALSE, NIL, TRUE, Type, int_value
+
+_PRIMITIVE_TYPES = (Type.INT, Type.BOOL, Type.STRING)
+
+
+# interpreter: the Interpreter the program runs on, with its struct and
+# function tables set up
+def optimize(ast, interpreter):
+    optimizer = _Optimizer(interpreter)
+    return ProgramNode(ast.structs, [optimizer.function(func_def) for func_def in ast.functions])
+
+
+# slot -> struct type of the struct variables in a function's (resolved)
+# statements whose struct never leaves the frame: the ones scalar replacement
+# would give a slot per field (see _StructUses)
+def frame_local_structs(statements, structs):
+    uses = _StructUses(structs)
+    uses.statements(statements)
+    return {slot: var_type for slot, var_type in uses.candidates.items() if slot not in uses.escaped}
+
+
+# raised in place of Interpreter.error while folding, which would record the
+# error on the interpreter
+class _NotConstant(Exception):
+    pass
+
+
+# what general_binary_op needs of an interpreter, minus the error bookkeeping
+class _Folder:
+    def __init__(self, interpreter):
+        self.op_to_lambda = interpreter.op_to_lambda
+        self.structs = interpreter.structs
+
+    @staticmethod
+    def error(error_type, description=None):
+        raise _NotConstant(description)
+
+
+class _Optimizer:
+    def __init__(self, interpreter):
+        self.functions = interpreter.func_name_to_ast
+        self.structs = interpreter.structs
+        self.folder = _Folder(interpreter)
+        self.binary_ops = {}
+        self.substituted = 0
+
+    def function(self, func_def):
+        statements = self.statements(func_def.statements)
+        while True:
+            assigned = {}
+            _count_assignments(statements, assigned)
+            self.substituted = 0
+            statements = self.propagate(statements, {}, assigned)
+            if not self.substituted:
+                break
+            statements = self.statements(statements)
+        self.nlocals = func_def.nlocals
+        statements = self.share(self.hoist(self.replace_structs(statements)))
+        return rebuild(func_def, statements=statements, nlocals=self.nlocals)
+
+    def new_slot(self):
+        self.nlocals += 1
+        return self.nlocals - 1
+
+    # --- folding and dead code ----------------------------------------------
+
+    def statements(self, statements):
+        result = []
+        for statement in statements:
+            kind = statement.elem_type
+            if kind == InterpreterBase.IF_NODE:
+                condition = self.expression(statement.condition)
+                then_statements = self.statements(statement.statements)
+                else_statements = statement.else_statements
+                if else_statements is not None:
+                    else_statements = self.statements(else_statements)
+                taken = _truth(condition)
+                if taken is True:
+                    result.extend(then_statements)
+                elif taken is False:
+                    result.extend(else_statements or ())
+                else:
+                    result.append(rebuild(
+                        statement,
+                        condition=condition,
+                        statements=then_statements,
+                        else_statements=else_statements,
+                    ))
+            elif kind == InterpreterBase.FOR_NODE:
+                init = self.assignment(statement.init)
+                condition = self.expression(statement.condition)
+                if _truth(condition) is False:
+                    result.append(init)
+                else:
+                    result.append(rebuild(
+                        statement,
+                        init=init,
+                        condition=condition,
+                        update=self.assignment(statement.update),
+                        statements=self.statements(statement.statements),
+                    ))
+            elif kind == "=":
+                result.append(self.assignment(statement))
+            elif kind == InterpreterBase.RETURN_NODE:
+                if statement.expression is not None:
+                    statement = rebuild(statement, expression=self.expression(statement.expression))
+                result.append(statement)
+            elif kind == InterpreterBase.FCALL_NODE:
+                result.append(self.expression(statement))
+            else:
+                result.append(statement)
+            # nothing after a return runs (a spliced branch can only end with one)
+            if result and result[-1].elem_type == InterpreterBase.RETURN_NODE:
+                break
+        return result
+
+    def assignment(self, assign_ast):
+        expression = self.expression(assign_ast.expression)
+        if expression is assign_ast.expression:
+            return assign_ast
+        return rebuild(assign_ast, expression=expression)
+
+    def expression(self, expr):
+        kind = expr.elem_type
+        if kind == InterpreterBase.FCALL_NODE:
+            args = [self.expression(arg) for arg in expr.args]
+            return rebuild(expr, args=args)
+        if kind == InterpreterBase.NEG_NODE or kind == InterpreterBase.NOT_NODE:
+            op1 = self.expression(expr.op1)
+            value = _constant(op1)
+            if value is not None:
+                folded = _literal(_unary(kind, value))
+                if folded is not None:
+                    return folded
+            return expr if op1 is expr.op1 else rebuild(expr, op1=op1)
+        if hasattr(expr, "op2"):
+            op1 = self.expression(expr.op1)
+            op2 = self.expression(expr.op2)
+            left, right = _constant(op1), _constant(op2)
+            if left is not None and right is not None:
+                folded = _literal(self.binary(kind, left, right))
+                if folded is not None:
+                    return folded
+            if op1 is expr.op1 and op2 is expr.op2:
+                return expr
+            return rebuild(expr, op1=op1, op2=op2)
+        return expr
+
+    # the Value of op applied to two constants, or None where that would fail
+    def binary(self, op, left, right):
+        binary_op = self.binary_ops.get(op)
+        if binary_op is None:
+            binary_op = self.binary_ops[op] = general_binary_op(self.folder, op)
+        try:
+            return binary_op(left, right)
+        except Exception:  # _NotConstant, or ZeroDivisionError from "/"
+            return None
+
+    # --- propagation ---------------------------------------------------------
+
+    # constants: slot -> literal, for the variables known to hold one here
+    # assigned: slot -> number of assignments to it in the function
+    def propagate(self, statements, constants, assigned):
+        constants = dict(constants)
+        defined = set()
+        result = []
+        for statement in statements:
+            statement = self.propagate_statement(statement, constants, assigned)
+            result.append(statement)
+            kind = statement.elem_type
+            if kind == InterpreterBase.VAR_DEF_NODE:
+                if statement.slot is not None and statement.var_type in _PRIMITIVE_TYPES:
+                    defined.add(statement.slot)
+            elif (
+                kind == "="
+                and statement.path is None
+                and statement.slot in defined
+                and assigned[statement.slot] == 1
+                and statement.expression.elem_type != InterpreterBase.NIL_NODE
+                and _literal(_constant(statement.expression)) is not None
+            ):
+                constants[statement.slot] = statement.expression.constant
+        return result
+
+    def propagate_statement(self, statement, constants, assigned):
+        kind = statement.elem_type
+        if kind == "=":
+            return self.substitute_assignment(statement, constants)
+        if kind == InterpreterBase.IF_NODE:
+            else_statements = statement.else_statements
+            if else_statements is not None:
+                else_statements = self.propagate(else_statements, constants, assigned)
+            return rebuild(
+                statement,
+                condition=self.substitute(statement.condition, constants),
+                statements=self.propagate(statement.statements, constants, assigned),
+                else_statements=else_statements,
+            )
+        if kind == InterpreterBase.FOR_NODE:
+            return rebuild(
+                statement,
+                init=self.substitute_assignment(statement.init, constants),
+                condition=self.substitute(statement.condition, constants),
+                update=self.substitute_assignment(statement.update, constants),
+                statements=self.propagate(statement.statements, constants, assigned),
+            )
+        if kind == InterpreterBase.RETURN_NODE:
+            if statement.expression is None:
+                return statement
+            return rebuild(statement, expression=self.substitute(statement.expression, constants))
+        if kind == InterpreterBase.FCALL_NODE:
+            return self.substitute(statement, constants)
+        return statement
+
+    def substitute_assignment(self, assign_ast, constants):
+        expression = self.substitute(assign_ast.expression, constants)
+        if expression is assign_ast.expression:
+            return assign_ast
+        return rebuild(assign_ast, expression=expression)
+
+    def substitute(self, expr, constants):
+        if not constants:
+            return expr
+        kind = expr.elem_type
+        if kind == InterpreterBase.VAR_NODE:
+            if expr.path is None and expr.slot in constants:
+                self.substituted += 1
+                return _literal(constants[expr.slot])
+            return expr
+        if kind == InterpreterBase.FCALL_NODE:
+            params = self.params(expr)
+            args = []
+            for i, arg in enumerate(expr.args):
+                if arg.elem_type == InterpreterBase.VAR_NODE and (params is None or params[i] not in _PRIMITIVE_TYPES):
+                    args.append(arg)
+                else:
+                    args.append(self.substitute(arg, constants))
+            return rebuild(expr, args=args)
+        if kind == InterpreterBase.NEG_NODE or kind == InterpreterBase.NOT_NODE:
+            op1 = self.substitute(expr.op1, constants)
+            return expr if op1 is expr.op1 else rebuild(expr, op1=op1)
+        if hasattr(expr, "op2"):
+            op1 = self.substitute(expr.op1, constants)
+            op2 = self.substitute(expr.op2, constants)
+            if op1 is expr.op1 and op2 is expr.op2:
+                return expr
+            return rebuild(expr, op1=op1, op2=op2)
+        return expr
+
+    # the declared parameter types of the function a call runs, or None when
+    # that's a built-in (whose arguments are only evaluated) or not known
+    def params(self, call):
+        if call.builtin is not None:
+            return _PRIMITIVE_TYPES * len(call.args)
+        callee = self.functions.get(call.name, {}).get(len(call.args))
+        if callee is None:
+            return None
+        return [arg.var_type for arg in callee.args]
+
+
+    # --- scalar replacement ----------------------------------------------------
+
+    # (frame_local_structs is the same analysis, for brewpool)
+    def replace_structs(self, statements):
+        uses = _StructUses(self.structs)
+        uses.statements(statements)
+        replaced = {}  # variable slot -> (struct type, field -> slot)
+        for slot, var_type in uses.candidates.items():
+            if slot not in uses.escaped:
+                offsets = self.structs[var_type].layout.offsets
+                fields = sorted(uses.fields.get(slot, ()), key=offsets.get)
+                replaced[slot] = (var_type, {field: self.new_slot() for field in fields})
+        if not replaced:
+            return statements
+        return self.replace_statements(statements, replaced)
+
+    def replace_statements(self, statements, replaced):
+        result = []
+        for statement in statements:
+            kind = statement.elem_type
+            if kind == InterpreterBase.VAR_DEF_NODE:
+                # kept for type_of_struct_dict; the variable starts out nil
+                result.append(statement)
+                if statement.slot in replaced:
+                    result.append(self.field_slots(statement, replaced, False))
+            elif kind == "=":
+                if statement.path is None and statement.slot in replaced:
+                    new = statement.expression.elem_type == InterpreterBase.NEW_NODE
+                    field_slots = self.field_slots(statement, replaced, new)
+                    previous = result[-1] if result else None
+                    if previous is not None and previous.elem_type == field_slots.elem_type:
+                        if previous.slots == field_slots.slots:
+                            result.pop()  # set again straight away
+                    result.append(field_slots)
+                elif statement.path is not None and statement.path.base_slot in replaced:
+                    result.append(FieldSlotAssignNode(
+                        self.field_slot(statement, replaced),
+                        self.replace_expression(statement.expression, replaced),
+                    ))
+                else:
+                    result.append(rebuild(
+                        statement, expression=self.replace_expression(statement.expression, replaced)
+                    ))
+            elif kind == InterpreterBase.IF_NODE:
+                else_statements = statement.else_statements
+                if else_statements is not None:
+                    else_statements = self.replace_statements(else_statements, replaced)
+                result.append(rebuild(
+                    statement,
+                    condition=self.replace_expression(statement.condition, replaced),
+                    statements=self.replace_statements(statement.statements, replaced),
+                    else_statements=else_statements,
+                ))
+            elif kind == InterpreterBase.FOR_NODE:
+                # (_StructUses keeps the variables a loop's init or update assigns)
+                init, update = statement.init, statement.update
+                result.append(rebuild(
+                    statement,
+                    init=rebuild(init, expression=self.replace_expression(init.expression, replaced)),
+                    condition=self.replace_expression(statement.condition, replaced),
+                    update=rebuild(update, expression=self.replace_expression(update.expression, replaced)),
+                    statements=self.replace_statements(statement.statements, replaced),
+                ))
+            elif kind == InterpreterBase.RETURN_NODE:
+                if statement.expression is not None:
+                    statement = rebuild(
+                        statement, expression=self.replace_expression(statement.expression, replaced)
+                    )
+                result.append(statement)
+            elif kind == InterpreterBase.FCALL_NODE:
+                result.append(self.replace_expression(statement, replaced))
+            else:
+                result.append(statement)
+        return result
+
+    def replace_expression(self, expr, replaced):
+        kind = expr.elem_type
+        if kind == InterpreterBase.VAR_NODE:
+            if expr.path is not None and expr.path.base_slot in replaced:
+                return self.field_slot(expr, replaced)
+            return expr
+        if kind == InterpreterBase.FCALL_NODE:
+            return rebuild(expr, args=[self.replace_expression(arg, replaced) for arg in expr.args])
+        if kind == InterpreterBase.NEG_NODE or kind == InterpreterBase.NOT_NODE:
+            return rebuild(expr, op1=self.replace_expression(expr.op1, replaced))
+        if hasattr(expr, "op2"):
+            return rebuild(
+                expr,
+                op1=self.replace_expression(expr.op1, replaced),
+                op2=self.replace_expression(expr.op2, replaced),
+            )
+        return expr
+
+    # the FieldSlotNode for a field read or assigned through a replaced variable
+    def field_slot(self, node, replaced):
+        path = node.path
+        var_type, slots = replaced[path.base_slot]
+        field = path.steps[0][0]
+        return FieldSlotNode(node.name, var_type, field, slots[field], path.steps[1:])
+
+    # the FieldSlotsNode for a replaced variable's definition or assignment:
+    # its fields' defaults when it's set to a new struct, None (nil) otherwise
+    def field_slots(self, node, replaced, new):
+        var_type, slots = replaced[node.slot]
+        struct_class = self.structs[var_type]
+        values = tuple(
+            struct_class.defaults[struct_class.layout.offsets[field]] if new else None
+            for field in slots
+        )
+        return FieldSlotsNode(node.name, tuple(slots.values()), values)
+
+    # --- loop-invariant expressions -------------------------------------------
+
+    # the statements with every for loop's invariant expressions cached, the
+    # loop preceded by the UncacheNode for them; outer loops go first, so an
+    # expression is cached for the outermost loop it doesn't change in
+    def hoist(self, statements):
+        result = []
+        for statement in statements:
+            kind = statement.elem_type
+            if kind == InterpreterBase.IF_NODE:
+                else_statements = statement.else_statements
+                if else_statements is not None:
+                    else_statements = self.hoist(else_statements)
+                statement = rebuild(
+                    statement,
+                    statements=self.hoist(statement.statements),
+                    else_statements=else_statements,
+                )
+            elif kind == InterpreterBase.FOR_NODE:
+                effects = _LoopEffects(statement)
+                cached = []
+                body = self.invariant_statements(statement.statements, effects, cached)
+                statement = rebuild(statement, statements=self.hoist(body))
+                if cached:
+                    result.append(UncacheNode(tuple(cached)))
+            result.append(statement)
+        return result
+
+    # the condition and update of a nested loop are left alone, as
+    # mark_counting_loops looks at them
+    def invariant_statements(self, statements, effects, cached):
+        result = []
+        for statement in statements:
+            kind = statement.elem_type
+            if kind == "=":
+                statement = rebuild(statement, expression=self.invariant(statement.expression, effects, cached))
+            elif kind == InterpreterBase.IF_NODE:
+                else_statements = statement.else_statements
+                if else_statements is not None:
+                    else_statements = self.invariant_statements(else_statements, effects, cached)
+                statement = rebuild(
+                    statement,
+                    condition=self.invariant(statement.condition, effects, cached),
+                    statements=self.invariant_statements(statement.statements, effects, cached),
+                    else_statements=else_statements,
+                )
+            elif kind == InterpreterBase.FOR_NODE:
+                init = statement.init
+                statement = rebuild(
+                    statement,
+                    init=rebuild(init, expression=self.invariant(init.expression, effects, cached)),
+                    statements=self.invariant_statements(statement.statements, effects, cached),
+                )
+            elif kind == InterpreterBase.RETURN_NODE:
+                if statement.expression is not None:
+                    statement = rebuild(statement, expression=self.invariant(statement.expression, effects, cached))
+            elif kind == InterpreterBase.FCALL_NODE:
+                statement = self.invariant(statement, effects, cached)
+            elif kind == InterpreterBase.FIELD_SLOT_ASSIGN_NODE:
+                statement = rebuild(statement, expression=self.invariant(statement.expression, effects, cached))
+            result.append(statement)
+        return result
+
+    # expr with its largest loop-invariant parts that are worth it cached
+    def invariant(self, expr, effects, cached):
+        if _worth_caching(expr) and effects.invariant(expr):
+            slot = self.new_slot()
+            cached.append(slot)
+            return CachedNode(expr, slot)
+        kind = expr.elem_type
+        if kind == InterpreterBase.FCALL_NODE:
+            args = [
+                arg if _checked_as_variable(expr, arg) else self.invariant(arg, effects, cached)
+                for arg in expr.args
+            ]
+            return rebuild(expr, args=args)
+        if kind == InterpreterBase.NEG_NODE or kind == InterpreterBase.NOT_NODE:
+            return rebuild(expr, op1=self.invariant(expr.op1, effects, cached))
+        if hasattr(expr, "op2"):
+            return rebuild(
+                expr,
+                op1=self.invariant(expr.op1, effects, cached),
+                op2=self.invariant(expr.op2, effects, cached),
+            )
+        return expr
+
+    # --- repeated field reads -------------------------------------------------
+
+    # the statements with the field reads that repeat within a block, before
+    # anything could change what they read, sharing one read; each block
+    # (the branches of an if, the body of a for) is one
+    def share(self, statements):
+        counter = _FieldReads(self, None)
+        counter.block(statements)
+        repeated = {read for read, count in counter.counts.items() if count > 1}
+        return _FieldReads(self, repeated).block(statements)
+
+
+# a copy of node with some fields replaced; annotations are carried over
+def rebuild(node, **fields):
+    copy = object.__new__(node.__class__)
+    for name in node.__class__.__slots__:
+        setattr(copy, name, fields[name] if name in fields else getattr(node, name))
+    return copy
+
+
+# the Value of a literal (or nil) node, or None for any other expression
+def _constant(expr):
+    kind = expr.elem_type
+    if kind == InterpreterBase.INT_NODE or kind == InterpreterBase.BOOL_NODE or kind == InterpreterBase.STRING_NODE:
+        return expr.constant
+    if kind == InterpreterBase.NIL_NODE:
+        return NIL
+    return None
+
+
+# a literal node holding value, or None for a value no literal can hold
+def _literal(value):
+    if value is None:
+        return None
+    val = value.value()
+    if value.type() == Type.INT and val.__class__ is int:
+        node = IntNode(val)
+    elif value.type() == Type.BOOL and val.__class__ is bool:
+        node = BoolNode(val)
+    elif value.type() == Type.STRING:
+        node = StringNode(val)
+    else:
+        return None
+    node.constant = value
+    return node
+
+
+# neg and ! of a constant, as the tree walker's __eval_unary, or None where
+# that's a type error
+def _unary(kind, value):
+    if kind == InterpreterBase.NEG_NODE:
+        return int_value(-1 * value.value()) if value.type() == Type.INT else None
+    if value.type() == Type.BOOL:
+        return FALSE if value.value() else TRUE
+    return None
+
+
+# which way an if or for condition goes, as far as it's a literal: True, False or None
+def _truth(condition):
+    kind = condition.elem_type
+    if kind == InterpreterBase.BOOL_NODE:
+        return condition.val
+    if kind == InterpreterBase.INT_NODE:
+        return condition.val != 0
+    return None
+
+
+# whether caching expr saves more than reading it: it isn't a literal or a plain variable
+def _worth_caching(expr):
+    kind = expr.elem_type
+    if kind == InterpreterBase.VAR_NODE:
+        return expr.path is not None
+    return hasattr(expr, "op1")
+
+
+# whether binding arg to its parameter looks at arg itself, which a CachedNode
+# in its place would change: a field read passed to a user function
+def _checked_as_variable(call, arg):
+    return call.builtin is None and arg.elem_type == InterpreterBase.VAR_NODE and arg.path is not None
+
+
+# What can change while a for loop runs: the variables its body and update
+# assign or define (assigned), and whether a struct field can change in it
+# (fields: the loop assigns a field or calls a user function, which might).
+#
+# An expression made of literals, operators and the other variables and field
+# reads gives the same value every time it runs in the loop, or fails the same
+# way. Cached, it runs only where it first did in the loop (the CachedNode
+# stays where the expression was), so a loop that fails or doesn't get to it
+# still does so with the same error at the same point.
+class _LoopEffects:
+    def __init__(self, for_node):
+        self.assigned = set()
+        self.fields = False
+        self.statements([for_node.update])
+        self.statements(for_node.statements)
+        self.expression(for_node.condition)
+
+    def statements(self, statements):
+        for statement in statements:
+            kind = statement.elem_type
+            if kind == "=":
+                if statement.path is None:
+                    self.assigned.add(statement.slot)
+                else:
+                    self.fields = True
+                self.expression(statement.expression)
+            elif kind == InterpreterBase.VAR_DEF_NODE:
+                self.assigned.add(statement.slot)
+            elif kind == InterpreterBase.FIELD_SLOT_ASSIGN_NODE:
+                if statement.target.steps:
+                    self.fields = True
+                self.expression(statement.expression)
+            elif kind == InterpreterBase.IF_NODE:
+                self.expression(statement.condition)
+                self.statements(statement.statements)
+                self.statements(statement.else_statements or ())
+            elif kind == InterpreterBase.FOR_NODE:
+                self.statements([statement.init, statement.update])
+                self.expression(statement.condition)
+                self.statements(statement.statements)
+            elif kind == InterpreterBase.RETURN_NODE:
+                if statement.expression is not None:
+                    self.expression(statement.expression)
+            elif kind == InterpreterBase.FCALL_NODE:
+                self.expression(statement)
+
+    def expression(self, expr):
+        kind = expr.elem_type
+        if kind == InterpreterBase.FCALL_NODE:
+            if expr.builtin is None:
+                self.fields = True
+            for arg in expr.args:
+                self.expression(arg)
+        elif kind == InterpreterBase.NEG_NODE or kind == InterpreterBase.NOT_NODE:
+            self.expression(expr.op1)
+        elif hasattr(expr, "op2"):
+            self.expression(expr.op1)
+            self.expression(expr.op2)
+
+    def invariant(self, expr):
+        kind = expr.elem_type
+        if kind == InterpreterBase.VAR_NODE:
+            if expr.path is None:
+                return expr.slot is not None and expr.slot not in self.assigned
+            base_slot = expr.path.base_slot
+            return not self.fields and base_slot is not None and base_slot not in self.assigned
+        if kind == InterpreterBase.NEG_NODE or kind == InterpreterBase.NOT_NODE:
+            return self.invariant(expr.op1)
+        if hasattr(expr, "op2"):
+            return self.invariant(expr.op1) and self.invariant(expr.op2)
+        return hasattr(expr, "constant") or kind == InterpreterBase.NIL_NODE
+
+
+# One pass over a block for _Optimizer.share, following the order things run
+# in. A field read is known by its base variable and fields; reads of the same
+# path are one read (one shared value) until the base variable is assigned or
+# defined again, a field is assigned, or a user function is called, and a new
+# read after that. The first pass (repeated None) counts how often each read
+# happens; the second caches the reads in repeated, the first of each
+# clearing its slot beforehand.
+class _FieldReads:
+    def __init__(self, optimizer, repeated):
+        self.optimizer = optimizer
+        self.repeated = repeated
+        self.counts = {}
+        self.slots = {}  # read -> slot
+        self.current = {}  # (base slot, fields) -> read
+        self.reads = 0
+        self.first = []
+
+    def block(self, statements):
+        result = []
+        for statement in statements:
+            self.first = []
+            statement = self.statement(statement)
+            if self.first:
+                result.append(UncacheNode(tuple(self.first)))
+            result.append(statement)
+        return result
+
+    def statement(self, statement):
+        kind = statement.elem_type
+        if kind == "=":
+            statement = rebuild(statement, expression=self.expression(statement.expression))
+            if statement.path is None:
+                self.forget(statement.slot)
+            else:
+                self.current = {}
+        elif kind == InterpreterBase.VAR_DEF_NODE:
+            self.forget(statement.slot)
+        elif kind == InterpreterBase.FIELD_SLOT_ASSIGN_NODE:
+            statement = rebuild(statement, expression=self.expression(statement.expression))
+            if statement.target.steps:
+                self.current = {}
+        elif kind == InterpreterBase.FCALL_NODE:
+            statement = self.expression(statement)
+        elif kind == InterpreterBase.RETURN_NODE:
+            if statement.expression is not None:
+                statement = rebuild(statement, expression=self.expression(statement.expression))
+        elif kind == InterpreterBase.IF_NODE:
+            statement = rebuild(statement, condition=self.expression(statement.condition))
+            if self.repeated is not None:
+                else_statements = statement.else_statements
+                if else_statements is not None:
+                    else_statements = self.optimizer.share(else_statements)
+                statement = rebuild(
+                    statement,
+                    statements=self.optimizer.share(statement.statements),
+                    else_statements=else_statements,
+                )
+            self.current = {}
+        elif kind == InterpreterBase.FOR_NODE:
+            statement = rebuild(statement, init=self.statement(statement.init))
+            if self.repeated is not None:
+                statement = rebuild(statement, statements=self.optimizer.share(statement.statements))
+            self.current = {}
+        return statement
+
+    def forget(self, slot):
+        self.current = {path: read for path, read in self.current.items() if path[0] != slot}
+
+    def expression(self, expr):
+        kind = expr.elem_type
+        if kind == InterpreterBase.VAR_NODE:
+            if expr.path is None or expr.path.base_slot is None:
+                return expr
+            return self.read(expr)
+        if kind == InterpreterBase.FCALL_NODE:
+            args = [arg if _checked_as_variable(expr, arg) else self.expression(arg) for arg in expr.args]
+            if expr.builtin is None:
+                self.current = {}
+            return rebuild(expr, args=args)
+        if kind == InterpreterBase.NEG_NODE or kind == InterpreterBase.NOT_NODE:
+            return rebuild(expr, op1=self.expression(expr.op1))
+        if hasattr(expr, "op2"):
+            op1 = self.expression(expr.op1)
+            return rebuild(expr, op1=op1, op2=self.expression(expr.op2))
+        # a CachedNode's expression doesn't run every time the node does
+        return expr
+
+    def read(self, var_ast):
+        path = (var_ast.path.base_slot, tuple(var_ast.path.fields))
+        read = self.current.get(path)
+        if read is None:
+            read = self.current[path] = self.reads
+            self.reads += 1
+        if self.repeated is None:
+            self.counts[read] = self.counts.get(read, 0) + 1
+            return var_ast
+        if read not in self.repeated:
+            return var_ast
+        slot = self.slots.get(read)
+        if slot is None:
+            slot = self.slots[read] = self.optimizer.new_slot()
+            self.first.append(slot)
+        return CachedNode(var_ast, slot)
+
+
+# The struct variables of a function that can be replaced by a slot per field
+# (_Optimizer.replace_structs). candidates are the variables defined with a
+# struct type, slot -> struct type; one escapes, and is kept, when its value
+# could be seen as a whole: anything but a field read or assignment through
+# it, or being set to anything but nil or a new struct of its type. A field
+# read passed to a user function, and a loop init or update setting the
+# variable or one of its fields, keep it as well, as does a field the struct
+# doesn't have (which is looked up by name, to fail at run time). fields:
+# slot -> the fields read or assigned through the variable.
+class _StructUses:
+    def __init__(self, structs):
+        self.structs = structs
+        self.candidates = {}
+        self.escaped = set()
+        self.fields = {}
+
+    def statements(self, statements):
+        for statement in statements:
+            self.statement(statement)
+
+    def statement(self, statement):
+        kind = statement.elem_type
+        if kind == InterpreterBase.VAR_DEF_NODE:
+            if statement.slot is not None and statement.var_type in self.structs:
+                self.candidates[statement.slot] = statement.var_type
+        elif kind == "=":
+            expression = statement.expression
+            if statement.path is not None:
+                self.path(statement.path)
+            elif not (
+                expression.elem_type == InterpreterBase.NIL_NODE
+                or (
+                    expression.elem_type == InterpreterBase.NEW_NODE
+                    and expression.var_type == self.candidates.get(statement.slot)
+                )
+            ):
+                self.escaped.add(statement.slot)
+            self.expression(expression)
+        elif kind == InterpreterBase.IF_NODE:
+            self.expression(statement.condition)
+            self.statements(statement.statements)
+            self.statements(statement.else_statements or ())
+        elif kind == InterpreterBase.FOR_NODE:
+            for assign_ast in (statement.init, statement.update):
+                path = assign_ast.path
+                self.escaped.add(assign_ast.slot if path is None else path.base_slot)
+            self.statements([statement.init, statement.update])
+            self.expression(statement.condition)
+            self.statements(statement.statements)
+        elif kind == InterpreterBase.RETURN_NODE:
+            if statement.expression is not None:
+                self.expression(statement.expression)
+        elif kind == InterpreterBase.FCALL_NODE:
+            self.expression(statement)
+        # try and raise statements are never run
+
+    def expression(self, expr):
+        kind = expr.elem_type
+        if kind == InterpreterBase.VAR_NODE:
+            if expr.path is None:
+                self.escaped.add(expr.slot)
+            else:
+                self.path(expr.path)
+        elif kind == InterpreterBase.FCALL_NODE:
+            for arg in expr.args:
+                if _checked_as_variable(expr, arg):
+                    self.escaped.add(arg.path.base_slot)
+                self.expression(arg)
+        elif kind == InterpreterBase.NEG_NODE or kind == InterpreterBase.NOT_NODE:
+            self.expression(expr.op1)
+        elif hasattr(expr, "op2"):
+            self.expression(expr.op1)
+            self.expression(expr.op2)
+
+    def path(self, path):
+        field, offset, _ = path.steps[0]
+        if offset is None:
+            self.escaped.add(path.base_slot)
+        else:
+            self.fields.setdefault(path.base_slot, set()).add(field)
+
+
+# slot -> number of assignments to that variable (not through a field) in statements
+def _count_assignments(statements, assigned):
+    for statement in statements:
+        kind = statement.elem_type
+        if kind == "=":
+            if statement.path is None:
+                assigned[statement.slot] = assigned.get(statement.slot, 0) + 1
+        elif kind == InterpreterBase.IF_NODE:
+            _count_assignments(statement.statements, assigned)
+            if statement.else_statements is not None:
+                _count_assignments(statement.else_statements, assigned)
+        elif kind == InterpreterBase.FOR_NODE:
+            _count_assignments([statement.init, statement.update], assigned)
+            _count_assignments(statement.statements, assigned)
+        elif kind == InterpreterBase.TRY_NODE:
+            _count_assignments(statement.statements, assigned)
+            for catcher in statement.catchers:
+                _count_assignments(catcher.statements, assigned)
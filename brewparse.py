@@ -1,4 +1,38 @@
-from element import Element
+from element import (
+    ArgNode,
+    AssignNode,
+    BinOpNode,
+    BoolNode,
+    CatchNode,
+    FCallNode,
+    FieldDefNode,
+    FieldPathNode,
+    ForNode,
+    FuncNode,
+    IfNode,
+    IntNode,
+    NewNode,
+    NilNode,
+    ProgramNode,
+    RaiseNode,
+    ReturnNode,
+    StringNode,
+    StructNode,
+    TryNode,
+    UnaryOpNode,
+    VarDefNode,
+    VarNode,
+)
+import copy
+import mmap
+import os
+import queue
+import sys
+import threading
+from contextlib import contextmanager
+
+import brewlex
+import brewscan
 from brewlex import *
 from intbase import InterpreterBase
 from ply import yacc
@@ -26,9 +60,9 @@ def p_program(p):
     """program : structs funcs
     | funcs"""
     if len(p) == 2:
-        p[0] = Element(InterpreterBase.PROGRAM_NODE, structs=[], functions=p[1])
+        p[0] = ProgramNode(structs=[], functions=p[1])
     else:
-        p[0] = Element(InterpreterBase.PROGRAM_NODE, structs=p[1], functions=p[2])
+        p[0] = ProgramNode(structs=p[1], functions=p[2])
 
 def p_structs(p):
     """structs : structs struct
@@ -37,7 +71,7 @@ def p_structs(p):
 
 def p_struct(p):
    "struct : STRUCT NAME LBRACE fields RBRACE"
-   p[0] = Element(InterpreterBase.STRUCT_NODE, name=p[2], fields=p[4])
+   p[0] = StructNode(name=p[2], fields=p[4])
 
 def p_fields(p):
    """fields : fields field
@@ -46,7 +80,7 @@ def p_fields(p):
 
 def p_field(p):
   "field : NAME COLON NAME SEMI"  # field_name: type
-  p[0] = Element(InterpreterBase.FIELD_DEF_NODE, name=p[1], var_type=p[3])
+  p[0] = FieldDefNode(name=p[1], var_type=p[3])
 
 def p_funcs(p):
     """funcs : funcs func
@@ -58,17 +92,17 @@ def p_func(p):
     """func : FUNC NAME LPAREN formal_args RPAREN COLON NAME LBRACE statements RBRACE
     | FUNC NAME LPAREN RPAREN COLON NAME LBRACE statements RBRACE"""
     if len(p) == 11:  # handle with 1+ formal args
-        p[0] = Element(InterpreterBase.FUNC_NODE, name=p[2], args=p[4], return_type = p[7], statements=p[9])
+        p[0] = FuncNode(name=p[2], args=p[4], return_type = p[7], statements=p[9])
     else:  # handle no formal args
-        p[0] = Element(InterpreterBase.FUNC_NODE, name=p[2], args=[], return_type = p[6], statements=p[8])
+        p[0] = FuncNode(name=p[2], args=[], return_type = p[6], statements=p[8])
 
 def p_func2(p):
     """func : FUNC NAME LPAREN formal_args RPAREN LBRACE statements RBRACE
     | FUNC NAME LPAREN RPAREN LBRACE statements RBRACE"""
     if len(p) == 9:  # handle with 1+ formal args
-        p[0] = Element(InterpreterBase.FUNC_NODE, name=p[2], args=p[4], return_type = None, statements=p[7])
+        p[0] = FuncNode(name=p[2], args=p[4], return_type = None, statements=p[7])
     else:  # handle no formal args
-        p[0] = Element(InterpreterBase.FUNC_NODE, name=p[2], args=[], return_type = None, statements=p[6])
+        p[0] = FuncNode(name=p[2], args=[], return_type = None, statements=p[6])
 
 def p_formal_args(p):
     """formal_args : formal_args COMMA formal_arg
@@ -80,9 +114,9 @@ def p_formal_arg(p):
     """formal_arg : NAME COLON NAME
     | NAME"""
     if len(p) == 2:
-      p[0] = Element(InterpreterBase.ARG_NODE, name=p[1], var_type = None)
+      p[0] = ArgNode(name=p[1], var_type = None)
     else:
-      p[0] = Element(InterpreterBase.ARG_NODE, name=p[1], var_type = p[3])
+      p[0] = ArgNode(name=p[1], var_type = p[3])
 
 def p_statements(p):
     """statements : statements statement
@@ -96,42 +130,50 @@ def p_statement___assign(p):
 
 def p_assign(p):
     "assign : variable_w_dot ASSIGN expression"
-    p[0] = Element("=", name=p[1], expression=p[3])
+    p[0] = AssignNode(name=str(p[1]), expression=p[3], path=field_path(p[1]))
 
 def p_statement___var(p):
     """statement : VAR variable COLON NAME SEMI
     | VAR variable SEMI"""
     if len(p) == 6:
-      p[0] = Element(InterpreterBase.VAR_DEF_NODE, name=p[2], var_type=p[4])
+      p[0] = VarDefNode(name=p[2], var_type=p[4])
     else:
-      p[0] = Element(InterpreterBase.VAR_DEF_NODE, name=p[2], var_type=None)
+      p[0] = VarDefNode(name=p[2], var_type=None)
 
 def p_variable(p):
     "variable : NAME"
     p[0] = p[1]
 
+# a plain NAME stays a string; a dotted name becomes a FieldPathNode
 def p_variable_w_dot(p):
     """variable_w_dot : variable_w_dot DOT NAME
     | NAME"""
     if len(p) == 4:
-        p[0] = p[1] + "." + p[3]
+        if isinstance(p[1], FieldPathNode):
+            p[0] = FieldPathNode(p[1].base, p[1].fields + (p[3],))
+        else:
+            p[0] = FieldPathNode(p[1], (p[3],))
     else:
         p[0] = p[1]
 
+
+def field_path(variable):
+    if isinstance(variable, FieldPathNode):
+        return variable
+    return None
+
 def p_statement_if(p):
     """statement : IF LPAREN expression RPAREN LBRACE statements RBRACE
     | IF LPAREN expression RPAREN LBRACE statements RBRACE ELSE LBRACE statements RBRACE
     """
     if len(p) == 8:
-        p[0] = Element(
-            InterpreterBase.IF_NODE,
+        p[0] = IfNode(
             condition=p[3],
             statements=p[6],
             else_statements=None,
         )
     else:
-        p[0] = Element(
-            InterpreterBase.IF_NODE,
+        p[0] = IfNode(
             condition=p[3],
             statements=p[6],
             else_statements=p[10],
@@ -139,7 +181,7 @@ def p_statement_if(p):
 
 def p_statement_try(p):
     """statement : TRY LBRACE statements RBRACE catchers"""
-    p[0] = Element(InterpreterBase.TRY_NODE, statements=p[3], catchers=p[5])
+    p[0] = TryNode(statements=p[3], catchers=p[5])
 
 def p_catches(p):
     """catchers : catchers catch
@@ -148,15 +190,15 @@ def p_catches(p):
 
 def p_catch(p):
     "catch : CATCH STRING LBRACE statements RBRACE"
-    p[0] = Element(InterpreterBase.CATCH_NODE, exception_type=p[2], statements=p[4])
+    p[0] = CatchNode(exception_type=p[2], statements=p[4])
 
 def p_statement_for(p):
     "statement : FOR LPAREN assign SEMI expression SEMI assign RPAREN LBRACE statements RBRACE"
-    p[0] = Element(InterpreterBase.FOR_NODE, init=p[3], condition=p[5], update=p[7], statements=p[10])
+    p[0] = ForNode(init=p[3], condition=p[5], update=p[7], statements=p[10])
 
 def p_statement_raise(p):
     "statement : RAISE expression SEMI"
-    p[0] = Element(InterpreterBase.RAISE_NODE, exception_type=p[2])
+    p[0] = RaiseNode(exception_type=p[2])
 
 def p_statement_expr(p):
     "statement : expression SEMI"
@@ -170,21 +212,21 @@ def p_statement_return(p):
         expr = p[2]
     else:
         expr = None
-    p[0] = Element(InterpreterBase.RETURN_NODE, expression=expr)
+    p[0] = ReturnNode(expression=expr)
 
 
 def p_expression_not(p):
     "expression : NOT expression"
-    p[0] = Element(InterpreterBase.NOT_NODE, op1=p[2])
+    p[0] = UnaryOpNode(InterpreterBase.NOT_NODE, op1=p[2])
 
 
 def p_expression_uminus(p):
     "expression : MINUS expression %prec UMINUS"
-    p[0] = Element(InterpreterBase.NEG_NODE, op1=p[2])
+    p[0] = UnaryOpNode(InterpreterBase.NEG_NODE, op1=p[2])
 
 def p_expression_new(p):
     "expression : NEW NAME"
-    p[0] = Element(InterpreterBase.NEW_NODE, var_type=p[2])
+    p[0] = NewNode(var_type=p[2])
 
 
 def p_arith_expression_binop(p):
@@ -198,7 +240,7 @@ def p_arith_expression_binop(p):
     | expression MINUS expression
     | expression MULTIPLY expression
     | expression DIVIDE expression"""
-    p[0] = Element(p[2], op1=p[1], op2=p[3])
+    p[0] = BinOpNode(p[2], op1=p[1], op2=p[3])
 
 
 def p_expression_group(p):
@@ -209,43 +251,43 @@ def p_expression_group(p):
 def p_expression_and_or(p):
     """expression : expression OR expression
     | expression AND expression"""
-    p[0] = Element(p[2], op1=p[1], op2=p[3])
+    p[0] = BinOpNode(p[2], op1=p[1], op2=p[3])
 
 
 def p_expression_number(p):
     "expression : NUMBER"
-    p[0] = Element(InterpreterBase.INT_NODE, val=p[1])
+    p[0] = IntNode(val=p[1])
 
 
 def p_expression_bool(p):
     """expression : TRUE
     | FALSE"""
     bool_val = p[1] == InterpreterBase.TRUE_DEF
-    p[0] = Element(InterpreterBase.BOOL_NODE, val=bool_val)
+    p[0] = BoolNode(val=bool_val)
 
 
 def p_expression_nil(p):
     "expression : NIL"
-    p[0] = Element(InterpreterBase.NIL_NODE)
+    p[0] = NilNode()
 
 
 def p_expression_string(p):
     "expression : STRING"
-    p[0] = Element(InterpreterBase.STRING_NODE, val=p[1])
+    p[0] = StringNode(val=p[1])
 
 
 def p_expression_variable(p):
     "expression : variable_w_dot"
-    p[0] = Element(InterpreterBase.VAR_NODE, name=p[1])
+    p[0] = VarNode(name=str(p[1]), path=field_path(p[1]))
 
 
 def p_func_call(p):
     """expression : NAME LPAREN args RPAREN
     | NAME LPAREN RPAREN"""
     if len(p) == 5:
-        p[0] = Element(InterpreterBase.FCALL_NODE, name=p[1], args=p[3])
+        p[0] = FCallNode(name=p[1], args=p[3])
     else:
-        p[0] = Element(InterpreterBase.FCALL_NODE, name=p[1], args=[])
+        p[0] = FCallNode(name=p[1], args=[])
 
 
 def p_expression_args(p):
@@ -262,13 +304,143 @@ def p_error(p):
 
 
 # exported function
-def parse_program(program):
-    reset_lineno()
-    ast = yacc.parse(program)
-    if ast is None:
-        raise SyntaxError("Syntax error")
+# cache: optional brewcache.ASTCache; on a hit the lexer and parser are skipped entirely
+# safe to call from several threads at once: each parse borrows a Parser from parser_pool
+def parse_program(program, cache=None):
+    if cache is not None:
+        ast = cache.get(program)
+        if ast is not None:
+            return ast
+    ast = parser_pool.parse(program)
+    if cache is not None:
+        cache.put(program, ast)
     return ast
 
 
-# generate our parser
-yacc.yacc() # yacc.yacc(debug=True, debuglog=open("parse.log", "w"))
+# parse a program straight from a file: the file is memory-mapped and scanned as bytes
+# by brewscan, so the source is never read into a Python string
+def parse_file(path, cache=None):
+    with open(path, "rb") as f:
+        try:
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty files can't be mapped
+            return parse_program(b"", cache)
+        try:
+            return parse_program(source, cache)
+        finally:
+            source.close()
+
+
+# A reentrant parser: owns its own lexer and LRParser, so separate instances never
+# share line numbers or parse stacks. The LALR tables and the compiled token regexes
+# are read-only and shared by every instance.
+# fast_lexer: tokenize with brewscan instead of a clone of the PLY lexer in brewlex;
+# brewscan is also what lets parse() take the source as UTF-8 bytes or an mmap
+class Parser:
+    def __init__(self, fast_lexer=True):
+        self.lexer = brewscan.Lexer() if fast_lexer else lexer.clone()
+        # an LRParser keeps its parse state on self; a shallow copy shares only the tables
+        self.parser = copy.copy(parser)
+
+    def parse(self, program):
+        self.lexer.lineno = 1
+        try:
+            ast = self.parser.parse(program, lexer=self.lexer)
+        finally:
+            self.lexer.input("")  # don't keep the source alive between parses
+        if ast is None:
+            raise SyntaxError("Syntax error")
+        return ast
+
+
+# A bounded set of Parser instances for multi-threaded callers. Parsers are created on
+# demand up to size; once all of them are busy, acquire() blocks until one is released.
+class ParserPool:
+    def __init__(self, size=8):
+        if size < 1:
+            raise ValueError("ParserPool size must be at least 1")
+        self.size = size
+        self.__idle = queue.LifoQueue()
+        self.__created = 0
+        self.__lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        try:
+            return self.__idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.__lock:
+            if self.__created < self.size:
+                self.__created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return Parser()
+            except BaseException:
+                with self.__lock:
+                    self.__created -= 1
+                raise
+        try:
+            return self.__idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("no parser available") from None
+
+    def release(self, instance):
+        self.__idle.put(instance)
+
+    @contextmanager
+    def parser(self, timeout=None):
+        instance = self.acquire(timeout)
+        try:
+            yield instance
+        finally:
+            self.release(instance)
+
+    def parse(self, program):
+        with self.parser() as instance:
+            return instance.parse(program)
+
+
+# load the LALR tables straight from parsetab.py: no grammar reflection, signature
+# check or table writing, so importing this module never touches the disk
+def load_parser():
+    import parsetab
+
+    lr = yacc.LRTable()
+    lr.read_table(parsetab)
+    lr.bind_callables(globals())
+    return yacc.LRParser(lr, p_error)
+
+
+def build_parser():
+    if not REFLECT:
+        try:
+            return load_parser()
+        except (ImportError, yacc.VersionError):
+            pass
+    # validate the grammar and rebuild the tables in memory if parsetab.py is out of date
+    return yacc.yacc(debug=False, write_tables=False)
+
+
+# regenerate lextab.py, parsetab.py and parser.out from the rules in brewlex.py and here
+def build_tables(outputdir=None):
+    if outputdir is None:
+        outputdir = os.path.dirname(os.path.abspath(__file__))
+    brewlex.write_lextab(outputdir)
+    # yacc() reuses a table whose signature still matches, so drop the old one first
+    sys.modules.pop("parsetab", None)
+    tab_file = os.path.join(outputdir, "parsetab.py")
+    if os.path.exists(tab_file):
+        os.remove(tab_file)
+    yacc.yacc(module=sys.modules[__name__], debug=True, outputdir=outputdir)
+
+
+# generate our parser; Parser instances copy it rather than using it directly
+parser = build_parser()
+parser_pool = ParserPool(os.cpu_count() or 4)
+
+
+if __name__ == "__main__":
+    build_tables()
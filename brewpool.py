@@ -0,0 +1,81 @@
+# Recycling of struct instances.
+#
+# A StructPool passed to the Interpreter (struct_pool=...) hands out struct
+# instances for `new`, and takes back the ones a returning call leaves in its
+# frame-local struct variables: the variables brewopt.frame_local_structs finds
+# are only ever set to nil or to a new struct of their type, and only used
+# through their fields. The struct such a variable holds when the call returns
+# was made by the call and never stored anywhere else, so nothing can reach it
+# once the frame is gone; it's reset to its defaults and kept for the next
+# `new` of its type. A struct that leaves its call (returned, passed to a
+# function, stored in a field or another variable, as every node of a list
+# built with cons is) is never recycled.
+#
+# With optimize=True those same variables get a slot per field instead of an
+# instance (brewopt's scalar replacement), so there is nothing left to recycle.
+from brewopt import frame_local_structs
+
+DEFAULT_MAX_FREE = 1024
+
+
+# Sets each function's pooled_slots: the slots of its frame-local struct
+# variables. source_ast is the program as resolved, before brewopt and
+# brewinline, which keep a function's variables in their slots and the
+# functions in their order; the escape analysis only understands the nodes the
+# parser makes, so it looks at that one.
+def mark_pooled_structs(ast, source_ast, structs):
+    for func_def, source_def in zip(ast.functions, source_ast.functions):
+        func_def.pooled_slots = tuple(sorted(frame_local_structs(source_def.statements, structs)))
+
+
+# Free instances are kept per struct type, at most max_free of each. allocations
+# counts instances built from scratch, reuses the ones taken from the pool and
+# releases the ones put back, over the pool's lifetime; the free instances
+# themselves are dropped at the start of every run, since each run builds its
+# own struct classes.
+class StructPool:
+    def __init__(self, max_free=DEFAULT_MAX_FREE):
+        self.max_free = max_free
+        self.free = {}
+        self.allocations = 0
+        self.reuses = 0
+        self.releases = 0
+
+    # a new instance of struct_class with every field at its default
+    def new(self, struct_class):
+        free = self.free.get(struct_class)
+        if free:
+            self.reuses += 1
+            return free.pop()
+        self.allocations += 1
+        return struct_class(struct_class.defaults)
+
+    # frame: the locals of a call that has just returned; slots: its
+    # function's pooled_slots (a slot still holding nil is skipped)
+    def release(self, frame, slots):
+        for slot in slots:
+            value = frame[slot]
+            if isinstance(value, list):
+                free = self.free.setdefault(value.__class__, [])
+                if len(free) < self.max_free:
+                    value[:] = value.defaults
+                    free.append(value)
+                    self.releases += 1
+
+    def clear(self):
+        self.free.clear()
+
+    def stats(self):
+        return {
+            "allocations": self.allocations,
+            "reuses": self.reuses,
+            "releases": self.releases,
+            "free": sum(len(free) for free in self.free.values()),
+        }
+
+    def report(self):
+        stats = self.stats()
+        return (
+            f"pool: {stats['allocations']} allocations, {stats['reuses']} reuses, "
+            f"{stats['releases']} releases, {stats['free']} free"
+        )
@@ -0,0 +1,319 @@
+# Static resolution passes over a parsed Brewin program.
+import operator
+
+from intbase import InterpreterBase
+from type_valuev2 import literal_value
+
+# FCallNode.builtin values: calls to the built-in functions, which always take
+# precedence over user functions of the same name
+PRINT = 1
+INPUTI = 2
+INPUTS = 3
+BUILTINS = {"print": PRINT, "inputi": INPUTI, "inputs": INPUTS}
+
+
+# Field layout of one struct type, computed once when the struct table is set up.
+# Instances are fixed-length lists of their field values; offsets maps field name -> index.
+class StructLayout:
+    def __init__(self, name, field_names, field_types):
+        self.name = name
+        self.field_names = tuple(field_names)
+        self.field_types = tuple(field_types)
+        self.offsets = {field: i for i, field in enumerate(self.field_names)}
+
+    @staticmethod
+    def from_ast(struct_def):
+        return StructLayout(
+            struct_def.name,
+            [field.name for field in struct_def.fields],
+            [field.var_type for field in struct_def.fields],
+        )
+
+
+# Resolve every variable in the program ahead of time.
+#
+# Variables: each parameter and var definition of a function gets its own
+# index ("slot") in a flat list of locals allocated per call, and every use
+# (VarNode, AssignNode, the base of a FieldPathNode) is bound to the slot of
+# the innermost declaration before it in an enclosing block. That is the
+# variable the interpreter used to find by searching its block scopes by name
+# at run time, because the declarations of a block always run in order; and as
+# Brewin has no nested functions, every variable lives in the running call's
+# frame. A use with no such declaration gets slot None; a var definition that
+# repeats a name already declared in the same block also gets slot None.
+# FuncNode.nlocals and FuncNode.param_slots describe the frame.
+#
+# Calls: every FCallNode is linked here too. builtin is set to PRINT, INPUTI or
+# INPUTS for the built-ins, None otherwise, and the call site cache the tree
+# walker fills in on the first call (call_site) is cleared.
+#
+# Literals: each int, bool and string literal gets its Value (constant) here,
+# so evaluating one returns the same shared Value every time.
+#
+# Field paths: the declared type of each path's base variable is the type of
+# that same declaration; each field is then resolved against the layout of the
+# struct type reached so far. A step whose struct type can't be determined
+# statically gets offset None and struct class None, and is looked up by name
+# at run time instead. The declared type of the last field is recorded as
+# path.field_type.
+#
+# layouts: struct name -> StructLayout
+# struct_classes: struct name -> the Python class whose instances have that layout
+def resolve(ast, layouts, struct_classes):
+    resolver = _Resolver(layouts, struct_classes)
+    for func_def in ast.functions:
+        resolver.function(func_def)
+
+
+class _Resolver:
+    def __init__(self, layouts, struct_classes):
+        self.layouts = layouts
+        self.struct_classes = struct_classes
+        self.nlocals = 0
+
+    # scopes map name -> (slot, declared type)
+    def function(self, func_def):
+        self.nlocals = 0
+        params = {}
+        param_slots = []
+        for arg in func_def.args:
+            # a repeated parameter name is one variable holding the last argument
+            slot = params[arg.name][0] if arg.name in params else self.__new_slot()
+            params[arg.name] = (slot, arg.var_type)
+            param_slots.append(slot)
+        self.statements(func_def.statements, [params])
+        func_def.param_slots = tuple(param_slots)
+        func_def.nlocals = self.nlocals
+
+    def __new_slot(self):
+        self.nlocals += 1
+        return self.nlocals - 1
+
+    def statements(self, statements, scopes):
+        scopes = scopes + [{}]
+        for statement in statements:
+            self.statement(statement, scopes)
+
+    def statement(self, statement, scopes):
+        kind = statement.elem_type
+        if kind == InterpreterBase.VAR_DEF_NODE:
+            if statement.name in scopes[-1]:
+                statement.slot = None
+            else:
+                statement.slot = self.__new_slot()
+                scopes[-1][statement.name] = (statement.slot, statement.var_type)
+        elif kind == "=":
+            self.expression(statement.expression, scopes)
+            self.variable(statement, scopes)
+        elif kind == InterpreterBase.IF_NODE:
+            self.expression(statement.condition, scopes)
+            self.statements(statement.statements, scopes)
+            if statement.else_statements is not None:
+                self.statements(statement.else_statements, scopes)
+        elif kind == InterpreterBase.FOR_NODE:
+            self.statement(statement.init, scopes)
+            self.expression(statement.condition, scopes)
+            self.statements(statement.statements, scopes)
+            self.statement(statement.update, scopes)
+        elif kind == InterpreterBase.RETURN_NODE:
+            if statement.expression is not None:
+                self.expression(statement.expression, scopes)
+        elif kind == InterpreterBase.TRY_NODE:
+            self.statements(statement.statements, scopes)
+            for catcher in statement.catchers:
+                self.statements(catcher.statements, scopes)
+        elif kind == InterpreterBase.RAISE_NODE:
+            self.expression(statement.exception_type, scopes)
+        else:
+            self.expression(statement, scopes)
+
+    def expression(self, expr, scopes):
+        kind = expr.elem_type
+        if kind == InterpreterBase.VAR_NODE:
+            self.variable(expr, scopes)
+        elif kind == InterpreterBase.FCALL_NODE:
+            expr.builtin = BUILTINS.get(expr.name)
+            expr.call_site = None
+            for arg in expr.args:
+                self.expression(arg, scopes)
+        elif kind == InterpreterBase.NEG_NODE or kind == InterpreterBase.NOT_NODE:
+            self.expression(expr.op1, scopes)
+        elif hasattr(expr, "op2"):
+            self.expression(expr.op1, scopes)
+            self.expression(expr.op2, scopes)
+        elif hasattr(expr, "constant"):
+            expr.constant = literal_value(kind, expr.val)
+
+    # a VarNode or AssignNode
+    def variable(self, node, scopes):
+        path = node.path
+        slot, var_type = self.lookup(path.base if path is not None else node.name, scopes)
+        node.slot = slot
+        if path is not None:
+            path.base_slot = slot
+            self.path(path, var_type)
+
+    @staticmethod
+    def lookup(name, scopes):
+        for scope in reversed(scopes):
+            if name in scope:
+                return scope[name]
+        return None, None
+
+    def path(self, path, struct_type):
+        steps = []
+        for field in path.fields:
+            layout = self.layouts.get(struct_type)
+            offset = None if layout is None else layout.offsets.get(field)
+            if offset is None:
+                steps.append((field, None, None))
+                struct_type = None
+            else:
+                steps.append((field, offset, self.struct_classes[struct_type]))
+                struct_type = layout.field_types[offset]
+        path.steps = tuple(steps)
+        path.field_type = struct_type
+
+
+# Mark the tail calls that can run in place of their caller: a `return f(...)`
+# where f returns the same type as the function the return is in. The caller's
+# return coercion can't change what such a callee returns (the callee's own
+# coercion already did the same), so a backend can drop the caller's frame and
+# run f with the new arguments as if it had been called directly.
+# ReturnNode.tail_call is set to f's FuncNode, or None.
+#
+# functions: name -> {number of params -> FuncNode}, as Interpreter.func_name_to_ast
+def mark_tail_calls(ast, functions):
+    for func_def in ast.functions:
+        _mark_tail_calls(func_def.statements, func_def.return_type, functions)
+
+
+def _mark_tail_calls(statements, return_type, functions):
+    for statement in statements:
+        kind = statement.elem_type
+        if kind == InterpreterBase.RETURN_NODE:
+            statement.tail_call = None
+            expr = statement.expression
+            if (
+                expr is not None
+                and expr.elem_type == InterpreterBase.FCALL_NODE
+                and expr.name not in ("print", "inputi", "inputs")  # always the built-ins
+            ):
+                callee = functions.get(expr.name, {}).get(len(expr.args))
+                if callee is not None and callee.return_type == return_type:
+                    statement.tail_call = callee
+        elif kind == InterpreterBase.IF_NODE:
+            _mark_tail_calls(statement.statements, return_type, functions)
+            if statement.else_statements is not None:
+                _mark_tail_calls(statement.else_statements, return_type, functions)
+        elif kind == InterpreterBase.FOR_NODE:
+            _mark_tail_calls(statement.statements, return_type, functions)
+
+
+# How a counting loop's condition compares the counter to its limit
+_COUNTER_TESTS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "!=": operator.ne,
+}
+
+
+# A for loop that does nothing but count (see mark_counting_loops). Each
+# iteration tests test(counter, limit) and then adds step to the counter.
+# limit is an int, or None when it's read from the variable in limit_slot.
+class CountingLoop:
+    def __init__(self, slot, op, limit, limit_slot, step):
+        self.slot = slot
+        self.test = _COUNTER_TESTS[op]
+        self.limit = limit
+        self.limit_slot = limit_slot
+        self.step = step
+
+
+# Mark the for loops that only count:
+#   for (i = <init>; i < <limit>; i = i + <k>)   (or <=, >, >=, !=, or i - <k>)
+#   for (i = <init>; i; i = i - <k>)             (a countdown: i != 0)
+# where <k> is an int literal, <limit> an int literal or a variable other than
+# i, and nothing in the body assigns i or the limit variable. Calls can't
+# reach the running function's locals, so while such a loop runs its counter
+# changes only by the update and its limit not at all. ForNode.counter is set
+# to a CountingLoop for these loops and None for the rest.
+#
+# Whether the counter and limit really hold ints is only known once the init
+# has run; a backend checks that and runs the loop the general way otherwise.
+def mark_counting_loops(ast):
+    for func_def in ast.functions:
+        _mark_counting_loops(func_def.statements)
+
+
+def _mark_counting_loops(statements):
+    for statement in statements:
+        kind = statement.elem_type
+        if kind == InterpreterBase.IF_NODE:
+            _mark_counting_loops(statement.statements)
+            if statement.else_statements is not None:
+                _mark_counting_loops(statement.else_statements)
+        elif kind == InterpreterBase.FOR_NODE:
+            statement.counter = _counting_loop(statement)
+            _mark_counting_loops(statement.statements)
+
+
+def _counting_loop(for_node):
+    slot = _local(for_node.init)
+    if slot is None:
+        return None
+
+    condition = for_node.condition
+    limit, limit_slot = None, None
+    if _local(condition) == slot:
+        op, limit = "!=", 0
+    elif condition.elem_type in _COUNTER_TESTS and _local(condition.op1) == slot:
+        op = condition.elem_type
+        if condition.op2.elem_type == InterpreterBase.INT_NODE:
+            limit = condition.op2.val
+        else:
+            limit_slot = _local(condition.op2)
+            if limit_slot is None or limit_slot == slot:
+                return None
+    else:
+        return None
+
+    update = for_node.update
+    step = update.expression
+    if (
+        _local(update) != slot
+        or step.elem_type not in ("+", "-")
+        or _local(step.op1) != slot
+        or step.op2.elem_type != InterpreterBase.INT_NODE
+    ):
+        return None
+
+    assigned = set()
+    _assigned_slots(for_node.statements, assigned)
+    if slot in assigned or (limit_slot is not None and limit_slot in assigned):
+        return None
+    return CountingLoop(slot, op, limit, limit_slot, step.op2.val if step.elem_type == "+" else -step.op2.val)
+
+
+# the slot of a plain (dot-free) variable or assignment target, or None
+def _local(node):
+    if node.elem_type not in (InterpreterBase.VAR_NODE, "=") or node.path is not None:
+        return None
+    return node.slot
+
+
+def _assigned_slots(statements, assigned):
+    for statement in statements:
+        kind = statement.elem_type
+        if kind == "=":
+            if statement.path is None:
+                assigned.add(statement.slot)
+        elif kind == InterpreterBase.IF_NODE:
+            _assigned_slots(statement.statements, assigned)
+            if statement.else_statements is not None:
+                _assigned_slots(statement.else_statements, assigned)
+        elif kind == InterpreterBase.FOR_NODE:
+            _assigned_slots([statement.init, statement.update], assigned)
+            _assigned_slots(statement.statements, assigned)
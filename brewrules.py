@@ -0,0 +1,97 @@
+# Typing rules of Brewin values, shared by every backend and by brewcheck.
+#
+# The tree walker (interpreterv3, env_v2), the compiled backends (brewcompile,
+# brewvm), the checker (brewcheck) and the optimizer (brewopt) all take these
+# rules from here, so a change to the language is made in one place. The rules
+# keep the tree walker's quirks, e.g. EnvironmentManager.set spelling string
+# as "String" (so a string variable can be set to nil).
+from intbase import ErrorType
+from type_valuev2 import EMPTY_STRING, FALSE, NIL, TRUE, VOID, ZERO
+
+# types a variable can't be set to nil from, or set to from nil
+NOT_NILLABLE = ("int", "bool", "String")
+
+# the types a formal parameter can have besides structs; also the types nil
+# can't be compared to
+PRIMITIVE_TYPES = ("int", "string", "bool", "void")
+
+
+# whether a variable holding a value of cur_type can be set to one of val_type
+# (the value is stored as it is either way; an int set on a bool isn't coerced)
+def can_store(cur_type, val_type):
+    return (
+        cur_type == val_type
+        or (cur_type == "bool" and val_type == "int")
+        or (val_type == "nil" and cur_type not in NOT_NILLABLE)
+        or (cur_type == "nil" and val_type not in NOT_NILLABLE)
+    )
+
+
+# binary operator op applied to two Values, with the int/bool coercions and the
+# nil comparisons; the operators themselves come from interpreter.op_to_lambda
+def general_binary_op(interpreter, op):
+    op_to_lambda = interpreter.op_to_lambda
+    structs = interpreter.structs
+    error = interpreter.error
+    logical = op in ("||", "&&")
+    comparison = op in ("==", "!=")
+
+    def binary_op(left_value_obj, right_value_obj):
+        left_type = left_value_obj.type()
+        right_type = right_value_obj.type()
+        if left_type == "bool" and right_type == "int":
+            right_value_obj = (TRUE if right_value_obj.value() != 0 else FALSE)
+        elif left_type == "int" and right_type == "bool":
+            left_value_obj = (TRUE if left_value_obj.value() != 0 else FALSE)
+        elif left_type == "int" and right_type == "int" and logical:
+            left_value_obj = (TRUE if left_value_obj.value() != 0 else FALSE)
+            right_value_obj = (TRUE if right_value_obj.value() != 0 else FALSE)
+        elif left_type in structs and right_type == "nil" and op == "==":
+            return FALSE
+        elif left_type in structs and right_type == "nil" and op == "!=":
+            return TRUE
+        elif left_type in PRIMITIVE_TYPES and right_type == "nil":
+            error(ErrorType.TYPE_ERROR, f"Cannot compare {left_type} to nil")
+        elif right_type in PRIMITIVE_TYPES and left_type == "nil":
+            error(ErrorType.TYPE_ERROR, f"Cannot compare {left_type} to nil")
+
+        # ==/!= compare anything against anything
+        if not comparison and left_value_obj.type() != right_value_obj.type():
+            error(ErrorType.TYPE_ERROR, f"Incompatible types for {op} operation")
+        left_type = left_value_obj.type()
+        if op not in op_to_lambda[left_type]:
+            error(ErrorType.TYPE_ERROR, f"Incompatible operator {op} for type {left_type}")
+        return op_to_lambda[left_type][op](left_value_obj, right_value_obj)
+
+    return binary_op
+
+
+# maps a function body's result (NIL_VALUE when it falls off the end) to the
+# call's value for a function returning func_return_type
+def return_coercion(interpreter, func_return_type):
+    error = interpreter.error
+    returns_struct = func_return_type in interpreter.structs
+
+    def return_value(return_val):
+        return_type = return_val.type()
+        if return_type == "nil":
+            if func_return_type == "int":
+                return ZERO
+            if func_return_type == "string":
+                return EMPTY_STRING
+            if func_return_type == "bool":
+                return FALSE
+            if func_return_type == "void":
+                return VOID
+        if func_return_type == "bool" and return_type == "int":
+            return (TRUE if return_val.value() != 0 else FALSE)
+        if returns_struct and return_type == "nil":
+            return NIL
+        if func_return_type != return_type:
+            error(
+                ErrorType.TYPE_ERROR,
+                f"The function is supposed to return a {func_return_type} but instead returns a {return_type}",
+            )
+        return return_val
+
+    return return_value
@@ -0,0 +1,195 @@
+# A hand-written lexer for Brewin.
+#
+# Produces exactly the token stream brewlex's PLY lexer does (same types, values,
+# line numbers and positions) but without PLY's per-token rule dispatch: one regex
+# with a group per token class is run over the source with finditer, and tokens
+# are built directly from the match. Every character matches some group (the last
+# one is brewlex's catch-all t_DOT), so the matches cover the source contiguously.
+#
+# Use with PLY's parser as  parser.parse(lexer=scanner) after scanner.input(source),
+# or pass scanner.token as tokenfunc.
+#
+# The source may also be any bytes-like object holding UTF-8 text, e.g. an mmap of
+# the program file. Bytes are scanned in place and only identifier and string token
+# slices are ever decoded, so the source is never copied into a Python str. Token
+# lexpos is then a byte offset, for every token in the source.
+import itertools
+import re
+
+from brewlex import reserved_map
+
+# group numbers, in the same priority order as the master regex PLY builds from brewlex
+_IGNORE = 1
+_NUMBER = 2
+_NAME = 3
+_NEWLINE = 4
+_COMMENT = 5
+_STRING = 6
+_OPERATOR = 7
+_DOT = 8  # in _TOKEN_RE
+_NON_ASCII = 8  # in _BYTES_TOKEN_RE, whose catch-all dot moves to group 9
+
+_TOKEN_RE = re.compile(
+    r"([ \t]+)"  # t_ignore
+    r"|(\d+)"  # t_NUMBER
+    r"|([A-Za-z_]\w*)"  # t_NAME
+    r"|(\n+)"  # t_newline
+    r"|(/\*[\s\S]*?\*/)"  # t_comment, without the (.|\n) alternation that backtracks
+    r'|("[^"\n]*")'  # t_STRING: ".*?" can't cross a newline
+    r"|(\|\||&&|==|>=|<=|!=|[(){}+\-*,:;><=/!])"  # two-character operators first
+    r"|(.)"  # t_DOT matches any other character
+)
+
+# The same rules over UTF-8 bytes. In a str, \w, \d and . are Unicode-aware; over
+# bytes they only see ASCII. So a name or number running into a non-ASCII byte, or a
+# non-ASCII character outside a string or comment, is matched by _NON_ASCII instead,
+# and the scanner decodes the rest of the source and finishes with _TOKEN_RE, turning
+# the positions back into byte offsets. Strings and comments are byte-transparent and
+# need no special handling.
+_BYTES_TOKEN_RE = re.compile(
+    rb"([ \t]+)"
+    rb"|(\d+)(?![\d\x80-\xff])"
+    rb"|([A-Za-z_]\w*)(?![\w\x80-\xff])"
+    rb"|(\n+)"
+    rb"|(/\*[\s\S]*?\*/)"
+    rb'|("[^"\n]*")'
+    rb"|(\|\||&&|==|>=|<=|!=|[(){}+\-*,:;><=/!])"
+    rb"|(\w*[\x80-\xff])"
+    rb"|(.)"
+)
+
+# operator text -> token type; the token value is the text itself
+OPERATORS = {
+    "||": "OR",
+    "&&": "AND",
+    "==": "EQ",
+    ">=": "GREATER_EQ",
+    "<=": "LESS_EQ",
+    "!=": "NOT_EQ",
+    "(": "LPAREN",
+    ")": "RPAREN",
+    "{": "LBRACE",
+    "}": "RBRACE",
+    "+": "PLUS",
+    "-": "MINUS",
+    "*": "MULTIPLY",
+    ",": "COMMA",
+    ":": "COLON",
+    ";": "SEMI",
+    ">": "GREATER",
+    "<": "LESS",
+    "=": "ASSIGN",
+    "/": "DIVIDE",
+    "!": "NOT",
+}
+
+
+# bytes text -> (token type, token value) for the words and operators with fixed values
+FIXED_BYTES = {}
+for text, token_type in reserved_map.items():
+    FIXED_BYTES[text.encode("ascii")] = (token_type, text)
+for text, token_type in OPERATORS.items():
+    FIXED_BYTES[text.encode("ascii")] = (token_type, text)
+
+
+class Token:
+    __slots__ = ("type", "value", "lineno", "lexpos", "lexer")
+
+    def __init__(self, type, value, lineno, lexpos):
+        self.type = type
+        self.value = value
+        self.lineno = lineno
+        self.lexpos = lexpos
+
+    def __repr__(self):
+        return f"LexToken({self.type},{self.value!r},{self.lineno},{self.lexpos})"
+
+
+class Lexer:
+    def __init__(self):
+        self.lexdata = ""
+        self.lineno = 1
+        self.token = iter(()).__next__
+
+    def input(self, data):
+        self.lexdata = data
+        if isinstance(data, str):
+            tokens = self.__scan(data, self.lineno)
+        else:
+            tokens = self.__scan_bytes(data, self.lineno)
+        # the parser keeps asking for tokens after the end while it reduces, so pad with None
+        self.token = itertools.chain(tokens, itertools.repeat(None)).__next__
+
+    def clone(self):
+        return Lexer()
+
+    def __iter__(self):
+        while True:
+            tok = self.token()
+            if tok is None:
+                return
+            yield tok
+
+    def __scan(self, data, lineno):
+        reserved = reserved_map
+        operators = OPERATORS
+        for m in _TOKEN_RE.finditer(data):
+            kind = m.lastindex
+            if kind == _IGNORE:
+                continue
+            if kind == _NAME:
+                text = m.group(kind)
+                yield Token(reserved.get(text, "NAME"), text, lineno, m.start())
+            elif kind == _OPERATOR:
+                text = m.group(kind)
+                yield Token(operators[text], text, lineno, m.start())
+            elif kind == _NUMBER:
+                yield Token("NUMBER", int(m.group(kind)), lineno, m.start())
+            elif kind == _NEWLINE:
+                lineno += m.end() - m.start()
+            elif kind == _STRING:
+                yield Token("STRING", m.group(kind)[1:-1], lineno, m.start())
+            elif kind == _COMMENT:
+                lineno += m.group(kind).count("\n")
+            else:
+                yield Token("DOT", m.group(kind), lineno, m.start())
+        self.lineno = lineno
+
+    def __scan_bytes(self, data, lineno):
+        # decoded names are shared: every occurrence of an identifier gets the same str
+        words = dict(FIXED_BYTES)
+        for m in _BYTES_TOKEN_RE.finditer(data):
+            kind = m.lastindex
+            if kind == _IGNORE:
+                continue
+            if kind == _NAME or kind == _OPERATOR:
+                raw = m.group(kind)
+                word = words.get(raw)
+                if word is None:
+                    word = words[raw] = ("NAME", raw.decode("ascii"))
+                yield Token(word[0], word[1], lineno, m.start())
+            elif kind == _NUMBER:
+                yield Token("NUMBER", int(m.group(kind)), lineno, m.start())
+            elif kind == _NEWLINE:
+                lineno += m.end() - m.start()
+            elif kind == _STRING:
+                yield Token("STRING", m.group(kind)[1:-1].decode("utf-8"), lineno, m.start())
+            elif kind == _COMMENT:
+                lineno += m.group(kind).count(b"\n")
+            elif kind == _NON_ASCII:
+                yield from self.__scan_text_tail(data, m.start(), lineno)
+                return
+            else:
+                yield Token("DOT", m.group(kind).decode("ascii"), lineno, m.start())
+        self.lineno = lineno
+
+    # the tokens of data[start:] decoded, with lexpos still a byte offset into data
+    def __scan_text_tail(self, data, start, lineno):
+        text = bytes(data[start:]).decode("utf-8")
+        chars = 0
+        offset = start
+        for tok in self.__scan(text, lineno):
+            offset += len(text[chars:tok.lexpos].encode("utf-8"))
+            chars = tok.lexpos
+            tok.lexpos = offset
+            yield tok
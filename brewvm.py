@@ -0,0 +1,639 @@
+# Bytecode compiler and stack VM backend for interpreterv3.
+#
+# Each function is compiled to a FunctionCode: parallel lists of opcodes and
+# operands, run by VM.execute in one dispatch loop with a value stack. Variables
+# live in a flat list of locals per call, indexed by the slots brewresolve.resolve
+# assigned. Calls push a frame record instead of recursing in Python.
+#
+# Like brewcompile, the VM reproduces the tree walker's coercions, evaluation
+# order, error types and messages; whatever can fail is checked when it runs.
+# Values are never mutated once built, so the VM shares them where the tree
+# walker copies arguments and return values, and literals are built once per
+# program instead of on every evaluation.
+import functools
+
+from brewmemo import MemoCache
+from brewrules import PRIMITIVE_TYPES, can_store, general_binary_op, return_coercion
+from intbase import InterpreterBase, ErrorType
+from type_valuev2 import EMPTY_STRING, FALSE, NIL, TRUE, ZERO, Type, Value, bool_value, get_printable, int_value
+
+# opcodes, roughly in order of how often they run
+LOAD = 0  # slot: push a local
+CONST = 1  # value: push a constant
+STORE = 2  # (slot, name): pop into a local, with brewrules.can_store's type check
+ADD = 3  # slow op: each binary operator pops two values, pushes one
+SUB = 4
+MUL = 5
+DIV = 6
+EQ = 7
+NE = 8
+LT = 9
+LE = 10
+GT = 11
+GE = 12
+AND = 13
+OR = 14
+JUMP_IF_FALSE = 15  # (target, message): pop a condition, int coerced to bool
+JUMP = 16  # target
+LOAD_PATH = 17  # (slot or None, steps): push a struct field
+STORE_PATH = 18  # (slot or None, steps): pop into a struct field
+CHECK_ARG = 19  # (arg type, is struct type): check or coerce the argument on top
+CALL = 20  # (FunctionCode, argc): pop the arguments and enter the function
+RETURN = 21  # None: pop the return value, coerce it and leave the function
+RETURN_NIL = 22  # None: return nil from the function
+POP = 23  # None: discard the top of the stack
+DEFINE = 24  # (slot, default value): var definition
+DEFINE_STRUCT = 25  # (slot, name, struct type): var definition of a struct type
+NEG = 26  # None
+NOT = 27  # None
+NEW = 28  # struct name: push a new struct instance
+STRUCT_ARG = 29  # (arg type, variable name, message): type_of_struct_dict check
+PRINTABLE = 30  # None: pop a value and append its printable form to the string below it
+PRINT = 31  # None: pop the string, output it, push print()'s result
+INPUT = 32  # (function name, has prompt)
+TRACE = 33  # statement: print it (trace_output)
+FAIL = 34  # callable that raises
+TAIL_CALL = 35  # (FunctionCode, argc): CALL that replaces the running call (brewresolve.mark_tail_calls)
+BIND = 36  # slot: pop an argument into an inlined body's parameter (brewinline)
+COERCE = 37  # return_value: coerce the value an inlined body returned
+CACHED = 38  # (slot, target): push the value kept in slot and jump, if there is one (brewopt)
+KEEP = 39  # slot: keep the value on top in a CACHED slot
+UNCACHE = 40  # slots: clear CACHED slots
+FIELD_SLOT = 41  # (slot, steps): push a struct field brewopt keeps in a slot, or the field steps lead to from it
+STORE_FIELD_SLOT = 42  # (slot, steps): pop into such a field, or the field steps lead to from it
+SET_SLOTS = 43  # (slots, values): set the field slots of a struct variable (element.FieldSlotsNode)
+
+OPCODE_NAMES = {
+    value: name for name, value in list(globals().items()) if name.isupper() and isinstance(value, int)
+}
+
+BINARY_OPCODES = {
+    "+": ADD,
+    "-": SUB,
+    "*": MUL,
+    "/": DIV,
+    "==": EQ,
+    "!=": NE,
+    "<": LT,
+    "<=": LE,
+    ">": GT,
+    ">=": GE,
+    "&&": AND,
+    "||": OR,
+}
+
+class FunctionCode:
+    def __init__(self, name, func_def=None):
+        self.name = name
+        self.func_def = func_def
+        self.ops = []
+        self.operands = []
+        self.nlocals = 0
+        self.param_slots = ()
+        self.pooled_slots = ()  # released to the StructPool on return (brewpool.mark_pooled_structs)
+        self.return_value = None  # coerces the returned Value (brewrules.return_coercion)
+
+    def emit(self, op, operand=None):
+        self.ops.append(op)
+        self.operands.append(operand)
+        return len(self.ops) - 1
+
+
+def disassemble(code):
+    lines = [f"{code.name}: {code.nlocals} locals, params in slots {list(code.param_slots)}"]
+    for pc, (op, operand) in enumerate(zip(code.ops, code.operands)):
+        if op == CALL or op == TAIL_CALL:
+            operand = (operand[0].name, operand[1])
+        lines.append(f"{pc:5}  {OPCODE_NAMES[op]:<14} {'' if operand is None else operand}")
+    return "\n".join(lines)
+
+
+class BytecodeCompiler:
+    # interpreter: the interpreterv3.Interpreter running the program, after its
+    # struct and function tables are set up
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.error = interpreter.error
+        self.structs = interpreter.structs
+        self.functions = {}
+        # while compiling an inlined body: the JUMPs its returns make to its end
+        self.inline_exits = None
+
+    # returns the FunctionCode of a stub that calls main()
+    def compile_program(self):
+        for name, overloads in self.interpreter.func_name_to_ast.items():
+            for num_params, func_def in overloads.items():
+                self.functions[name, num_params] = FunctionCode(name, func_def)
+        for code in self.functions.values():
+            self.__function(code)
+
+        entry = FunctionCode("<entry>")
+        entry.return_value = lambda value: value
+        self.__call(entry, "main", [])
+        entry.emit(POP)
+        entry.emit(RETURN_NIL)
+        return entry
+
+    def __fail(self, code, error_type, message):
+        code.emit(FAIL, functools.partial(self.error, error_type, message))
+
+    def __function(self, code):
+        func_def = code.func_def
+        code.return_value = return_coercion(self.interpreter, func_def.return_type)
+        code.nlocals = func_def.nlocals
+        code.param_slots = func_def.param_slots
+        code.pooled_slots = func_def.pooled_slots
+        self.__block(code, func_def.statements)
+        code.emit(RETURN_NIL)
+
+    def __block(self, code, statements):
+        trace = self.interpreter.trace_output
+        for statement in statements:
+            if trace:
+                code.emit(TRACE, statement)
+            self.__statement(code, statement)
+
+    # --- statements ---------------------------------------------------------
+
+    def __statement(self, code, statement):
+        kind = statement.elem_type
+        if kind == InterpreterBase.FCALL_NODE:
+            self.__call(code, statement.name, statement.args)
+            code.emit(POP)
+        elif kind == InterpreterBase.INLINE_NODE:
+            self.__inline(code, statement)
+            code.emit(POP)
+        elif kind == InterpreterBase.UNCACHE_NODE:
+            code.emit(UNCACHE, statement.slots)
+        elif kind == InterpreterBase.FIELD_SLOT_ASSIGN_NODE:
+            self.__expression(code, statement.expression)
+            code.emit(STORE_FIELD_SLOT, (statement.target.slot, statement.target.steps))
+        elif kind == InterpreterBase.FIELD_SLOTS_NODE:
+            code.emit(SET_SLOTS, (statement.slots, statement.values))
+        elif kind == "=":
+            self.__assign(code, statement)
+        elif kind == InterpreterBase.VAR_DEF_NODE:
+            self.__var_def(code, statement)
+        elif kind == InterpreterBase.RETURN_NODE:
+            self.__return(code, statement)
+        elif kind == InterpreterBase.IF_NODE:
+            self.__if(code, statement)
+        elif kind == InterpreterBase.FOR_NODE:
+            self.__for(code, statement)
+        # anything else (try, raise) is ignored by the tree walker too
+
+    def __assign(self, code, assign_ast):
+        self.__expression(code, assign_ast.expression)
+        if assign_ast.path is not None:
+            path = assign_ast.path
+            code.emit(STORE_PATH, (path.base_slot, path.steps))
+            return
+        name = assign_ast.name
+        slot = assign_ast.slot
+        if slot is None:
+            self.__fail(code, ErrorType.NAME_ERROR, f"Undefined variable {name} in assignment")
+        else:
+            code.emit(STORE, (slot, name))
+
+    def __var_def(self, code, var_ast):
+        name = var_ast.name
+        var_type = var_ast.var_type
+        if var_type == InterpreterBase.BOOL_NODE:
+            default = FALSE
+        elif var_type == InterpreterBase.INT_NODE:
+            default = ZERO
+        elif var_type == InterpreterBase.STRING_NODE:
+            default = EMPTY_STRING
+        elif var_type in self.structs:
+            default = None
+        else:
+            self.__fail(
+                code,
+                ErrorType.TYPE_ERROR,
+                f"All variable definitions must now specify an explicit type for the variable",
+            )
+            return
+
+        slot = var_ast.slot
+        if slot is None:
+            if default is None:
+                code.emit(DEFINE_STRUCT, (None, name, var_type))
+            self.__fail(code, ErrorType.NAME_ERROR, f"Duplicate definition for variable {name}")
+            return
+        if default is None:
+            code.emit(DEFINE_STRUCT, (slot, name, var_type))
+        else:
+            code.emit(DEFINE, (slot, default))
+
+    def __return(self, code, return_ast):
+        expr_ast = return_ast.expression
+        if self.inline_exits is not None:
+            # leave the inlined body with the value on the stack
+            if expr_ast is None:
+                code.emit(CONST, self.interpreter.NIL_VALUE)
+            else:
+                self.__expression(code, expr_ast)
+            self.inline_exits.append(code.emit(JUMP))
+            return
+        if expr_ast is None:
+            code.emit(RETURN_NIL)
+            return
+        if return_ast.tail_call is not None:
+            self.__call(code, expr_ast.name, expr_ast.args, TAIL_CALL)
+            return
+        self.__expression(code, expr_ast)
+        code.emit(RETURN)
+
+    def __if(self, code, if_ast):
+        self.__expression(code, if_ast.condition)
+        jump_if_false = code.emit(JUMP_IF_FALSE)
+        self.__block(code, if_ast.statements)
+        if if_ast.else_statements is not None:
+            jump = code.emit(JUMP)
+            code.operands[jump_if_false] = (len(code.ops), "Incompatible type for if condition")
+            self.__block(code, if_ast.else_statements)
+            code.operands[jump] = len(code.ops)
+        else:
+            code.operands[jump_if_false] = (len(code.ops), "Incompatible type for if condition")
+
+    def __for(self, code, for_ast):
+        self.__statement(code, for_ast.init)
+        top = len(code.ops)
+        self.__expression(code, for_ast.condition)
+        jump_if_false = code.emit(JUMP_IF_FALSE)
+        self.__block(code, for_ast.statements)
+        self.__statement(code, for_ast.update)
+        code.emit(JUMP, top)
+        code.operands[jump_if_false] = (len(code.ops), "Incompatible type for for condition")
+
+    # --- expressions --------------------------------------------------------
+
+    def __expression(self, code, expr_ast):
+        kind = expr_ast.elem_type
+        if kind == InterpreterBase.VAR_NODE:
+            if expr_ast.path is not None:
+                path = expr_ast.path
+                code.emit(LOAD_PATH, (path.base_slot, path.steps))
+                return
+            slot = expr_ast.slot
+            if slot is None:
+                self.__fail(code, ErrorType.NAME_ERROR, f"Variable {expr_ast.name} not found")
+            else:
+                code.emit(LOAD, slot)
+        elif kind in BINARY_OPCODES:
+            self.__expression(code, expr_ast.op1)
+            self.__expression(code, expr_ast.op2)
+            code.emit(BINARY_OPCODES[kind], general_binary_op(self.interpreter, kind))
+        elif kind == InterpreterBase.INT_NODE:
+            code.emit(CONST, expr_ast.constant)
+        elif kind == InterpreterBase.STRING_NODE:
+            code.emit(CONST, expr_ast.constant)
+        elif kind == InterpreterBase.BOOL_NODE:
+            code.emit(CONST, expr_ast.constant)
+        elif kind == InterpreterBase.NIL_NODE:
+            code.emit(CONST, self.interpreter.NIL_VALUE)
+        elif kind == InterpreterBase.FCALL_NODE:
+            self.__call(code, expr_ast.name, expr_ast.args)
+        elif kind == InterpreterBase.INLINE_NODE:
+            self.__inline(code, expr_ast)
+        elif kind == InterpreterBase.FIELD_SLOT_NODE:
+            code.emit(FIELD_SLOT, (expr_ast.slot, expr_ast.steps))
+        elif kind == InterpreterBase.CACHED_NODE:
+            cached = code.emit(CACHED)
+            self.__expression(code, expr_ast.expression)
+            code.emit(KEEP, expr_ast.slot)
+            code.operands[cached] = (expr_ast.slot, len(code.ops))
+        elif kind == InterpreterBase.NEW_NODE:
+            code.emit(NEW, expr_ast.var_type)
+        elif kind == InterpreterBase.NEG_NODE:
+            self.__expression(code, expr_ast.op1)
+            code.emit(NEG)
+        elif kind == InterpreterBase.NOT_NODE:
+            self.__expression(code, expr_ast.op1)
+            code.emit(NOT)
+        else:
+            code.emit(CONST, None)
+
+    # call_op: CALL, or TAIL_CALL for a marked tail call
+    def __call(self, code, func_name, actual_args, call_op=CALL):
+        if func_name == "print":
+            code.emit(CONST, "")
+            for arg in actual_args:
+                self.__expression(code, arg)
+                code.emit(PRINTABLE)
+            code.emit(PRINT)
+            return
+        if func_name == "inputi" or func_name == "inputs":
+            if len(actual_args) > 1:
+                self.__fail(code, ErrorType.NAME_ERROR, "No inputi() function that takes > 1 parameter")
+                return
+            for arg in actual_args:
+                self.__expression(code, arg)
+            code.emit(INPUT, (func_name, len(actual_args) == 1))
+            return
+
+        callee = self.functions.get((func_name, len(actual_args)))
+        if callee is None:
+            if any(name == func_name for name, _ in self.functions):
+                message = f"Function {func_name} taking {len(actual_args)} params not found"
+            else:
+                message = f"Function {func_name} not found"
+            self.__fail(code, ErrorType.NAME_ERROR, message)
+            return
+
+        for formal_ast, actual_ast in zip(callee.func_def.args, actual_args):
+            self.__argument(code, func_name, formal_ast, actual_ast)
+        code.emit(call_op, (callee, len(actual_args)))
+
+    # a call brewinline replaced with the callee's body: the arguments are pushed
+    # and checked as for the call, then popped into the body's parameter slots,
+    # and the body runs in the caller's frame; its returns jump to the end,
+    # where the value is coerced as the call's RETURN would
+    def __inline(self, code, inline_ast):
+        func_def = self.functions[inline_ast.name, len(inline_ast.args)].func_def
+        for formal_ast, actual_ast in zip(func_def.args, inline_ast.args):
+            self.__argument(code, inline_ast.name, formal_ast, actual_ast)
+        bound = set()
+        for slot in reversed(inline_ast.param_slots):
+            # a repeated parameter name holds the last argument
+            if slot in bound:
+                code.emit(POP)
+            else:
+                code.emit(BIND, slot)
+                bound.add(slot)
+
+        outer_exits = self.inline_exits
+        self.inline_exits = []
+        self.__block(code, inline_ast.statements)
+        code.emit(CONST, self.interpreter.NIL_VALUE)
+        for jump in self.inline_exits:
+            code.operands[jump] = len(code.ops)
+        self.inline_exits = outer_exits
+        code.emit(COERCE, return_coercion(self.interpreter, func_def.return_type))
+
+    def __argument(self, code, func_name, formal_ast, actual_ast):
+        arg_name = formal_ast.name
+        arg_type = formal_ast.var_type
+        structs = self.structs
+        if arg_type not in PRIMITIVE_TYPES and arg_type not in structs:
+            self.__fail(
+                code,
+                ErrorType.NAME_ERROR,
+                f"Invalid type for formal parameter {arg_name} in function {func_name}*/",
+            )
+            return
+
+        mismatch = f"Formal parameter {arg_name} excepted struct of type {arg_type}, type mismatch*/"
+        if arg_type not in structs:
+            pass
+        elif actual_ast.get("var_type") is not None and actual_ast.get("var_type") == arg_type:
+            pass
+        elif actual_ast.elem_type == InterpreterBase.VAR_NODE and actual_ast.path is not None:
+            field_type = actual_ast.path.field_type
+            if field_type is not None and field_type != arg_type:
+                self.__fail(code, ErrorType.TYPE_ERROR, mismatch)
+                return
+        else:
+            code.emit(STRUCT_ARG, (arg_type, actual_ast.get("name"), mismatch))
+        self.__expression(code, actual_ast)
+        code.emit(CHECK_ARG, (arg_type, arg_type in structs))
+
+
+class VM:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+
+    def execute(self, entry):
+        interpreter = self.interpreter
+        error = interpreter.error
+        structs = interpreter.structs
+        type_of_struct_dict = interpreter.type_of_struct_dict
+        check_path_base = interpreter.check_path_base
+        follow_field_path = interpreter.follow_field_path
+        store_field_path = interpreter.store_field_path
+        field_value = interpreter.field_value
+        nil_value = interpreter.NIL_VALUE
+        memo = interpreter.memo
+        pool = interpreter.pool
+        small_int = int_value
+
+        frames = []
+        code = entry
+        ops = code.ops
+        operands = code.operands
+        slots = []
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        pc = 0
+        while True:
+            op = ops[pc]
+            arg = operands[pc]
+            pc += 1
+            if op == LOAD:
+                push(slots[arg])
+            elif op == CONST:
+                push(arg)
+            elif op == STORE:
+                slot, name = arg
+                value = pop()
+                cur_type = slots[slot].t
+                val_type = value.t
+                if cur_type != val_type and not can_store(cur_type, val_type):
+                    error(
+                        ErrorType.TYPE_ERROR,
+                        f"{name} has type {cur_type} but was set to a {val_type}",
+                    )
+                slots[slot] = value
+            elif op <= OR:
+                right = pop()
+                left = stack[-1]
+                if op <= DIV:
+                    if left.t == "int" and right.t == "int":
+                        if op == ADD:
+                            stack[-1] = small_int(left.v + right.v)
+                        elif op == SUB:
+                            stack[-1] = small_int(left.v - right.v)
+                        elif op == MUL:
+                            stack[-1] = small_int(left.v * right.v)
+                        else:
+                            stack[-1] = small_int(left.v // right.v)
+                    else:
+                        stack[-1] = arg(left, right)
+                elif op <= GE:
+                    if left.t == "int" and right.t == "int":
+                        if op == LT:
+                            stack[-1] = TRUE if left.v < right.v else FALSE
+                        elif op == EQ:
+                            stack[-1] = TRUE if left.v == right.v else FALSE
+                        elif op == GT:
+                            stack[-1] = TRUE if left.v > right.v else FALSE
+                        elif op == LE:
+                            stack[-1] = TRUE if left.v <= right.v else FALSE
+                        elif op == GE:
+                            stack[-1] = TRUE if left.v >= right.v else FALSE
+                        else:
+                            stack[-1] = TRUE if left.v != right.v else FALSE
+                    else:
+                        stack[-1] = arg(left, right)
+                elif left.t == "bool" and right.t == "bool":
+                    if op == AND:
+                        stack[-1] = bool_value(left.v and right.v)
+                    else:
+                        stack[-1] = bool_value(left.v or right.v)
+                else:
+                    stack[-1] = arg(left, right)
+            elif op == JUMP_IF_FALSE:
+                condition = pop()
+                cond_type = condition.t
+                if cond_type == "bool":
+                    if not condition.v:
+                        pc = arg[0]
+                elif cond_type == "int":
+                    if condition.v == 0:
+                        pc = arg[0]
+                else:
+                    error(ErrorType.TYPE_ERROR, arg[1])
+            elif op == JUMP:
+                pc = arg
+            elif op == LOAD_PATH:
+                slot, steps = arg
+                push(follow_field_path(check_path_base(None if slot is None else slots[slot]), steps))
+            elif op == STORE_PATH:
+                slot, steps = arg
+                value = pop()
+                store_field_path(check_path_base(None if slot is None else slots[slot]), steps, value)
+            elif op == CHECK_ARG:
+                arg_type, is_struct = arg
+                value = stack[-1]
+                val_type = value.t
+                if arg_type == "bool" and val_type == "int":
+                    stack[-1] = TRUE if value.v != 0 else FALSE
+                elif is_struct and val_type == "nil":
+                    pass
+                elif arg_type != val_type:
+                    error(ErrorType.TYPE_ERROR, f"Wrong type for parameter input")
+            elif op == CALL or op == TAIL_CALL:
+                callee, argc = arg
+                new_slots = [None] * callee.nlocals
+                if argc:
+                    args = stack[-argc:]
+                    del stack[-argc:]
+                    for slot, value in zip(callee.param_slots, args):
+                        new_slots[slot] = value
+                # a tail call returns the same type, so the callee can return
+                # straight to this call's caller
+                if op == CALL:
+                    # the frame record also keeps the MemoCache key the callee's result goes under
+                    memo_key = None
+                    if memo is not None and callee.func_def.pure:
+                        memo_key = MemoCache.key(callee.func_def, [new_slots[slot] for slot in callee.param_slots])
+                        value = memo.get(memo_key)
+                        if value is not None:
+                            push(value)
+                            continue
+                    frames.append((code, pc, slots, stack, memo_key))
+                elif pool is not None:
+                    pool.release(slots, code.pooled_slots)
+                code = callee
+                ops = code.ops
+                operands = code.operands
+                slots = new_slots
+                stack = []
+                push = stack.append
+                pop = stack.pop
+                pc = 0
+            elif op == RETURN or op == RETURN_NIL:
+                value = code.return_value(pop() if op == RETURN else nil_value)
+                if not frames:
+                    return value
+                if pool is not None:
+                    pool.release(slots, code.pooled_slots)
+                code, pc, slots, stack, memo_key = frames.pop()
+                if memo_key is not None:
+                    memo.put(memo_key, value)
+                ops = code.ops
+                operands = code.operands
+                push = stack.append
+                pop = stack.pop
+                push(value)
+            elif op == POP:
+                pop()
+            elif op == DEFINE:
+                slots[arg[0]] = arg[1]
+            elif op == DEFINE_STRUCT:
+                slot, name, var_type = arg
+                type_of_struct_dict[name] = var_type
+                if slot is not None:
+                    slots[slot] = NIL
+            elif op == NEG:
+                value = stack[-1]
+                if value.t != Type.INT:
+                    error(ErrorType.TYPE_ERROR, f"Incompatible type for neg operation")
+                stack[-1] = small_int(-1 * value.v)
+            elif op == NOT:
+                value = stack[-1]
+                if value.t != Type.BOOL:
+                    error(ErrorType.TYPE_ERROR, f"Incompatible type for ! operation")
+                stack[-1] = FALSE if value.v else TRUE
+            elif op == NEW:
+                struct_class = structs[arg]
+                push(struct_class(struct_class.defaults) if pool is None else pool.new(struct_class))
+            elif op == STRUCT_ARG:
+                arg_type, name, message = arg
+                if arg_type != type_of_struct_dict[name]:
+                    error(ErrorType.TYPE_ERROR, message)
+            elif op == PRINTABLE:
+                value = pop()
+                stack[-1] = stack[-1] + get_printable(value)
+            elif op == PRINT:
+                interpreter.output(stack[-1])
+                stack[-1] = InterpreterBase.VOID_DEF
+            elif op == INPUT:
+                func_name, has_prompt = arg
+                if has_prompt:
+                    interpreter.output(get_printable(pop()))
+                inp = interpreter.get_input()
+                if func_name == "inputi":
+                    push(small_int(int(inp)))
+                else:
+                    push(Value(Type.STRING, inp))
+            elif op == BIND:
+                slots[arg] = pop()
+            elif op == COERCE:
+                stack[-1] = arg(stack[-1])
+            elif op == CACHED:
+                value = slots[arg[0]]
+                if value is not None:
+                    push(value)
+                    pc = arg[1]
+            elif op == KEEP:
+                slots[arg] = stack[-1]
+            elif op == UNCACHE:
+                for slot in arg:
+                    slots[slot] = None
+            elif op == FIELD_SLOT:
+                slot, steps = arg
+                value = slots[slot]
+                if value is None:
+                    error(ErrorType.FAULT_ERROR, "Dot operator invalid on uninitialized struct")
+                push(follow_field_path(value, steps) if steps else value)
+            elif op == STORE_FIELD_SLOT:
+                slot, steps = arg
+                value = pop()
+                field = slots[slot]
+                if field is None:
+                    error(ErrorType.FAULT_ERROR, "Dot operator invalid on uninitialized struct")
+                if steps:
+                    store_field_path(field, steps, value)
+                else:
+                    slots[slot] = field_value(field, value)
+            elif op == SET_SLOTS:
+                for slot, value in zip(*arg):
+                    slots[slot] = value
+            elif op == TRACE:
+                print(arg)
+            elif op == FAIL:
+                arg()
+            else:
+                raise RuntimeError(f"bad opcode {op} at {pc - 1} in {code.name}")
@@ -17,7 +17,7 @@ class Element:
         return s[0:-2]
 
     def __val(self, v):
-        if isinstance(v, Element):
+        if isinstance(v, (Element, Node)):
             return "[" + str(v) + "]"
         if isinstance(v, list):
             s = ""
@@ -27,3 +27,435 @@ class Element:
                 return "[" + s[0:-2] + "]"
             return "[" + s + "]"
         return str(v)
+
+
+# Compact AST nodes produced by brewparse. Each node kind has a fixed set of
+# fields stored in __slots__ and read with plain attribute access (node.op1).
+# get() and elem_type keep them interchangeable with Element for the older
+# interpreters, which only ever call node.get("field").
+class Node:
+    __slots__ = ()
+    _fields = ()
+    init_args = ()
+
+    def get(self, key):
+        if key in self._fields:
+            return getattr(self, key)
+        return None
+
+    # field name -> value, in the same order Element stored its kwargs
+    @property
+    def dict(self):
+        return {key: getattr(self, key) for key in self._fields}
+
+    # rebuild through __init__ so pickled trees (brewcache) stay small and fast to load
+    def __reduce__(self):
+        return (self.__class__, tuple(getattr(self, key) for key in self.init_args))
+
+    def __str__(self):
+        s = f"{self.elem_type}: "
+        for key in self._fields:
+            s += key + ": " + _val(getattr(self, key)) + ", "
+        return s[0:-2]
+
+
+def _val(v):
+    if isinstance(v, (Element, Node)):
+        return "[" + str(v) + "]"
+    if isinstance(v, list):
+        s = ""
+        for i in v:
+            s += str(i) + ", "
+        if len(s) > 0:
+            return "[" + s[0:-2] + "]"
+        return "[" + s + "]"
+    return str(v)
+
+
+class ProgramNode(Node):
+    __slots__ = ("structs", "functions")
+    elem_type = "program"
+    _fields = init_args = __slots__
+
+    def __init__(self, structs, functions):
+        self.structs = structs
+        self.functions = functions
+
+
+class StructNode(Node):
+    __slots__ = ("name", "fields")
+    elem_type = "struct"
+    _fields = init_args = __slots__
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+
+class FieldDefNode(Node):
+    __slots__ = ("name", "var_type")
+    elem_type = "fielddef"
+    _fields = init_args = __slots__
+
+    def __init__(self, name, var_type):
+        self.name = name
+        self.var_type = var_type
+
+
+# nlocals and param_slots are filled in by brewresolve.resolve, pure by
+# brewmemo.mark_pure_functions, pooled_slots by brewpool.mark_pooled_structs
+class FuncNode(Node):
+    __slots__ = ("name", "args", "return_type", "statements", "nlocals", "param_slots", "pure", "pooled_slots")
+    elem_type = "func"
+    _fields = init_args = ("name", "args", "return_type", "statements")
+
+    def __init__(self, name, args, return_type, statements):
+        self.name = name
+        self.args = args
+        self.return_type = return_type
+        self.statements = statements
+        self.nlocals = 0
+        self.param_slots = ()
+        self.pure = False
+        self.pooled_slots = ()
+
+
+class ArgNode(Node):
+    __slots__ = ("name", "var_type")
+    elem_type = "arg"
+    _fields = init_args = __slots__
+
+    def __init__(self, name, var_type):
+        self.name = name
+        self.var_type = var_type
+
+
+# name is the target as written ("a.b.c"); path is its FieldPathNode when it has dots.
+# slot (the variable's, or the path base's) is filled in by brewresolve.resolve,
+# checked by brewcheck.check
+class AssignNode(Node):
+    __slots__ = ("name", "expression", "path", "slot", "checked")
+    elem_type = "="
+    _fields = ("name", "expression")
+    init_args = ("name", "expression", "path")
+
+    def __init__(self, name, expression, path=None):
+        self.name = name
+        self.expression = expression
+        self.path = path
+        self.slot = None
+        self.checked = False
+
+
+# slot is filled in by brewresolve.resolve (None for a repeated definition)
+class VarDefNode(Node):
+    __slots__ = ("name", "var_type", "slot")
+    elem_type = "vardef"
+    _fields = init_args = ("name", "var_type")
+
+    def __init__(self, name, var_type):
+        self.name = name
+        self.var_type = var_type
+        self.slot = None
+
+
+class IfNode(Node):
+    __slots__ = ("condition", "statements", "else_statements")
+    elem_type = "if"
+    _fields = init_args = __slots__
+
+    def __init__(self, condition, statements, else_statements):
+        self.condition = condition
+        self.statements = statements
+        self.else_statements = else_statements
+
+
+# counter is set by brewresolve.mark_counting_loops
+class ForNode(Node):
+    __slots__ = ("init", "condition", "update", "statements", "counter")
+    elem_type = "for"
+    _fields = init_args = ("init", "condition", "update", "statements")
+
+    def __init__(self, init, condition, update, statements):
+        self.init = init
+        self.condition = condition
+        self.update = update
+        self.statements = statements
+        self.counter = None
+
+
+class TryNode(Node):
+    __slots__ = ("statements", "catchers")
+    elem_type = "try"
+    _fields = init_args = __slots__
+
+    def __init__(self, statements, catchers):
+        self.statements = statements
+        self.catchers = catchers
+
+
+class CatchNode(Node):
+    __slots__ = ("exception_type", "statements")
+    elem_type = "catch"
+    _fields = init_args = __slots__
+
+    def __init__(self, exception_type, statements):
+        self.exception_type = exception_type
+        self.statements = statements
+
+
+class RaiseNode(Node):
+    __slots__ = ("exception_type",)
+    elem_type = "raise"
+    _fields = init_args = __slots__
+
+    def __init__(self, exception_type):
+        self.exception_type = exception_type
+
+
+# tail_call is filled in by brewresolve.mark_tail_calls
+class ReturnNode(Node):
+    __slots__ = ("expression", "tail_call")
+    elem_type = "return"
+    _fields = init_args = ("expression",)
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tail_call = None
+
+
+# Expression nodes also carry a static_type, filled in by brewcheck.check: the
+# set of types their value can have, or None where that isn't known.
+
+
+# "!" and "neg"
+class UnaryOpNode(Node):
+    __slots__ = ("elem_type", "op1", "static_type")
+    _fields = ("op1",)
+    init_args = ("elem_type", "op1")
+
+    def __init__(self, elem_type, op1):
+        self.elem_type = elem_type
+        self.op1 = op1
+        self.static_type = None
+
+
+# arithmetic, comparison and logical operators; elem_type is the operator itself.
+# operand_type is set by brewcheck.check when both operands are proven to have
+# that one type and the operator applies to it directly
+class BinOpNode(Node):
+    __slots__ = ("elem_type", "op1", "op2", "static_type", "operand_type")
+    _fields = ("op1", "op2")
+    init_args = ("elem_type", "op1", "op2")
+
+    def __init__(self, elem_type, op1, op2):
+        self.elem_type = elem_type
+        self.op1 = op1
+        self.op2 = op2
+        self.static_type = None
+        self.operand_type = None
+
+
+class NewNode(Node):
+    __slots__ = ("var_type", "static_type")
+    elem_type = "new"
+    _fields = init_args = ("var_type",)
+
+    def __init__(self, var_type):
+        self.var_type = var_type
+        self.static_type = None
+
+
+# literals; constant is their Value, built once by brewresolve.resolve
+class IntNode(Node):
+    __slots__ = ("val", "static_type", "constant")
+    elem_type = "int"
+    _fields = init_args = ("val",)
+
+    def __init__(self, val):
+        self.val = val
+        self.static_type = None
+        self.constant = None
+
+
+class BoolNode(Node):
+    __slots__ = ("val", "static_type", "constant")
+    elem_type = "bool"
+    _fields = init_args = ("val",)
+
+    def __init__(self, val):
+        self.val = val
+        self.static_type = None
+        self.constant = None
+
+
+class StringNode(Node):
+    __slots__ = ("val", "static_type", "constant")
+    elem_type = "string"
+    _fields = init_args = ("val",)
+
+    def __init__(self, val):
+        self.val = val
+        self.static_type = None
+        self.constant = None
+
+
+class NilNode(Node):
+    __slots__ = ("static_type",)
+    elem_type = "nil"
+
+    def __init__(self):
+        self.static_type = None
+
+
+# name is the variable as written ("a.b.c"); path is its FieldPathNode when it has dots.
+# slot (the variable's, or the path base's) is filled in by brewresolve.resolve
+class VarNode(Node):
+    __slots__ = ("name", "path", "slot", "static_type")
+    elem_type = "var"
+    _fields = ("name",)
+    init_args = ("name", "path")
+
+    def __init__(self, name, path=None):
+        self.name = name
+        self.path = path
+        self.slot = None
+        self.static_type = None
+
+
+# a.b.c split once by the parser: base "a", fields ("b", "c").
+# base_slot, steps and field_type are filled in per run by brewresolve.resolve:
+# the base variable's slot, one (field name, offset, expected struct class)
+# triple per field, and the declared type of the last field (None where it
+# can't be determined statically).
+class FieldPathNode(Node):
+    __slots__ = ("base", "fields", "base_slot", "steps", "field_type")
+    elem_type = "path"
+    _fields = ("base", "fields")
+    init_args = _fields
+
+    def __init__(self, base, fields):
+        self.base = base
+        self.fields = fields
+        self.base_slot = None
+        self.steps = None
+        self.field_type = None
+
+    def __str__(self):
+        return ".".join((self.base,) + self.fields)
+
+
+# args_checked is set by brewcheck.check when every argument is proven to pass
+# the parameter checks; builtin by brewresolve.resolve; call_site is the tree
+# walker's cache of the resolved function and how to bind its arguments
+class FCallNode(Node):
+    __slots__ = ("name", "args", "static_type", "args_checked", "builtin", "call_site")
+    elem_type = "fcall"
+    _fields = init_args = ("name", "args")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.static_type = None
+        self.args_checked = False
+        self.builtin = None
+        self.call_site = None
+
+
+# A call to a user function with the callee's body in place of the call, made
+# by brewinline. It reads like the FCallNode it replaces (name, args and the
+# annotations a call site has); callee is the FuncNode called, and statements
+# its body with every variable moved to a slot of the caller's frame, the
+# parameters to param_slots.
+class InlineNode(Node):
+    __slots__ = (
+        "name", "args", "callee", "param_slots", "statements",
+        "static_type", "args_checked", "builtin", "call_site",
+    )
+    elem_type = "inline"
+    _fields = ("name", "args")
+    init_args = ("name", "args", "callee", "param_slots", "statements")
+
+    def __init__(self, name, args, callee, param_slots, statements):
+        self.name = name
+        self.args = args
+        self.callee = callee
+        self.param_slots = param_slots
+        self.statements = statements
+        self.static_type = None
+        self.args_checked = False
+        self.builtin = None
+        self.call_site = None
+
+
+# An expression run at most once between resets of its slot, made by brewopt
+# for loop-invariant expressions and repeated field reads. The first time it
+# runs its value is kept in slot (of the running call's frame); until an
+# UncacheNode clears the slot again, running it returns that value.
+class CachedNode(Node):
+    __slots__ = ("expression", "slot", "static_type")
+    elem_type = "cached"
+    _fields = ("expression",)
+    init_args = ("expression", "slot")
+
+    def __init__(self, expression, slot):
+        self.expression = expression
+        self.slot = slot
+        self.static_type = None
+
+
+# Clears the slots of CachedNodes, so they run their expressions again.
+class UncacheNode(Node):
+    __slots__ = ("slots",)
+    elem_type = "uncache"
+    _fields = ("slots",)
+    init_args = ("slots",)
+
+    def __init__(self, slots):
+        self.slots = slots
+
+
+# A field of a struct variable whose fields brewopt moved to slots of their own
+# (a struct that never leaves its function): the field's value is kept in slot,
+# None while the variable is nil, and steps are the rest of the path from it,
+# as FieldPathNode.steps. name is the path as written, var_type the variable's
+# struct type.
+class FieldSlotNode(Node):
+    __slots__ = ("name", "var_type", "field", "slot", "steps", "static_type")
+    elem_type = "fieldslot"
+    _fields = ("name",)
+    init_args = ("name", "var_type", "field", "slot", "steps")
+
+    def __init__(self, name, var_type, field, slot, steps):
+        self.name = name
+        self.var_type = var_type
+        self.field = field
+        self.slot = slot
+        self.steps = steps
+        self.static_type = None
+
+
+# An assignment to a field a FieldSlotNode (target) stands for.
+class FieldSlotAssignNode(Node):
+    __slots__ = ("target", "expression")
+    elem_type = "fieldslot="
+    _fields = ("target", "expression")
+    init_args = ("target", "expression")
+
+    def __init__(self, target, expression):
+        self.target = target
+        self.expression = expression
+
+
+# Sets the field slots of such a struct variable: to the fields' defaults where
+# the program created the struct, to None where it set the variable to nil.
+class FieldSlotsNode(Node):
+    __slots__ = ("name", "slots", "values")
+    elem_type = "fieldslots"
+    _fields = ("name", "slots")
+    init_args = ("name", "slots", "values")
+
+    def __init__(self, name, slots, values):
+        self.name = name
+        self.slots = slots
+        self.values = values
@@ -32,6 +32,12 @@ class InterpreterBase:
     TRY_NODE = "try"
     CATCH_NODE = "catch"
     RAISE_NODE = "raise"
+    INLINE_NODE = "inline"  # a call brewinline replaced with the callee's body
+    CACHED_NODE = "cached"  # an expression brewopt keeps the value of
+    UNCACHE_NODE = "uncache"  # clears CACHED_NODE values
+    FIELD_SLOT_NODE = "fieldslot"  # a struct field brewopt keeps in a local slot
+    FIELD_SLOT_ASSIGN_NODE = "fieldslot="
+    FIELD_SLOTS_NODE = "fieldslots"  # sets the FIELD_SLOT_NODE slots of a variable
 
     # other constants
     TRUE_DEF = "true"
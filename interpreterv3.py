@@ -1,100 +1,219 @@
 # document that we won't have a return inside the init/update of a for loop
 
-import copy
 from enum import Enum
 
+from brewcheck import BOOL, check
+from brewcompile import ClosureCompiler
+from brewmemo import MemoCache, mark_pure_functions
+from brewopt import optimize
 from brewparse import parse_program
+from brewpool import mark_pooled_structs
+from brewvm import VM, BytecodeCompiler
+from brewresolve import PRINT, StructLayout, mark_counting_loops, mark_tail_calls, resolve
+from brewrules import PRIMITIVE_TYPES, general_binary_op, return_coercion
 from env_v2 import EnvironmentManager
 from intbase import InterpreterBase, ErrorType
-from type_valuev2 import Type, Value, create_value, get_printable
+from type_valuev2 import (
+    EMPTY_STRING,
+    FALSE,
+    NIL,
+    TRUE,
+    ZERO,
+    Type,
+    Value,
+    bool_value,
+    get_printable,
+    int_value,
+)
+
+
+# binding plan actions (Interpreter.__binding_plan)
+_BIND_SHARE = "share"  # evaluate and pass the value (struct references and immutable Values alike)
+_BIND_STRUCT_VAR = "struct var"  # check the variable's type in type_of_struct_dict, then evaluate
+_BIND_FAIL = "fail"  # raise the error in the detail field
 
 
 class ExecStatus(Enum):
     CONTINUE = 1
     RETURN = 2
+    TAIL_CALL = 3  # return value is (callee FuncNode, evaluated arguments)
+
+
+# what running a statement or block that carries on to the next one returns;
+# shared, so statements and loop iterations that don't return allocate nothing
+_CONTINUE = (ExecStatus.CONTINUE, NIL)
 
 
 # Main interpreter class
 class Interpreter(InterpreterBase):
     # constants
-    NIL_VALUE = create_value(InterpreterBase.NIL_DEF)
-    TRUE_VALUE = create_value(InterpreterBase.TRUE_DEF)
+    NIL_VALUE = NIL
+    TRUE_VALUE = TRUE
     BIN_OPS = {"+", "-", "*", "/", "==", "!=", ">", ">=", "<", "<=", "||", "&&"}
 
     # methods
-    def __init__(self, console_output=True, inp=None, trace_output=False):
+    # ast_cache: optional brewcache.ASTCache used to skip re-parsing programs we've seen before
+    # memo_cache: optional brewmemo.MemoCache; calls to pure functions are answered from it
+    # (not while tracing, which prints the statements a call would run)
+    # struct_pool: optional brewpool.StructPool; `new` reuses the struct instances
+    # it recycles from the frame-local struct variables of returning calls
+    # optimize: run each program through brewopt.optimize before running it, and
+    # annotate it with brewcheck so the backends skip the checks it proves pass
+    # inliner: optional brewinline.Inliner; small functions are inlined into their callers
+    # (neither while tracing, which prints the statements as written)
+    def __init__(self, console_output=True, inp=None, trace_output=False, ast_cache=None, memo_cache=None, struct_pool=None, optimize=False, inliner=None):
         super().__init__(console_output, inp)
         self.trace_output = trace_output
+        self.ast_cache = ast_cache
+        self.memo_cache = memo_cache
+        self.struct_pool = struct_pool
+        self.optimize = optimize
+        self.inliner = inliner
         self.__setup_ops()
 
+    BACKENDS = ("tree", "closure", "vm")
+
     # run a program that's provided in a string
     # use the provided Parser found in brewparse.py to parse the program
     # into an abstract syntax tree (ast)
-    def run(self, program):
-        ast = parse_program(program)
+    # backend: "tree" walks the AST directly; "closure" compiles it to Python
+    # closures first (brewcompile) and runs those; "vm" compiles it to bytecode
+    # for a stack VM (brewvm). The VM keeps Brewin calls on its own frame stack
+    # rather than Python's, so only it can run recursion deeper than Python's
+    # recursion limit allows.
+    # check_types: report the first type error brewcheck finds before running
+    # anything, instead of when the program gets to it
+    def run(self, program, backend="tree", check_types=False):
+        if backend not in Interpreter.BACKENDS:
+            raise ValueError(f"unknown backend {backend!r}; choose from {', '.join(Interpreter.BACKENDS)}")
+        ast = parse_program(program, self.ast_cache)
         self.structs = {}
         self.func_name_to_ast = {}
         self.type_of_struct_dict = {}
+        self.struct_layouts = {}
         #add a struct table
         self.__set_up_struct_table(ast)
         self.__set_up_function_table(ast)
-        self.env = EnvironmentManager(interpreter)
-        self.__call_func_aux("main", [])
+        resolve(ast, self.struct_layouts, self.structs)
+        # the tree walker's operators and return coercions (brewrules), over this run's structs
+        self.binary_ops = {op: general_binary_op(self, op) for op in Interpreter.BIN_OPS}
+        self.return_coercions = {}
+        source_ast = ast
+        if self.optimize and not self.trace_output:
+            ast = optimize(ast, self)
+            self.func_name_to_ast = {}
+            self.__set_up_function_table(ast)
+        if self.inliner is not None and not self.trace_output:
+            ast = self.inliner.inline(ast, self.func_name_to_ast)
+            self.func_name_to_ast = {}
+            self.__set_up_function_table(ast)
+        mark_tail_calls(ast, self.func_name_to_ast)
+        mark_counting_loops(ast)
+        # the cache the backends use for this run, or None
+        self.memo = None if self.trace_output else self.memo_cache
+        if self.memo is not None:
+            self.memo.clear()
+            mark_pure_functions(self.func_name_to_ast)
+        self.pool = self.struct_pool
+        if self.pool is not None:
+            self.pool.clear()
+            mark_pooled_structs(ast, source_ast, self.structs)
+        # brewcheck's annotations only let the backends skip checks, so the pass
+        # runs when the program is checked anyway or when asked to optimize
+        if check_types and ast is not source_ast:
+            # report the errors of the program as written, unreachable code included
+            type_errors = check(source_ast, self)
+            check(ast, self)
+        elif check_types or self.optimize:
+            type_errors = check(ast, self)
+        else:
+            type_errors = []
+        if check_types and type_errors:
+            super().error(*type_errors[0])
+        if backend == "closure":
+            ClosureCompiler(self).compile_program()([])
+        elif backend == "vm":
+            VM(self).execute(BytecodeCompiler(self).compile_program())
+        else:
+            self.env = EnvironmentManager(self)
+            self.__call_func_aux("main", [])
         self.structs = {}
         self.func_name_to_ast = {}
         self.type_of_struct_dict = {}
+        self.struct_layouts = {}
 
     #STRUCT DICT WHICH ONLY STORES NAMES OF STRUCTS
     #Need to also store the variables inside the struct 
     def __set_up_struct_table(self,ast):
         
-        for struct_def in ast.get("structs"):
-            struct_name = struct_def.get("name")
-            struct_fields = struct_def.get("fields")
+        for struct_def in ast.structs:
+            struct_name = struct_def.name
             if struct_name not in self.structs:
-                self.structs[struct_name] = self.__create_class(struct_name, struct_fields, self.structs)
-
-    def __create_class(self, struct_name, struct_fields, structs):
-        def __init__(self, **kwargs):
-            for field in struct_fields:
-                var_name = field.get("name")
-                var_type = field.get("var_type")                 
-                if var_type == Interpreter.BOOL_NODE:
-                    obj_value = create_value(InterpreterBase.FALSE_DEF)
-                elif var_type == Interpreter.INT_NODE:
-                    obj_value = create_value(0)
-                elif var_type  == Interpreter.STRING_NODE:
-                    obj_value = create_value("")
-                #EDITED THIS
-                elif var_type in structs:
-                    #create struct 
-                    #set to nil initially
-                    obj_value = create_value(InterpreterBase.NIL_DEF)
-                setattr(self, var_name, obj_value)
-                
+                layout = StructLayout.from_ast(struct_def)
+                self.struct_layouts[struct_name] = layout
+                self.structs[struct_name] = self.__create_class(layout)
+
+        # defaults need the whole table: a field can have a struct type declared after it,
+        # so this is also where the field types are checked
+        for struct_class in self.structs.values():
+            struct_class.defaults = self.__field_defaults(struct_class.layout)
+
+    # instances are fixed-length lists of their field values, indexed by
+    # layout.offsets; a new instance is built from the class's defaults with
+    # struct_class(struct_class.defaults)
+    def __create_class(self, layout):
+        struct_name = layout.name
 
         def get_type(self):
             return struct_name
         
         # Create a dictionary of methods (including __init__) for the new class
-        methods = {'__init__': __init__,'type': get_type}
+        # (t mirrors Value.t, so the bytecode VM reads any value's type the same way;
+        # struct values are references, so they compare and hash by identity like objects)
+        methods = {
+            '__slots__': (), 'layout': layout, 'defaults': (), 't': struct_name, 'type': get_type,
+            '__eq__': object.__eq__, '__ne__': object.__ne__, '__hash__': object.__hash__,
+        }
 
         # Define the new class using type()
-        return type(struct_name, (object,), methods)
+        return type(struct_name, (list,), methods)
+
+    # the initial field values of a struct with this layout
+    def __field_defaults(self, layout):
+        values = []
+        for field_name, var_type in zip(layout.field_names, layout.field_types):
+            if var_type == Interpreter.BOOL_NODE:
+                obj_value = FALSE
+            elif var_type == Interpreter.INT_NODE:
+                obj_value = ZERO
+            elif var_type  == Interpreter.STRING_NODE:
+                obj_value = EMPTY_STRING
+            #EDITED THIS
+            elif var_type in self.structs:
+                #create struct 
+                #set to nil initially
+                obj_value = NIL
+            else:
+                super().error(
+                    ErrorType.TYPE_ERROR,
+                    f"Invalid type {var_type} for field {field_name} of struct {layout.name}",
+                )
+            values.append(obj_value)
+        return tuple(values)
 
     def __set_up_function_table(self, ast):
 
         
-        for func_def in ast.get("functions"):
-            func_name = func_def.get("name")
-            num_params = len(func_def.get("args"))
+        for func_def in ast.functions:
+            func_name = func_def.name
+            num_params = len(func_def.args)
             
-            for param in func_def.get("args"):
+            for param in func_def.args:
                 #print("PARAM")
                 #print(param.get("var_type"))
                 
-                if (param.get("var_type") not in ["bool", "string", "int", "nil"]) and (param.get("var_type") not in self.structs):
-                    param_name = param.get("name")
+                if (param.var_type not in ["bool", "string", "int", "nil"]) and (param.var_type not in self.structs):
+                    param_name = param.name
                     super().error(
                         ErrorType.TYPE_ERROR,
                         f"Invalid type for formal parameter {param_name} in function {func_name}",
@@ -116,41 +235,62 @@ class Interpreter(InterpreterBase):
             )
         return candidate_funcs[num_params]
 
+    # a block's variables live in the function's frame (brewresolve gave them
+    # their own slots), so entering and leaving a block needs no bookkeeping
     def __run_statements(self, statements):
-        self.env.push_block()
         for statement in statements:
             #remove after
             if self.trace_output:
                 print(statement)
-            status, return_val = self.__run_statement(statement)
-            if status == ExecStatus.RETURN:
-                self.env.pop_block()
-                return (status, return_val)
+            result = self.__run_statement(statement)
+            if result is not _CONTINUE:
+                return result
 
-        self.env.pop_block()
-        return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
+        return _CONTINUE
 
     def __run_statement(self, statement):
-        status = ExecStatus.CONTINUE
-        return_val = None
         if statement.elem_type == InterpreterBase.FCALL_NODE:
             self.__call_func(statement)
+        elif statement.elem_type == InterpreterBase.INLINE_NODE:
+            self.__run_inline(statement)
+        elif statement.elem_type == InterpreterBase.UNCACHE_NODE:
+            for slot in statement.slots:
+                self.env.store(slot, None)
+        elif statement.elem_type == InterpreterBase.FIELD_SLOT_ASSIGN_NODE:
+            self.__assign_field_slot(statement)
+        elif statement.elem_type == InterpreterBase.FIELD_SLOTS_NODE:
+            for slot, value in zip(statement.slots, statement.values):
+                self.env.store(slot, value)
         elif statement.elem_type == "=":
             self.__assign(statement)
         elif statement.elem_type == InterpreterBase.VAR_DEF_NODE:
             self.__var_def(statement)
         elif statement.elem_type == InterpreterBase.RETURN_NODE:
-            status, return_val = self.__do_return(statement)
+            return self.__do_return(statement)
         elif statement.elem_type == Interpreter.IF_NODE:
-            status, return_val = self.__do_if(statement)
+            return self.__do_if(statement)
         elif statement.elem_type == Interpreter.FOR_NODE:
-            status, return_val = self.__do_for(statement)
-        return (status, return_val)
+            return self.__do_for(statement)
+        return _CONTINUE
     
     def __call_func(self, call_node):
-        func_name = call_node.get("name")
-        actual_args = call_node.get("args")
-        return self.__call_func_aux(func_name, actual_args)
+        # built-ins were told apart when the program was linked (brewresolve)
+        builtin = call_node.builtin
+        if builtin == PRINT:
+            return self.__call_print(call_node.args)
+        if builtin is not None:
+            return self.__call_input(call_node.name, call_node.args)
+        func_ast, plan, checked = self.__call_site(call_node)
+        return self.__run_call(func_ast, self.__bind_args(plan, checked, call_node.args))
+
+    # the call site's cached (FuncNode, binding plan, args checked), worked out on its first call
+    def __call_site(self, call_node):
+        site = call_node.call_site
+        if site is None:
+            func_ast = self.__get_func_by_name(call_node.name, len(call_node.args))
+            plan = self.__binding_plan(func_ast, call_node.name, call_node.args, call_node.args_checked)
+            site = call_node.call_site = (func_ast, plan, call_node.args_checked)
+        return site
 
     def __call_func_aux(self, func_name, actual_args):
 
@@ -160,69 +300,128 @@ class Interpreter(InterpreterBase):
             return self.__call_input(func_name, actual_args)
 
         func_ast = self.__get_func_by_name(func_name, len(actual_args))
-        formal_args = func_ast.get("args")
+        formal_args = func_ast.args
 
         if len(actual_args) != len(formal_args):
             super().error(
                 ErrorType.NAME_ERROR,
-                f"Function {func_ast.get('name')} with {len(actual_args)} args not found",
+                f"Function {func_ast.name} with {len(actual_args)} args not found",
             )
 
-        # first evaluate all of the actual parameters and associate them with the formal parameter names
-        args = {}
-        for formal_ast, actual_ast in zip(formal_args, actual_args):
-            arg_name = formal_ast.get("name")
-            arg_type = formal_ast.get("var_type")
-            #print(arg_name)
-            #print(arg_type)
-            #print(actual_ast)
-            accepted_types = ["int", "string", "bool", "void"]
+        plan = self.__binding_plan(func_ast, func_name, actual_args, False)
+        return self.__run_call(func_ast, self.__bind_args(plan, False, actual_args))
+
+    # run a function with its evaluated arguments and return the call's value
+    def __run_call(self, func_ast, args):
+        memo_key = None
+        if self.memo is not None and func_ast.pure:
+            memo_key = MemoCache.key(func_ast, args)
+            return_val = self.memo.get(memo_key)
+            if return_val is not None:
+                return return_val
+
+        while True:
+            # then create the new activation record 
+            self.env.push_func(func_ast.nlocals)
+            # and add the formal arguments to the activation record
+            for slot, value in zip(func_ast.param_slots, args):
+              self.env.create(slot, value)
+            status, return_val = self.__run_statements(func_ast.statements)
+            frame = self.env.pop_func()
+            if self.pool is not None:
+                self.pool.release(frame, func_ast.pooled_slots)
+            if status != ExecStatus.TAIL_CALL:
+                break
+            # the body ended in a tail call (see __do_return): run the callee in
+            # place of this call, so the Python stack doesn't grow with it
+            func_ast, args = return_val
+
+        return_val = self.__coerce_return(func_ast.return_type, return_val)
+        if memo_key is not None:
+            self.memo.put(memo_key, return_val)
+        return return_val
 
-            
-            if (arg_type not in accepted_types) and (arg_type not in self.structs):
-                super().error(
-                ErrorType.NAME_ERROR,
-                f"Invalid type for formal parameter {arg_name} in function {func_name}*/",
-                )
+    # a call brewinline replaced with the callee's body, run in the caller's frame
+    def __run_inline(self, inline_ast):
+        func_ast, plan, checked = self.__call_site(inline_ast)
+        args = self.__bind_args(plan, checked, inline_ast.args)
+        for slot, value in zip(inline_ast.param_slots, args):
+            self.env.store(slot, value)
+        # (the marking passes leave no tail calls in an inlined body)
+        _, return_val = self.__run_statements(inline_ast.statements)
+        return self.__coerce_return(func_ast.return_type, return_val)
+
+    # the value a call returns, from the value its body returned (nil when it didn't return one)
+    def __coerce_return(self, func_return_type, return_val):
+        return_value = self.return_coercions.get(func_return_type)
+        if return_value is None:
+            return_value = self.return_coercions[func_return_type] = return_coercion(self, func_return_type)
+        return return_value(return_val)
+
+    # How each actual parameter of a call is evaluated, decided once per call site
+    # from the formal parameter's type and the form of the actual parameter:
+    # one (action, formal type, detail) per parameter, run by __bind_args.
+    # checked: brewcheck proved every argument passes the parameter checks
+    def __binding_plan(self, func_ast, func_name, actual_args, checked):
+        plan = []
+        for formal_ast, actual_ast in zip(func_ast.args, actual_args):
+            arg_name = formal_ast.name
+            arg_type = formal_ast.var_type
+            mismatch = (
+                ErrorType.TYPE_ERROR,
+                f"Formal parameter {arg_name} excepted struct of type {arg_type}, type mismatch*/",
+            )
 
-            #print(actual_ast.get_type())
-            
-            # don't know how to fix
-          
+            if (arg_type not in PRIMITIVE_TYPES) and (arg_type not in self.structs):
+                plan.append((_BIND_FAIL, arg_type, (
+                    ErrorType.NAME_ERROR,
+                    f"Invalid type for formal parameter {arg_name} in function {func_name}*/",
+                )))
             #changing to object reference if struct
-            #and arg_type == self.type_of_struct_dict[actual_ast.get("name")]
-            if arg_type in self.structs :
-                if actual_ast == "nil":
-                    result = self.__eval_expr(actual_ast)
-                elif actual_ast.get("var_type")!= None and actual_ast.get("var_type")==arg_type:
-                    result = self.__eval_expr(actual_ast)
-                elif arg_type == self.type_of_struct_dict[actual_ast.get("name")]:
-                    result = self.__eval_expr(actual_ast) 
-                
+            elif arg_type not in self.structs:
+                plan.append((_BIND_SHARE, arg_type, None))
+            elif checked:
+                plan.append((_BIND_SHARE, arg_type, None))
+            elif actual_ast.get("var_type")!= None and actual_ast.get("var_type")==arg_type:
+                plan.append((_BIND_SHARE, arg_type, None))
+            elif actual_ast.elem_type == InterpreterBase.VAR_NODE and actual_ast.path is not None:
+                # a struct field: check its declared type, or its value when that isn't known
+                if actual_ast.path.field_type is not None and actual_ast.path.field_type != arg_type:
+                    plan.append((_BIND_FAIL, arg_type, mismatch))
                 else:
-                    super().error(
-                        ErrorType.TYPE_ERROR,
-                        f"Formal parameter {arg_name} excepted struct of type {arg_type}, type mismatch*/",
-                        )
-                
-               
-                #print("HERE")
-                #print(result)
-                #print(result)
-            
+                    plan.append((_BIND_SHARE, arg_type, None))
+            else:
+                # checked against type_of_struct_dict when the call runs
+                plan.append((_BIND_STRUCT_VAR, arg_type, (actual_ast.get("name"), mismatch)))
+        return tuple(plan)
+
+    # evaluate the actual parameters of a call following its binding plan
+    # checked: brewcheck proved every argument passes the parameter checks
+    def __bind_args(self, plan, checked, actual_args):
+        args = []
+        for (action, arg_type, detail), actual_ast in zip(plan, actual_args):
+            if action is _BIND_SHARE:
+                result = self.__eval_expr(actual_ast)
+            elif action is _BIND_STRUCT_VAR:
+                var_name, mismatch = detail
+                if arg_type != self.type_of_struct_dict[var_name]:
+                    super().error(*mismatch)
+                result = self.__eval_expr(actual_ast)
             else:
-                result = copy.copy(self.__eval_expr(actual_ast))
+                super().error(*detail)
+
+            if checked:
+                args.append(result)
 
-           
             #bool parameter set to int
-            if arg_type == "bool" and result.type() == "int":
+            elif arg_type == "bool" and result.type() == "int":
                 if result.value() == 0:
-                    args[arg_name] = Value(Type.BOOL, False)
+                    args.append(FALSE)
                 else:
-                    args[arg_name] = Value(Type.BOOL, True)
+                    args.append(TRUE)
 
             elif arg_type in self.structs and result.type() == "nil":
-                args[arg_name] = result
+                args.append(result)
 
             elif arg_type != result.type():
                 super().error(
@@ -231,54 +430,8 @@ class Interpreter(InterpreterBase):
                 )
 
             else:
-                args[arg_name] = result
-
-        # then create the new activation record 
-        self.env.push_func()
-        # and add the formal arguments to the activation record
-        for arg_name, value in args.items():
-          self.env.create(arg_name, value)
-        _, return_val = self.__run_statements(func_ast.get("statements"))
-        self.env.pop_func()
-
-        func_return_type = func_ast.get("return_type")
-     
-        #int function with nil return type
-        if return_val.type() == "nil" and func_return_type == "int":
-            return Value(Type.INT,0)
-        
-        #string function with nil return type
-        elif return_val.type() == "nil" and func_return_type == "string":
-            return Value(Type.STRING,"")
-        
-        #bool function with nil return type
-        elif return_val.type() == "nil" and func_return_type == "bool":
-            return Value(Type.BOOL, False)
-
-        #void function with nil return type
-        elif return_val.type()== "nil" and func_return_type == "void":
-            return  Value(Type.VOID, None)
-        
-        #bool return set to int coercion
-        elif func_return_type == "bool" and return_val.type() == "int":
-            if return_val.value() == 0:
-                return Value(Type.BOOL, False)
-            else:
-                return Value(Type.BOOL, True)
-       
-         
-        elif (func_return_type in self.structs) and return_val.type() == "nil":
-            return Value(Type.NIL, None)
-        
-        elif func_return_type != return_val.type():
-                super().error(
-                ErrorType.TYPE_ERROR,
-                f"The function is supposed to return a {func_return_type} but instead returns a {return_val.type()}",
-                )
-       
-        #print("RETURN VAL")
-        #print(return_val)
-        return return_val
+                args.append(result)
+        return args
 
     def __call_print(self, args):
        
@@ -299,18 +452,20 @@ class Interpreter(InterpreterBase):
             )
         inp = super().get_input()
         if name == "inputi":
-            return Value(Type.INT, int(inp))
+            return int_value(int(inp))
         if name == "inputs":
             return Value(Type.STRING, inp)
 
     def __assign(self, assign_ast):
        
-        var_name = assign_ast.get("name")
-        value_obj = self.__eval_expr(assign_ast.get("expression"))
-        if "." in var_name:
-            self.set_nested_field(var_name, value_obj)
+        var_name = assign_ast.name
+        value_obj = self.__eval_expr(assign_ast.expression)
+        if assign_ast.path is not None:
+            self.set_nested_field(assign_ast.path, value_obj)
+        elif assign_ast.checked:
+            self.env.store(assign_ast.slot, value_obj)
         else:
-            if not self.env.set(var_name, value_obj):
+            if not self.env.set(assign_ast.slot, var_name, value_obj):
                 super().error(
                     ErrorType.NAME_ERROR, f"Undefined variable {var_name} in assignment"
                 )
@@ -323,104 +478,110 @@ class Interpreter(InterpreterBase):
                 )
         """ 
     def __var_def(self, var_ast):
-        var_name = var_ast.get("name")
+        var_name = var_ast.name
         #retrieve variable type
-        var_type = var_ast.get("var_type")
+        var_type = var_ast.var_type
         #set to the default value for that type
         if var_type == Interpreter.BOOL_NODE:
-            value = create_value(InterpreterBase.FALSE_DEF)
+            value = FALSE
         elif var_type == Interpreter.INT_NODE:
-            value = create_value(0)
+            value = ZERO
         elif var_type  == Interpreter.STRING_NODE:
-            value = create_value("")
+            value = EMPTY_STRING
         #EDITED THIS
         elif var_type in self.structs:
             #create struct 
             #set to nil initially
-            value = create_value(InterpreterBase.NIL_DEF)
+            value = NIL
             self.type_of_struct_dict[var_name] = var_type
       
         else:
             super().error(
                 ErrorType.TYPE_ERROR, f"All variable definitions must now specify an explicit type for the variable"
             )
-        if not self.env.create(var_name, value):
+        if not self.env.create(var_ast.slot, value):
             super().error(
                 ErrorType.NAME_ERROR, f"Duplicate definition for variable {var_name}"
             )
 
-    def set_nested_field(self, var_name, value):
-        # Split var_name into parts by dots
-        parts = var_name.split('.')
-      
-        # Start with the top-level object in the environment
-        current_obj = self.env.get(parts[0])
-        
-        if current_obj!= None and current_obj.type() == "nil":
-            super().error(
-                ErrorType.FAULT_ERROR, f"Dot operator invalid on uninitialized struct"
-            )
+    def set_nested_field(self, path, value):
+        self.store_field_path(self.check_path_base(self.env.get(path.base_slot)), path.steps, value)
 
-        if (current_obj == None or current_obj.type() not in self.structs):
+    # the value in a FieldSlotNode's slot, the field of a struct variable brewopt
+    # split into slots; the variable is nil while that's None
+    def __field_slot(self, field_ast):
+        value = self.env.get(field_ast.slot)
+        if value is None:
             super().error(
-                ErrorType.TYPE_ERROR, f"Dot operator only valid on struct"
+                ErrorType.FAULT_ERROR, f"Dot operator invalid on uninitialized struct"
             )
-        
-
-        # Traverse each part except the last to reach the second-to-last object
-        for part in parts[1:-1]:
-            if current_obj!=None and current_obj.type() == "nil":
-                super().error(
-                    ErrorType.FAULT_ERROR,  f"Dot operator invalid on uninitialized struct"
-                )
-
-            if(current_obj == None or current_obj.type() not in self.structs):
-                super().error(
-                    ErrorType.TYPE_ERROR, f"Dot operator only valid on struct"
-                )
+        return value
 
-            if not hasattr(current_obj, part):
+    def __assign_field_slot(self, assign_ast):
+        value = self.__eval_expr(assign_ast.expression)
+        target = assign_ast.target
+        if target.steps:
+            self.store_field_path(self.__field_slot(target), target.steps, value)
+        else:
+            self.env.store(target.slot, self.field_value(self.__field_slot(target), value))
+
+    def get_nested_field(self, path):
+        return self.follow_field_path(self.check_path_base(self.env.get(path.base_slot)), path.steps)
+
+    # the field path helpers below take the base variable's value, so other
+    # backends (brewcompile) can share them with their own variable lookup
+    def store_field_path(self, current_obj, steps, value):
+        # Traverse each field except the last to reach the struct holding it
+        for part, offset, struct_class in steps[:-1]:
+            if current_obj.__class__ is not struct_class:
+                offset = self.__field_offset(current_obj, part)
+            current_obj = current_obj[offset]
+
+        part, offset, struct_class = steps[-1]
+        if current_obj.__class__ is not struct_class:
+            # no nil/struct check here: anything but a struct just lacks the attribute
+            if current_obj.type() not in self.structs or part not in current_obj.layout.offsets:
                 super().error(
                     ErrorType.NAME_ERROR, f"Invalid attribute {part}"
                 )
+            offset = current_obj.layout.offsets[part]
 
-            current_obj = getattr(current_obj, part)
-           
-        if not hasattr(current_obj, parts[-1]):
-            super().error(
-                ErrorType.NAME_ERROR, f"Invalid attribute {parts[-1]}"
-            )
+        current_obj[offset] = self.field_value(current_obj[offset], value)
 
-        
-        cur_type = getattr(current_obj, parts[-1]).type()
+    # the value a struct field holding cur_value is set to when value is assigned to it
+    def field_value(self, cur_value, value):
+        cur_type = cur_value.type()
         val_type = value.type()
 
         if(cur_type == "nil" and val_type in self.structs):
-            setattr(current_obj, parts[-1], value)
+            return value
 
         elif(cur_type == "bool" and val_type == "int"):
             if value.value() == 0:
-                setattr(current_obj, parts[-1], Value(Type.BOOL, False))
+                return FALSE
             else:
-                setattr(current_obj, parts[-1], Value(Type.BOOL, True))
+                return TRUE
         
         elif(cur_type != val_type):
             super().error(
                     ErrorType.TYPE_ERROR, f"Setting a struct field of type {cur_type} to a value of type {val_type}"
                 )
-        # Use setattr on the last object to set the final attribute
         else:
-             setattr(current_obj, parts[-1], value)
+             return value
 
 
-    def get_nested_field(self, var_name):
-        # Split var_name into parts by dots (e.g., 'struct1.struct2.field' -> ['struct1', 'struct2', 'field'])
-        parts = var_name.split('.')
-        
-        # Start from the environment dictionary
-        current_obj = self.env.get(parts[0])
+    def follow_field_path(self, current_obj, steps):
+        # Follow the resolved offsets; a step whose struct type wasn't known
+        # statically (or whose value turned out not to be that struct) is looked up by name
+        for part, offset, struct_class in steps:
+            if current_obj.__class__ is not struct_class:
+                offset = self.__field_offset(current_obj, part)
+            current_obj = current_obj[offset]
         
+        # Return the final field
+        return current_obj
 
+    def check_path_base(self, current_obj):
         if current_obj!= None and current_obj.type() == "nil":
             super().error(
                 ErrorType.FAULT_ERROR,  f"Dot operator invalid on uninitialized struct"
@@ -430,183 +591,126 @@ class Interpreter(InterpreterBase):
             super().error(
                 ErrorType.TYPE_ERROR, f"Dot operator only valid on struct"
             )
+        return current_obj
 
-        # Traverse each part to go deeper
-        for part in parts[1:]:
-            
-            if current_obj!= None and current_obj.type() == "nil":
-                super().error(
-                    ErrorType.FAULT_ERROR,  f"Dot operator invalid on uninitialized struct"
-                )
-            
-            if(current_obj.type() not in self.structs or current_obj.type() == None):
-                super().error(
-                    ErrorType.TYPE_ERROR, f"Dot operator only valid on struct"
-                )
-
-            if not hasattr(current_obj, part):
-                super().error(
-                    ErrorType.NAME_ERROR, f"Invalid attribute {part}"
-                )
-            
-            current_obj = getattr(current_obj, part)
-            
+    def __field_offset(self, current_obj, part):
+        if current_obj.type() == "nil":
+            super().error(
+                ErrorType.FAULT_ERROR,  f"Dot operator invalid on uninitialized struct"
+            )
         
-        # Return the final field
-        return current_obj
+        if(current_obj.type() not in self.structs):
+            super().error(
+                ErrorType.TYPE_ERROR, f"Dot operator only valid on struct"
+            )
+
+        offset = current_obj.layout.offsets.get(part)
+        if offset is None:
+            super().error(
+                ErrorType.NAME_ERROR, f"Invalid attribute {part}"
+            )
+        return offset
         
 
     def __eval_expr(self, expr_ast):
 
-        var_name = expr_ast.get("name")
-       
-        
         if expr_ast.elem_type == InterpreterBase.NEW_NODE:
-            struct_name = expr_ast.get("var_type")
-            return self.structs[struct_name]()
+            struct_name = expr_ast.var_type
+            struct_class = self.structs[struct_name]
+            if self.pool is not None:
+                return self.pool.new(struct_class)
+            return struct_class(struct_class.defaults)
     
         
         if expr_ast.elem_type == InterpreterBase.NIL_NODE:
             return Interpreter.NIL_VALUE
         if expr_ast.elem_type == InterpreterBase.INT_NODE:
-            return Value(Type.INT, expr_ast.get("val"))
+            return expr_ast.constant
         if expr_ast.elem_type == InterpreterBase.STRING_NODE:
-            return Value(Type.STRING, expr_ast.get("val"))
+            return expr_ast.constant
         if expr_ast.elem_type == InterpreterBase.BOOL_NODE:
-            return Value(Type.BOOL, expr_ast.get("val"))
+            return expr_ast.constant
         if expr_ast.elem_type == InterpreterBase.VAR_NODE:
-            var_name = expr_ast.get("name")
-            if "." in var_name:
-               return self.get_nested_field(var_name)
+            var_name = expr_ast.name
+            if expr_ast.path is not None:
+               return self.get_nested_field(expr_ast.path)
             else:
-                val = self.env.get(var_name)
+                val = self.env.get(expr_ast.slot)
                 if val is None:
                     super().error(ErrorType.NAME_ERROR, f"Variable {var_name} not found")
                 return val
         if expr_ast.elem_type == InterpreterBase.FCALL_NODE:
             return self.__call_func(expr_ast)
+        if expr_ast.elem_type == InterpreterBase.INLINE_NODE:
+            return self.__run_inline(expr_ast)
+        if expr_ast.elem_type == InterpreterBase.FIELD_SLOT_NODE:
+            value = self.__field_slot(expr_ast)
+            if expr_ast.steps:
+                return self.follow_field_path(value, expr_ast.steps)
+            return value
+        if expr_ast.elem_type == InterpreterBase.CACHED_NODE:
+            value = self.env.get(expr_ast.slot)
+            if value is None:
+                value = self.__eval_expr(expr_ast.expression)
+                self.env.store(expr_ast.slot, value)
+            return value
         if expr_ast.elem_type in Interpreter.BIN_OPS:
             return self.__eval_op(expr_ast)
         if expr_ast.elem_type == Interpreter.NEG_NODE:
-            return self.__eval_unary(expr_ast, Type.INT, lambda x: -1 * x)
+            return self.__eval_unary(expr_ast, Type.INT, lambda x: int_value(-1 * x))
         if expr_ast.elem_type == Interpreter.NOT_NODE:
-            return self.__eval_unary(expr_ast, Type.BOOL, lambda x: not x)
+            return self.__eval_unary(expr_ast, Type.BOOL, lambda x: FALSE if x else TRUE)
 
     def __eval_op(self, arith_ast):
-        left_value_obj = self.__eval_expr(arith_ast.get("op1"))
-        right_value_obj = self.__eval_expr(arith_ast.get("op2"))
-
-        #if left_value_obj.type() == "BOOL" and right_value_obj.type() == "INT":
-        unaccepted_types = ["int", "string", "bool", "void"]
-        #print(left_value_obj.type())
-        #print(right_value_obj.type())
-        #print(left_value_obj.elem_type)
-        #bool return set to int coercion
-        if left_value_obj.type() == "bool" and right_value_obj.type() == "int":
-            if right_value_obj.value() == 0:
-                right_value_obj = Value(Type.BOOL, False)
-            else:
-                right_value_obj = Value(Type.BOOL, True)
-
-        #bool return set to int coercion
-        elif left_value_obj.type() == "int" and right_value_obj.type() == "bool":
-            if left_value_obj.value() == 0:
-                left_value_obj = Value(Type.BOOL, False)
-            else:
-                left_value_obj = Value(Type.BOOL, True)
-        
-        elif left_value_obj.type() == "int" and right_value_obj.type() == "int" and arith_ast.elem_type in ["||", "&&"]:
-            if left_value_obj.value() == 0:
-                left_value_obj = Value(Type.BOOL, False)
-            else: 
-                left_value_obj = Value(Type.BOOL, True)
-            if right_value_obj.value() == 0:
-                right_value_obj = Value(Type.BOOL, False)
-            else:
-                right_value_obj = Value(Type.BOOL, True)
-
-
-        elif left_value_obj.type() in self.structs and right_value_obj.type() == "nil" and arith_ast.elem_type == "==":
-            return Value(Type.BOOL, False)
-        
-        elif left_value_obj.type() in self.structs and right_value_obj.type() == "nil" and arith_ast.elem_type == "!=":
-            return Value(Type.BOOL, True)
-        
-        elif (left_value_obj.type() in unaccepted_types) and right_value_obj.type() == "nil":
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Cannot compare {left_value_obj.type()} to nil",
-            )
-
-        elif (right_value_obj.type() in unaccepted_types) and left_value_obj.type() == "nil":
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Cannot compare {left_value_obj.type()} to nil",
-            )
-
-        if not self.__compatible_types(
-            arith_ast.elem_type, left_value_obj, right_value_obj
-        ):
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Incompatible types for {arith_ast.elem_type} operation",
-            )
-        if arith_ast.elem_type not in self.op_to_lambda[left_value_obj.type()]:
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Incompatible operator {arith_ast.elem_type} for type {left_value_obj.type()}",
-            )
-        f = self.op_to_lambda[left_value_obj.type()][arith_ast.elem_type]
-        return f(left_value_obj, right_value_obj)
-
-    def __compatible_types(self, oper, obj1, obj2):
-        # DOCUMENT: allow comparisons ==/!= of anything against anything
-        if oper in ["==", "!="]:
-            return True
-        return obj1.type() == obj2.type()
+        left_value_obj = self.__eval_expr(arith_ast.op1)
+        right_value_obj = self.__eval_expr(arith_ast.op2)
+        # brewcheck proved no coercion or type check applies
+        if arith_ast.operand_type is not None:
+            return self.op_to_lambda[arith_ast.operand_type][arith_ast.elem_type](left_value_obj, right_value_obj)
+        return self.binary_ops[arith_ast.elem_type](left_value_obj, right_value_obj)
 
     def __eval_unary(self, arith_ast, t, f):
-        value_obj = self.__eval_expr(arith_ast.get("op1"))
+        value_obj = self.__eval_expr(arith_ast.op1)
         if value_obj.type() != t:
             super().error(
                 ErrorType.TYPE_ERROR,
                 f"Incompatible type for {arith_ast.elem_type} operation",
             )
-        return Value(t, f(value_obj.value()))
+        return f(value_obj.value())
 
     def __setup_ops(self):
         self.op_to_lambda = {}
         # set up operations on integers
         self.op_to_lambda[Type.INT] = {}
-        self.op_to_lambda[Type.INT]["+"] = lambda x, y: Value(
-            x.type(), x.value() + y.value()
+        self.op_to_lambda[Type.INT]["+"] = lambda x, y: int_value(
+            x.value() + y.value()
         )
-        self.op_to_lambda[Type.INT]["-"] = lambda x, y: Value(
-            x.type(), x.value() - y.value()
+        self.op_to_lambda[Type.INT]["-"] = lambda x, y: int_value(
+            x.value() - y.value()
         )
-        self.op_to_lambda[Type.INT]["*"] = lambda x, y: Value(
-            x.type(), x.value() * y.value()
+        self.op_to_lambda[Type.INT]["*"] = lambda x, y: int_value(
+            x.value() * y.value()
         )
-        self.op_to_lambda[Type.INT]["/"] = lambda x, y: Value(
-            x.type(), x.value() // y.value()
+        self.op_to_lambda[Type.INT]["/"] = lambda x, y: int_value(
+            x.value() // y.value()
         )
-        self.op_to_lambda[Type.INT]["=="] = lambda x, y: Value(
-            Type.BOOL, x.type() == y.type() and x.value() == y.value()
+        self.op_to_lambda[Type.INT]["=="] = lambda x, y: (
+            TRUE if x.type() == y.type() and x.value() == y.value() else FALSE
         )
-        self.op_to_lambda[Type.INT]["!="] = lambda x, y: Value(
-            Type.BOOL, x.type() != y.type() or x.value() != y.value()
+        self.op_to_lambda[Type.INT]["!="] = lambda x, y: (
+            TRUE if x.type() != y.type() or x.value() != y.value() else FALSE
         )
-        self.op_to_lambda[Type.INT]["<"] = lambda x, y: Value(
-            Type.BOOL, x.value() < y.value()
+        self.op_to_lambda[Type.INT]["<"] = lambda x, y: (
+            TRUE if x.value() < y.value() else FALSE
         )
-        self.op_to_lambda[Type.INT]["<="] = lambda x, y: Value(
-            Type.BOOL, x.value() <= y.value()
+        self.op_to_lambda[Type.INT]["<="] = lambda x, y: (
+            TRUE if x.value() <= y.value() else FALSE
         )
-        self.op_to_lambda[Type.INT][">"] = lambda x, y: Value(
-            Type.BOOL, x.value() > y.value()
+        self.op_to_lambda[Type.INT][">"] = lambda x, y: (
+            TRUE if x.value() > y.value() else FALSE
         )
-        self.op_to_lambda[Type.INT][">="] = lambda x, y: Value(
-            Type.BOOL, x.value() >= y.value()
+        self.op_to_lambda[Type.INT][">="] = lambda x, y: (
+            TRUE if x.value() >= y.value() else FALSE
         )
         self.op_to_lambda[Type.INT]["&&"] = lambda x, y: Value(
             Type.BOOL, x.value() & y.value()
@@ -617,75 +721,81 @@ class Interpreter(InterpreterBase):
         self.op_to_lambda[Type.STRING]["+"] = lambda x, y: Value(
             x.type(), x.value() + y.value()
         )
-        self.op_to_lambda[Type.STRING]["=="] = lambda x, y: Value(
-            Type.BOOL, x.value() == y.value()
+        self.op_to_lambda[Type.STRING]["=="] = lambda x, y: (
+            TRUE if x.value() == y.value() else FALSE
         )
-        self.op_to_lambda[Type.STRING]["!="] = lambda x, y: Value(
-            Type.BOOL, x.value() != y.value()
+        self.op_to_lambda[Type.STRING]["!="] = lambda x, y: (
+            TRUE if x.value() != y.value() else FALSE
         )
         #  set up operations on bools
         self.op_to_lambda[Type.BOOL] = {}
-        self.op_to_lambda[Type.BOOL]["&&"] = lambda x, y: Value(
-            x.type(), x.value() and y.value()
+        self.op_to_lambda[Type.BOOL]["&&"] = lambda x, y: bool_value(
+            x.value() and y.value()
         )
-        self.op_to_lambda[Type.BOOL]["||"] = lambda x, y: Value(
-            x.type(), x.value() or y.value()
+        self.op_to_lambda[Type.BOOL]["||"] = lambda x, y: bool_value(
+            x.value() or y.value()
         )
-        self.op_to_lambda[Type.BOOL]["=="] = lambda x, y: Value(
-            Type.BOOL, x.type() == y.type() and x.value() == y.value()
+        self.op_to_lambda[Type.BOOL]["=="] = lambda x, y: (
+            TRUE if x.type() == y.type() and x.value() == y.value() else FALSE
         )
-        self.op_to_lambda[Type.BOOL]["!="] = lambda x, y: Value(
-            Type.BOOL, x.type() != y.type() or x.value() != y.value()
+        self.op_to_lambda[Type.BOOL]["!="] = lambda x, y: (
+            TRUE if x.type() != y.type() or x.value() != y.value() else FALSE
         )
 
         #  set up operations on nil
         self.op_to_lambda[Type.NIL] = {}
-        self.op_to_lambda[Type.NIL]["=="] = lambda x, y: Value(
-            Type.BOOL, x.type() == y.type() and x.value() == y.value()
+        self.op_to_lambda[Type.NIL]["=="] = lambda x, y: (
+            TRUE if x.type() == y.type() and x.value() == y.value() else FALSE
         )
-        self.op_to_lambda[Type.NIL]["!="] = lambda x, y: Value(
-            Type.BOOL, x.type() != y.type() or x.value() != y.value()
+        self.op_to_lambda[Type.NIL]["!="] = lambda x, y: (
+            TRUE if x.type() != y.type() or x.value() != y.value() else FALSE
         )
 
     def __do_if(self, if_ast):
-        cond_ast = if_ast.get("condition")
+        cond_ast = if_ast.condition
         result = self.__eval_expr(cond_ast)
-        if result.type() == Type.INT:
+        if cond_ast.static_type is BOOL:
+            pass
+        elif result.type() == Type.INT:
             if result.value() == 0:
-                result = Value(Type.BOOL, False) 
+                result = FALSE
             else:
-                result = Value(Type.BOOL, True)
+                result = TRUE
         elif result.type() != Type.BOOL:
             super().error(
                 ErrorType.TYPE_ERROR,
                 "Incompatible type for if condition",
             )
         if result.value():
-            statements = if_ast.get("statements")
-            status, return_val = self.__run_statements(statements)
-            return (status, return_val)
+            statements = if_ast.statements
+            return self.__run_statements(statements)
         else:
-            else_statements = if_ast.get("else_statements")
+            else_statements = if_ast.else_statements
             if else_statements is not None:
-                status, return_val = self.__run_statements(else_statements)
-                return (status, return_val)
+                return self.__run_statements(else_statements)
 
-        return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
+        return _CONTINUE
 
     def __do_for(self, for_ast):
-        init_ast = for_ast.get("init") 
-        cond_ast = for_ast.get("condition")
-        update_ast = for_ast.get("update") 
+        init_ast = for_ast.init 
+        cond_ast = for_ast.condition
+        update_ast = for_ast.update 
 
         self.__run_statement(init_ast)  # initialize counter variable
+        if for_ast.counter is not None:
+            result = self.__count(for_ast)
+            if result is not None:
+                return result
         run_for = Interpreter.TRUE_VALUE
         while run_for.value():
             run_for = self.__eval_expr(cond_ast)  # check for-loop condition
-            if run_for.type() == Type.INT:
+            if cond_ast.static_type is BOOL:
+                pass
+            elif run_for.type() == Type.INT:
                 if run_for.value() == 0:
-                    run_for = Value(Type.BOOL, False) 
+                    run_for = FALSE
                 else:
-                    run_for = Value(Type.BOOL, True)
+                    run_for = TRUE
 
             elif run_for.type() != Type.BOOL:
                 super().error(
@@ -694,35 +804,69 @@ class Interpreter(InterpreterBase):
                 )
 
             if run_for.value():
-                statements = for_ast.get("statements")
-                status, return_val = self.__run_statements(statements)
-                if status == ExecStatus.RETURN:
-                    return status, return_val
+                statements = for_ast.statements
+                result = self.__run_statements(statements)
+                if result is not _CONTINUE:
+                    return result
                 self.__run_statement(update_ast)  # update counter variable
 
-        return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
+        return _CONTINUE
+
+    # run a loop brewresolve.mark_counting_loops found, once its init has run,
+    # with the counter in a Python int: the condition and the update are then
+    # plain int operations, and only the counter's new Value is stored each time.
+    # Returns None, having run nothing, when the counter or limit isn't an int Value.
+    def __count(self, for_ast):
+        loop = for_ast.counter
+        counter = self.env.get(loop.slot)
+        if counter.__class__ is not Value or counter.type() != Type.INT:
+            return None
+        limit = loop.limit
+        if loop.limit_slot is not None:
+            limit = self.env.get(loop.limit_slot)
+            if limit.__class__ is not Value or limit.type() != Type.INT:
+                return None
+            limit = limit.value()
+
+        i = counter.value()
+        test = loop.test
+        step = loop.step
+        statements = for_ast.statements
+        while test(i, limit):
+            result = self.__run_statements(statements)
+            if result is not _CONTINUE:
+                return result
+            i += step
+            self.env.store(loop.slot, int_value(i))
+        return _CONTINUE
 
     def __do_return(self, return_ast):
     
-        expr_ast = return_ast.get("expression")
+        expr_ast = return_ast.expression
         #print(expr_ast)
 
         if expr_ast is None:
             return (ExecStatus.RETURN, Interpreter.NIL_VALUE)
         
-        elif expr_ast.elem_type == "var" and "." in expr_ast.get("name"):
+        elif expr_ast.elem_type == "var" and expr_ast.path is not None:
             value_obj = self.__eval_expr(expr_ast)
             return (ExecStatus.RETURN, value_obj)
         
         
-        elif expr_ast.elem_type == "var" and self.env.get(expr_ast.get("name")).type() in self.structs:
+        elif expr_ast.elem_type == "var" and expr_ast.slot is not None and self.env.get(expr_ast.slot).type() in self.structs:
             value_obj = self.__eval_expr(expr_ast)
             #print("VAL OBJ")
             #print(value_obj)
             return (ExecStatus.RETURN, value_obj)
         
+        elif return_ast.tail_call is not None:
+            # evaluate the arguments here, in the caller's frame; __run_call runs the call
+            callee, plan, checked = self.__call_site(expr_ast)
+            return (ExecStatus.TAIL_CALL, (callee, self.__bind_args(plan, checked, expr_ast.args)))
+
         else:
-            value_obj = copy.copy(self.__eval_expr(expr_ast))
+            # Values are immutable, so the callee's value is returned as is
+            value_obj = self.__eval_expr(expr_ast)
             #print("GOING THROUGH IT")
             return (ExecStatus.RETURN, value_obj)
         
@@ -27,68 +27,68 @@ for _k, _v in _lr_goto_items.items():
 del _lr_goto_items
 _lr_productions = [
   ("S' -> program","S'",1,None,None,None),
-  ('program -> structs funcs','program',2,'p_program','brewparse.py',26),
-  ('program -> funcs','program',1,'p_program','brewparse.py',27),
-  ('structs -> structs struct','structs',2,'p_structs','brewparse.py',34),
-  ('structs -> struct','structs',1,'p_structs','brewparse.py',35),
-  ('struct -> STRUCT NAME LBRACE fields RBRACE','struct',5,'p_struct','brewparse.py',39),
-  ('fields -> fields field','fields',2,'p_fields','brewparse.py',43),
-  ('fields -> field','fields',1,'p_fields','brewparse.py',44),
-  ('field -> NAME COLON NAME SEMI','field',4,'p_field','brewparse.py',48),
-  ('funcs -> funcs func','funcs',2,'p_funcs','brewparse.py',52),
-  ('funcs -> func','funcs',1,'p_funcs','brewparse.py',53),
-  ('func -> FUNC NAME LPAREN formal_args RPAREN COLON NAME LBRACE statements RBRACE','func',10,'p_func','brewparse.py',58),
-  ('func -> FUNC NAME LPAREN RPAREN COLON NAME LBRACE statements RBRACE','func',9,'p_func','brewparse.py',59),
-  ('func -> FUNC NAME LPAREN formal_args RPAREN LBRACE statements RBRACE','func',8,'p_func2','brewparse.py',66),
-  ('func -> FUNC NAME LPAREN RPAREN LBRACE statements RBRACE','func',7,'p_func2','brewparse.py',67),
-  ('formal_args -> formal_args COMMA formal_arg','formal_args',3,'p_formal_args','brewparse.py',74),
-  ('formal_args -> formal_arg','formal_args',1,'p_formal_args','brewparse.py',75),
-  ('formal_arg -> NAME COLON NAME','formal_arg',3,'p_formal_arg','brewparse.py',80),
-  ('formal_arg -> NAME','formal_arg',1,'p_formal_arg','brewparse.py',81),
-  ('statements -> statements statement','statements',2,'p_statements','brewparse.py',88),
-  ('statements -> statement','statements',1,'p_statements','brewparse.py',89),
-  ('statement -> assign SEMI','statement',2,'p_statement___assign','brewparse.py',94),
-  ('assign -> variable_w_dot ASSIGN expression','assign',3,'p_assign','brewparse.py',98),
-  ('statement -> VAR variable COLON NAME SEMI','statement',5,'p_statement___var','brewparse.py',102),
-  ('statement -> VAR variable SEMI','statement',3,'p_statement___var','brewparse.py',103),
-  ('variable -> NAME','variable',1,'p_variable','brewparse.py',110),
-  ('variable_w_dot -> variable_w_dot DOT NAME','variable_w_dot',3,'p_variable_w_dot','brewparse.py',114),
-  ('variable_w_dot -> NAME','variable_w_dot',1,'p_variable_w_dot','brewparse.py',115),
-  ('statement -> IF LPAREN expression RPAREN LBRACE statements RBRACE','statement',7,'p_statement_if','brewparse.py',122),
-  ('statement -> IF LPAREN expression RPAREN LBRACE statements RBRACE ELSE LBRACE statements RBRACE','statement',11,'p_statement_if','brewparse.py',123),
-  ('statement -> TRY LBRACE statements RBRACE catchers','statement',5,'p_statement_try','brewparse.py',141),
-  ('catchers -> catchers catch','catchers',2,'p_catches','brewparse.py',145),
-  ('catchers -> catch','catchers',1,'p_catches','brewparse.py',146),
-  ('catch -> CATCH STRING LBRACE statements RBRACE','catch',5,'p_catch','brewparse.py',150),
-  ('statement -> FOR LPAREN assign SEMI expression SEMI assign RPAREN LBRACE statements RBRACE','statement',11,'p_statement_for','brewparse.py',154),
-  ('statement -> RAISE expression SEMI','statement',3,'p_statement_raise','brewparse.py',158),
-  ('statement -> expression SEMI','statement',2,'p_statement_expr','brewparse.py',162),
-  ('statement -> RETURN expression SEMI','statement',3,'p_statement_return','brewparse.py',167),
-  ('statement -> RETURN SEMI','statement',2,'p_statement_return','brewparse.py',168),
-  ('expression -> NOT expression','expression',2,'p_expression_not','brewparse.py',177),
-  ('expression -> MINUS expression','expression',2,'p_expression_uminus','brewparse.py',182),
-  ('expression -> NEW NAME','expression',2,'p_expression_new','brewparse.py',186),
-  ('expression -> expression EQ expression','expression',3,'p_arith_expression_binop','brewparse.py',191),
-  ('expression -> expression GREATER expression','expression',3,'p_arith_expression_binop','brewparse.py',192),
-  ('expression -> expression LESS expression','expression',3,'p_arith_expression_binop','brewparse.py',193),
-  ('expression -> expression NOT_EQ expression','expression',3,'p_arith_expression_binop','brewparse.py',194),
-  ('expression -> expression GREATER_EQ expression','expression',3,'p_arith_expression_binop','brewparse.py',195),
-  ('expression -> expression LESS_EQ expression','expression',3,'p_arith_expression_binop','brewparse.py',196),
-  ('expression -> expression PLUS expression','expression',3,'p_arith_expression_binop','brewparse.py',197),
-  ('expression -> expression MINUS expression','expression',3,'p_arith_expression_binop','brewparse.py',198),
-  ('expression -> expression MULTIPLY expression','expression',3,'p_arith_expression_binop','brewparse.py',199),
-  ('expression -> expression DIVIDE expression','expression',3,'p_arith_expression_binop','brewparse.py',200),
-  ('expression -> LPAREN expression RPAREN','expression',3,'p_expression_group','brewparse.py',205),
-  ('expression -> expression OR expression','expression',3,'p_expression_and_or','brewparse.py',210),
-  ('expression -> expression AND expression','expression',3,'p_expression_and_or','brewparse.py',211),
-  ('expression -> NUMBER','expression',1,'p_expression_number','brewparse.py',216),
-  ('expression -> TRUE','expression',1,'p_expression_bool','brewparse.py',221),
-  ('expression -> FALSE','expression',1,'p_expression_bool','brewparse.py',222),
-  ('expression -> NIL','expression',1,'p_expression_nil','brewparse.py',228),
-  ('expression -> STRING','expression',1,'p_expression_string','brewparse.py',233),
-  ('expression -> variable_w_dot','expression',1,'p_expression_variable','brewparse.py',238),
-  ('expression -> NAME LPAREN args RPAREN','expression',4,'p_func_call','brewparse.py',243),
-  ('expression -> NAME LPAREN RPAREN','expression',3,'p_func_call','brewparse.py',244),
-  ('args -> args COMMA expression','args',3,'p_expression_args','brewparse.py',252),
-  ('args -> expression','args',1,'p_expression_args','brewparse.py',253),
+  ('program -> structs funcs','program',2,'p_program','brewparse.py',60),
+  ('program -> funcs','program',1,'p_program','brewparse.py',61),
+  ('structs -> structs struct','structs',2,'p_structs','brewparse.py',68),
+  ('structs -> struct','structs',1,'p_structs','brewparse.py',69),
+  ('struct -> STRUCT NAME LBRACE fields RBRACE','struct',5,'p_struct','brewparse.py',73),
+  ('fields -> fields field','fields',2,'p_fields','brewparse.py',77),
+  ('fields -> field','fields',1,'p_fields','brewparse.py',78),
+  ('field -> NAME COLON NAME SEMI','field',4,'p_field','brewparse.py',82),
+  ('funcs -> funcs func','funcs',2,'p_funcs','brewparse.py',86),
+  ('funcs -> func','funcs',1,'p_funcs','brewparse.py',87),
+  ('func -> FUNC NAME LPAREN formal_args RPAREN COLON NAME LBRACE statements RBRACE','func',10,'p_func','brewparse.py',92),
+  ('func -> FUNC NAME LPAREN RPAREN COLON NAME LBRACE statements RBRACE','func',9,'p_func','brewparse.py',93),
+  ('func -> FUNC NAME LPAREN formal_args RPAREN LBRACE statements RBRACE','func',8,'p_func2','brewparse.py',100),
+  ('func -> FUNC NAME LPAREN RPAREN LBRACE statements RBRACE','func',7,'p_func2','brewparse.py',101),
+  ('formal_args -> formal_args COMMA formal_arg','formal_args',3,'p_formal_args','brewparse.py',108),
+  ('formal_args -> formal_arg','formal_args',1,'p_formal_args','brewparse.py',109),
+  ('formal_arg -> NAME COLON NAME','formal_arg',3,'p_formal_arg','brewparse.py',114),
+  ('formal_arg -> NAME','formal_arg',1,'p_formal_arg','brewparse.py',115),
+  ('statements -> statements statement','statements',2,'p_statements','brewparse.py',122),
+  ('statements -> statement','statements',1,'p_statements','brewparse.py',123),
+  ('statement -> assign SEMI','statement',2,'p_statement___assign','brewparse.py',128),
+  ('assign -> variable_w_dot ASSIGN expression','assign',3,'p_assign','brewparse.py',132),
+  ('statement -> VAR variable COLON NAME SEMI','statement',5,'p_statement___var','brewparse.py',136),
+  ('statement -> VAR variable SEMI','statement',3,'p_statement___var','brewparse.py',137),
+  ('variable -> NAME','variable',1,'p_variable','brewparse.py',144),
+  ('variable_w_dot -> variable_w_dot DOT NAME','variable_w_dot',3,'p_variable_w_dot','brewparse.py',149),
+  ('variable_w_dot -> NAME','variable_w_dot',1,'p_variable_w_dot','brewparse.py',150),
+  ('statement -> IF LPAREN expression RPAREN LBRACE statements RBRACE','statement',7,'p_statement_if','brewparse.py',166),
+  ('statement -> IF LPAREN expression RPAREN LBRACE statements RBRACE ELSE LBRACE statements RBRACE','statement',11,'p_statement_if','brewparse.py',167),
+  ('statement -> TRY LBRACE statements RBRACE catchers','statement',5,'p_statement_try','brewparse.py',183),
+  ('catchers -> catchers catch','catchers',2,'p_catches','brewparse.py',187),
+  ('catchers -> catch','catchers',1,'p_catches','brewparse.py',188),
+  ('catch -> CATCH STRING LBRACE statements RBRACE','catch',5,'p_catch','brewparse.py',192),
+  ('statement -> FOR LPAREN assign SEMI expression SEMI assign RPAREN LBRACE statements RBRACE','statement',11,'p_statement_for','brewparse.py',196),
+  ('statement -> RAISE expression SEMI','statement',3,'p_statement_raise','brewparse.py',200),
+  ('statement -> expression SEMI','statement',2,'p_statement_expr','brewparse.py',204),
+  ('statement -> RETURN expression SEMI','statement',3,'p_statement_return','brewparse.py',209),
+  ('statement -> RETURN SEMI','statement',2,'p_statement_return','brewparse.py',210),
+  ('expression -> NOT expression','expression',2,'p_expression_not','brewparse.py',219),
+  ('expression -> MINUS expression','expression',2,'p_expression_uminus','brewparse.py',224),
+  ('expression -> NEW NAME','expression',2,'p_expression_new','brewparse.py',228),
+  ('expression -> expression EQ expression','expression',3,'p_arith_expression_binop','brewparse.py',233),
+  ('expression -> expression GREATER expression','expression',3,'p_arith_expression_binop','brewparse.py',234),
+  ('expression -> expression LESS expression','expression',3,'p_arith_expression_binop','brewparse.py',235),
+  ('expression -> expression NOT_EQ expression','expression',3,'p_arith_expression_binop','brewparse.py',236),
+  ('expression -> expression GREATER_EQ expression','expression',3,'p_arith_expression_binop','brewparse.py',237),
+  ('expression -> expression LESS_EQ expression','expression',3,'p_arith_expression_binop','brewparse.py',238),
+  ('expression -> expression PLUS expression','expression',3,'p_arith_expression_binop','brewparse.py',239),
+  ('expression -> expression MINUS expression','expression',3,'p_arith_expression_binop','brewparse.py',240),
+  ('expression -> expression MULTIPLY expression','expression',3,'p_arith_expression_binop','brewparse.py',241),
+  ('expression -> expression DIVIDE expression','expression',3,'p_arith_expression_binop','brewparse.py',242),
+  ('expression -> LPAREN expression RPAREN','expression',3,'p_expression_group','brewparse.py',247),
+  ('expression -> expression OR expression','expression',3,'p_expression_and_or','brewparse.py',252),
+  ('expression -> expression AND expression','expression',3,'p_expression_and_or','brewparse.py',253),
+  ('expression -> NUMBER','expression',1,'p_expression_number','brewparse.py',258),
+  ('expression -> TRUE','expression',1,'p_expression_bool','brewparse.py',263),
+  ('expression -> FALSE','expression',1,'p_expression_bool','brewparse.py',264),
+  ('expression -> NIL','expression',1,'p_expression_nil','brewparse.py',270),
+  ('expression -> STRING','expression',1,'p_expression_string','brewparse.py',275),
+  ('expression -> variable_w_dot','expression',1,'p_expression_variable','brewparse.py',280),
+  ('expression -> NAME LPAREN args RPAREN','expression',4,'p_func_call','brewparse.py',285),
+  ('expression -> NAME LPAREN RPAREN','expression',3,'p_func_call','brewparse.py',286),
+  ('args -> args COMMA expression','args',3,'p_expression_args','brewparse.py',294),
+  ('args -> expression','args',1,'p_expression_args','brewparse.py',295),
 ]
@@ -0,0 +1,92 @@
+# Runs the Brewin programs under tests/ on every backend and checks each run
+# against the program's expected output.
+#
+# usage: python tests/run_backends.py [program.br ...]   (no arguments runs all)
+#
+# A program's expected output is the *OUT* block in the comment at its end, and
+# the lines it reads with inputi/inputs are in the *IN* block before it. When a
+# program stops on a Brewin error, the last expected line is the error type
+# (e.g. ErrorType.TYPE_ERROR); when the tree walker itself raises (e.g. integer
+# division by zero), it's the exception's class name, and every backend has to
+# raise the same one. Each program runs on tree, closure and vm, each plain,
+# with optimize, with the inliner, with both, and with a StructPool (alone and
+# with both).
+import contextlib
+import glob
+import io
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import brewinline
+import brewpool
+
+with contextlib.redirect_stdout(io.StringIO()):  # interpreterv3 runs a demo on import
+    import interpreterv3
+
+BACKENDS = ("tree", "closure", "vm")
+
+CONFIGS = {
+    "plain": lambda: {},
+    "optimize": lambda: {"optimize": True},
+    "inliner": lambda: {"inliner": brewinline.Inliner()},
+    "optimize+inliner": lambda: {"optimize": True, "inliner": brewinline.Inliner()},
+    "struct_pool": lambda: {"struct_pool": brewpool.StructPool()},
+    "optimize+inliner+struct_pool": lambda: {
+        "optimize": True, "inliner": brewinline.Inliner(), "struct_pool": brewpool.StructPool()
+    },
+}
+
+
+# the lines between the two occurrences of marker (e.g. *OUT*), or None
+def _block(source, marker):
+    parts = source.split(marker)
+    if len(parts) < 3:
+        return None
+    return parts[1].strip("\n").split("\n") if parts[1].strip("\n") else []
+
+
+def load_program(path):
+    with open(path) as f:
+        source = f.read()
+    expected = _block(source, "*OUT*")
+    if expected is None:
+        raise ValueError(f"{path} has no *OUT* block")
+    return source, _block(source, "*IN*") or [], expected
+
+
+def run_program(source, inp, backend, **kwargs):
+    interpreter = interpreterv3.Interpreter(console_output=False, inp=list(inp), **kwargs)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            interpreter.run(source, backend=backend)
+    except Exception as e:
+        if interpreter.error_type is not None:
+            return interpreter.get_output() + [str(interpreter.error_type)]
+        return interpreter.get_output() + [type(e).__name__]
+    return interpreter.get_output()
+
+
+def main(argv):
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    paths = argv or sorted(glob.glob(os.path.join(ROOT, "tests", "*", "*.br")))
+    runs = failures = 0
+    for path in paths:
+        source, inp, expected = load_program(path)
+        for backend in BACKENDS:
+            for config, make_kwargs in CONFIGS.items():
+                runs += 1
+                output = run_program(source, inp, backend, **make_kwargs())
+                if output != expected:
+                    failures += 1
+                    print(f"FAIL {os.path.relpath(path, ROOT)} [{backend}, {config}]")
+                    print(f"  expected: {expected}")
+                    print(f"  got:      {output}")
+    print(f"{len(paths)} programs, {runs} runs, {failures} failed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
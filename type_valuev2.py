@@ -10,8 +10,12 @@ class Type:
     VOID = "void"
 
 
-# Represents a value, which has a type and its value
+# Represents a value, which has a type and its value. Values are immutable: nothing
+# changes t or v after a Value is built, so one Value can be shared by every
+# variable, argument and struct field that holds it (and copying one is a no-op).
 class Value:
+    __slots__ = ("t", "v")
+
     def __init__(self, type, value=None):
         self.t = type
         self.v = value
@@ -22,20 +26,69 @@ class Value:
     def type(self):
         return self.t
 
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+# shared values for the results that don't depend on anything but their type
+TRUE = Value(Type.BOOL, True)
+FALSE = Value(Type.BOOL, False)
+NIL = Value(Type.NIL, None)
+VOID = Value(Type.VOID, None)
+ZERO = Value(Type.INT, 0)
+EMPTY_STRING = Value(Type.STRING, "")
+
+# ints in this range are built once; loop counters, indexes and small sums hit it
+SMALL_INT_MIN = -128
+SMALL_INT_MAX = 1024
+_SMALL_INTS = {n: Value(Type.INT, n) for n in range(SMALL_INT_MIN, SMALL_INT_MAX + 1)}
+_SMALL_INTS[0] = ZERO
+
+
+def int_value(n):
+    value = _SMALL_INTS.get(n)
+    if value is None:
+        return Value(Type.INT, n)
+    return value
+
+
+# b is normally True or False; anything else (an int that reached a bool
+# operator without being converted) keeps a Value of its own, as it always has
+def bool_value(b):
+    if b is True:
+        return TRUE
+    if b is False:
+        return FALSE
+    return Value(Type.BOOL, b)
+
+
+# the Value of a literal AST node's val, for an int, bool or string literal
+def literal_value(type, val):
+    if type == Type.INT:
+        return int_value(val)
+    if type == Type.BOOL:
+        return bool_value(val)
+    return Value(type, val)
+
 
 def create_value(val):
     if val == InterpreterBase.TRUE_DEF:
-        return Value(Type.BOOL, True)
+        return TRUE
     elif val == InterpreterBase.FALSE_DEF:
-        return Value(Type.BOOL, False)
+        return FALSE
     elif val == InterpreterBase.NIL_DEF:
-        return Value(Type.NIL, None)
+        return NIL
     elif val == InterpreterBase.VOID_DEF:
-        return Value(Type.VOID, None)
+        return VOID
     elif isinstance(val, str):
+        if val == "":
+            return EMPTY_STRING
         return Value(Type.STRING, val)
     elif isinstance(val, int):
-        return Value(Type.INT, val)
+        return int_value(val)
     else:
         raise ValueError("Unknown value type")
 